@@ -0,0 +1,145 @@
+import importlib
+import os
+
+import torch
+import torch.nn as nn
+
+# Backbone registry of train1.py / train2.py / save_features1.py: BACKBONES[name] says how to build
+# the network, and only its module is imported when it is built.
+#   family 'torchvision': fn(pretrained=bool); 'cadene': fn(num_classes=1000, pretrained='imagenet'|None)
+#   weights: loadW=ImageNet loads the fn's own weights, or weight_file into the randomly initialized
+#            net (a .pth.tar is the checkpoint['state_dict'] of a DataParallel model); fixed_weights
+#            ignores loadW; other loadW names are the SSL checkpoints of model_pytorch.Classifier_model.
+#   head: the attribute replaced by the 1-logit layer, its input are the save_features1.py features
+#   pooled: Cadene nets get features -> avg pool -> last_linear (their original wrappers)
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+WEIGHT_DIR = 'pretrain_model_weights'
+
+
+class Backbone(object):
+    def __init__(self, module, fn, family, feature_dim, head, head_type='linear', pooled=False, weight_file=None,
+                 fixed_weights=None, convert=None, ssl=False, input_size=224, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        self.module = module
+        self.fn = fn
+        self.family = family
+        self.feature_dim = feature_dim
+        self.head = head
+        self.head_type = head_type # linear | sequential: nn.Sequential(linear) | conv: 1x1 conv
+        self.pooled = pooled
+        self.weight_file = weight_file
+        self.fixed_weights = fixed_weights
+        self.convert = convert # 'module.function' applied before the weights are loaded
+        self.ssl = ssl
+        self.input_size = input_size # pretraining input: 3 x input_size^2, normalized with mean / std
+        self.mean = mean
+        self.std = std
+
+BACKBONES = {
+    'resnet18': Backbone('torchvision.models', 'resnet18', 'torchvision', 512, 'fc', ssl=True),
+    'resnet50': Backbone('torchvision.models', 'resnet50', 'torchvision', 2048, 'fc', ssl=True),
+    'resnet101': Backbone('resnet_copied', 'resnet101', 'torchvision', 2048, 'fc', weight_file='resnet101-63fe2227.pth', ssl=True),
+    'resnext50': Backbone('torchvision.models', 'resnext50_32x4d', 'torchvision', 2048, 'fc', head_type='sequential'),
+    'resnext101': Backbone('torchvision.models', 'resnext101_32x8d', 'torchvision', 2048, 'fc', head_type='sequential'),
+    'densenet121': Backbone('torchvision.models', 'densenet121', 'torchvision', 1024, 'classifier', ssl=True),
+    'vgg16': Backbone('torchvision.models', 'vgg16', 'torchvision', 25088, 'classifier'),
+    'drn_a_50': Backbone('drn_copiedModel', 'drn_a_50', 'torchvision', 2048, 'fc'),
+    'drn_d_54': Backbone('drn_copiedModel', 'drn_d_54', 'torchvision', 512, 'fc', head_type='conv'),
+    'seresnet50_manual': Backbone('torchvision.models', 'resnet50', 'torchvision', 2048, 'fc', convert='se_modules.convert_to_SE_ResNet50'),
+    'xception': Backbone('xception_copiedModel', 'xception', 'cadene', 2048, 'last_linear', head_type='sequential', input_size=299, mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5)),
+    'sexception': Backbone('xception_copiedModel', 'xception', 'cadene', 2048, 'last_linear', head_type='sequential', weight_file='sexception.pth.tar',
+                           convert='se_modules.convert_to_SE_Xception', input_size=299, mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5)),
+    'seresnet50': Backbone('pretrainedmodels.senet', 'se_resnet50', 'cadene', 2048, 'last_linear', pooled=True),
+    'seresnet101': Backbone('pretrainedmodels.senet', 'se_resnet101', 'cadene', 2048, 'last_linear', pooled=True, weight_file='se_resnet101-7e38fcc6.pth'),
+    'seresnext50': Backbone('pretrainedmodels.senet', 'se_resnext50_32x4d', 'cadene', 2048, 'last_linear', pooled=True, fixed_weights='ImageNet'),
+    'seresnext101': Backbone('pretrainedmodels.senet', 'se_resnext101_32x4d', 'cadene', 2048, 'last_linear', pooled=True),
+    'senet154': Backbone('pretrainedmodels.senet', 'se_resnext50_32x4d', 'cadene', 2048, 'last_linear', pooled=True, fixed_weights='Random'), # was always a random SE-ResNeXt50
+}
+
+
+class PooledClassifier(nn.Module):
+    # the seresnext50 / seresnet50 / ... wrappers of the training scripts, same state_dict keys
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+        self.avg_pool = nn.AdaptiveAvgPool2d(1)
+        self.last_linear = nn.Linear(net.last_linear.in_features, 1)
+    def forward(self, x):
+        x = self.net.features(x)
+        x = self.avg_pool(x)
+        x = x.view(x.size(0), -1)
+        x = self.last_linear(x)
+        return x
+
+class FeatureExtractor(nn.Module):
+    """(features, logits) of a registry model, features being the flattened input of its head."""
+    def __init__(self, model, head):
+        super().__init__()
+        self.model = model
+        self.head = head
+    def forward(self, x):
+        features = []
+        hook = self.head.register_forward_pre_hook(lambda module, inputs: features.append(inputs[0]))
+        try:
+            logits = self.model(x)
+        finally:
+            hook.remove()
+        return features[0].flatten(1), logits
+
+
+def load_function(path):
+    module, fn = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), fn)
+
+def strip_module_prefix(state_dict):
+    # keys of a DataParallel / DDP checkpoint without 'module.', other keys dropped
+    return {k[len('module.'):]: v for k, v in state_dict.items() if k.startswith('module.')}
+
+def new_head(spec):
+    if spec.head_type == 'conv':
+        return nn.Conv2d(spec.feature_dim, 1, kernel_size=(1, 1), stride=(1, 1))
+    if spec.head_type == 'sequential':
+        return nn.Sequential(nn.Linear(spec.feature_dim, 1))
+    return nn.Linear(spec.feature_dim, 1)
+
+def build_backbone(name, weights='ImageNet', weight_dir=WEIGHT_DIR):
+    """1-logit classifier `name` with loadW-style weights: ImageNet | Random | an SSL checkpoint name."""
+    if name not in BACKBONES:
+        raise ValueError("unknown backbone {}, expected one of {}".format(name, sorted(BACKBONES)))
+    spec = BACKBONES[name]
+    if spec.ssl and weights not in ('ImageNet', 'Random'):
+        from model_pytorch import Classifier_model # imports the SSL architectures, only on this path
+        model, _ = Classifier_model(name, 1, conv=None, weight=os.path.join(weight_dir, weights + '.pth.tar'), linear_classifier=False, sobel=False, activation=None)
+        return model
+    if weights not in ('ImageNet', 'Random'):
+        raise ValueError("loadW {} of backbone {}: expected ImageNet | Random{}".format(
+            weights, name, ' | an SSL checkpoint name' if spec.ssl else ''))
+    imagenet = (spec.fixed_weights or weights) == 'ImageNet'
+    from_fn = imagenet and spec.weight_file is None
+    fn = load_function(spec.module + '.' + spec.fn)
+    if spec.family == 'cadene':
+        net = fn(num_classes=1000, pretrained='imagenet' if from_fn else None)
+    else:
+        net = fn(pretrained=from_fn)
+    if spec.convert is not None:
+        net = load_function(spec.convert)(net)
+    if imagenet and spec.weight_file is not None:
+        state_dict = torch.load(os.path.join(weight_dir, spec.weight_file), map_location='cpu')
+        if spec.weight_file.endswith('.pth.tar'):
+            net.load_state_dict(strip_module_prefix(state_dict['state_dict']), strict=False)
+        else:
+            net.load_state_dict(state_dict)
+    if spec.pooled:
+        return PooledClassifier(net)
+    setattr(net, spec.head, new_head(spec))
+    return net
+
+def with_features(model, name):
+    # save_features1.py: the model returns (features, logits)
+    return FeatureExtractor(model, getattr(model, BACKBONES[name].head))
+
+def describe(name, weights='ImageNet'):
+    spec = BACKBONES[name]
+    return '{}: {}.{} ({} weights), {}-d features into {}, pretrained on 3x{}x{} mean {} std {}'.format(
+        name, spec.module, spec.fn, spec.fixed_weights or weights, spec.feature_dim, spec.head,
+        spec.input_size, spec.input_size, spec.mean, spec.std)
@@ -0,0 +1,87 @@
+import math
+
+import cv2
+import torch
+import torch.nn.functional as F
+
+# Whole-batch versions of the stage-1 albumentations pipeline, applied to an NCHW float32 tensor
+# (the channels_last view filled by PEDataset.load_batch). Same parameter ranges as
+#   RandomContrast(limit=0.2), ShiftScaleRotate(0.2, 0.2, 20, BORDER_CONSTANT),
+#   Cutout(num_holes=2, max_h_size=0.4*S, max_w_size=0.4*S, fill_value=0), Normalize(max_pixel_value=1.0)
+# with the random parameters drawn for the whole batch from torch's RNG, which DataLoader seeds per worker.
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def contrast_factors(n, limit=0.2):
+    # RandomContrast multiplies by alpha in [1-limit, 1+limit] and does not clip float images
+    return 1.0 + (torch.rand(n) * 2 - 1) * limit
+
+def shift_scale_rotate_matrix(angle, scale, dx, dy, height, width):
+    # cv2.getRotationMatrix2D((width/2, height/2), angle, scale) + (dx*width, dy*height), as (N, 3, 3) in pixel coordinates
+    a = scale * torch.cos(angle * math.pi / 180)
+    b = scale * torch.sin(angle * math.pi / 180)
+    cx, cy = width / 2, height / 2
+    m = torch.zeros(angle.shape[0], 3, 3, dtype=torch.float64)
+    m[:, 0, 0], m[:, 0, 1], m[:, 0, 2] = a, b, (1 - a) * cx - b * cy + dx * width
+    m[:, 1, 0], m[:, 1, 1], m[:, 1, 2] = -b, a, b * cx + (1 - a) * cy + dy * height
+    m[:, 2, 2] = 1
+    return m
+
+def shift_scale_rotate(x, shift_limit=0.2, scale_limit=0.2, rotate_limit=20):
+    # cv2.warpAffine(INTER_LINEAR, BORDER_CONSTANT=0) of every image
+    n, _, height, width = x.shape
+    uniform = lambda limit: (torch.rand(n, dtype=torch.float64) * 2 - 1) * limit
+    angle, scale, dx, dy = uniform(rotate_limit), 1 + uniform(scale_limit), uniform(shift_limit), uniform(shift_limit)
+    m = shift_scale_rotate_matrix(angle, scale, dx, dy, height, width)
+    if x.device.type == 'cpu' and x.permute(0, 2, 3, 1).is_contiguous():
+        # on CPU warpAffine into one NHWC buffer is ~4x faster than grid_sample
+        src = x.permute(0, 2, 3, 1).numpy()
+        out = torch.empty_like(x.permute(0, 2, 3, 1))
+        dst = out.numpy()
+        for k in range(n):
+            cv2.warpAffine(src[k], m[k, :2].numpy(), (width, height), dst=dst[k], flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        return out.permute(0, 3, 1, 2)
+    # one affine_grid/grid_sample; grid_sample maps output to input with pixel u <-> (2u+1)/size-1 (align_corners=False)
+    to_pixel = torch.tensor([[width / 2, 0, width / 2 - 0.5], [0, height / 2, height / 2 - 0.5], [0, 0, 1]], dtype=torch.float64)
+    theta = torch.linalg.inv(to_pixel) @ torch.linalg.inv(m) @ to_pixel
+    grid = F.affine_grid(theta[:, :2].to(x.device, x.dtype), list(x.shape), align_corners=False)
+    return F.grid_sample(x, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+
+def cutout_(x, num_holes=2, size=None, fill_value=0):
+    # size x size holes centered on random pixels, clipped to the image like albumentations Cutout
+    n, _, height, width = x.shape
+    for _ in range(num_holes):
+        y1 = (torch.randint(0, height + 1, (n,)) - size // 2).clamp(0, height).tolist()
+        x1 = (torch.randint(0, width + 1, (n,)) - size // 2).clamp(0, width).tolist()
+        for k in range(n):
+            x[k, :, y1[k]:y1[k]+size, x1[k]:x1[k]+size] = fill_value
+    return x
+
+def normalize_(x, mean=IMAGENET_MEAN, std=IMAGENET_STD, alpha=None):
+    # (alpha*x - mean) / std in place; alpha (N,) folds in RandomContrast, None => exactly transforms.Normalize
+    mean = torch.tensor(mean, device=x.device).view(1, -1, 1, 1)
+    std = torch.tensor(std, device=x.device).view(1, -1, 1, 1)
+    if alpha is None:
+        return x.sub_(mean).div_(std)
+    return x.mul_(alpha.to(x.device).view(-1, 1, 1, 1) / std).sub_(mean / std)
+
+def uint8_to_device(images, device, transform=None):
+    # uint8 batch from the DataLoader -> float32 [0, 1] on device -> transform (None: Normalize only)
+    x = images.to(device, non_blocking=True).float().div_(255.0)
+    return transform(x) if transform is not None else normalize_(x)
+
+
+class TrainBatchTransform(object):
+    """Batched train_transform of train1.py / train2.py.
+
+    Contrast is a per-image scale and warpAffine/Cutout are linear with zero fill, so the
+    contrast factor is applied in the Normalize pass instead of a separate pass over the batch.
+    """
+    def __init__(self, image_size):
+        self.cutout_size = int(0.4*image_size)
+    def __call__(self, x):
+        alpha = contrast_factors(x.shape[0], limit=0.2)
+        x = shift_scale_rotate(x, shift_limit=0.2, scale_limit=0.2, rotate_limit=20)
+        x = cutout_(x, num_holes=2, size=self.cutout_size, fill_value=0)
+        return normalize_(x, alpha=alpha)
@@ -0,0 +1,138 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import torch
+import torch.nn as nn
+from torch import optim
+
+from backbones import build_backbone, with_features
+from execution import Execution
+from precision import Precision
+
+# 1) Cold start of a training script's model: a fresh interpreter importing the model code and
+#    building one backbone with random weights (no download).
+#      legacy:   the old imports of train1/train2/save_features1, every pretrainedmodels architecture
+#                (its eager __init__) and torchvision.models, then the backbone
+#      registry: backbones.build_backbone, which imports the backbone's own module only
+# 2) CPU throughput of the --channels_last / --compile settings, same weights in each setting
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+LEGACY = '''
+import torch.nn as nn
+import torchvision.models as models
+import pretrainedmodels
+for name in pretrainedmodels.__all__:
+    getattr(pretrainedmodels, name)
+from backbones import build_backbone
+build_backbone({name!r}, 'Random')
+'''
+REGISTRY = '''
+import sys
+from backbones import build_backbone
+build_backbone({name!r}, 'Random')
+print(sorted(m for m in sys.modules if m.startswith('pretrainedmodels.')))
+'''
+SETTINGS = (('eager', Execution()), ('channels_last', Execution(channels_last=1)),
+            ('compiled', Execution(channels_last=1, compile='default')))
+
+
+def cold_start(code, name):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-W', 'ignore', '-c', code.format(name=name)], cwd=HERE,
+                         check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return time.perf_counter()-start, out.strip()
+
+def bench_cold_start(names, repeats):
+    cold_start('import torch', '') # warm the page cache
+    for name in names:
+        legacy = min(cold_start(LEGACY, name)[0] for _ in range(repeats))
+        runs = [cold_start(REGISTRY, name) for _ in range(repeats)]
+        registry = min(t for t, _ in runs)
+        loaded = runs[0][1]
+        # only the module of the backbone, e.g. pretrainedmodels.senet for the SE nets
+        assert 'pretrainedmodels.resnext' not in loaded or name.startswith('resnext'), (name, loaded)
+        print("{}: legacy {:.2f} s, registry {:.2f} s ({:.2f}x), pretrainedmodels modules {}".format(
+            name, legacy, registry, legacy/registry, loaded))
+
+
+def train_steps(model, execution, precision, images, labels, steps):
+    optimizer = optim.Adam(model.parameters(), lr=0.0004)
+    criterion = nn.BCEWithLogitsLoss()
+    model.train()
+    for step in range(steps+1): # step 0: the first step after the warmup, still slower
+        if step == 1:
+            start = time.perf_counter()
+        with precision.autocast():
+            logits = model(execution.inputs(images))[-1]
+        loss = criterion(logits.float().view(-1), labels)
+        loss.item()
+        optimizer.zero_grad()
+        precision.backward(loss)
+        precision.step(optimizer)
+    return (time.perf_counter()-start)/steps
+
+def eval_steps(model, execution, precision, images, steps):
+    model.eval()
+    with torch.no_grad():
+        for step in range(steps+1):
+            if step == 1:
+                start = time.perf_counter()
+            with precision.autocast():
+                features = model(execution.inputs(images))[0].float()
+    return (time.perf_counter()-start)/steps, features
+
+def bench_throughput(names, args):
+    precision = Precision('fp32', 'cpu')
+    torch.manual_seed(0)
+    images = torch.randn(args.BS, 3, args.imgSize, args.imgSize)
+    labels = (torch.rand(args.BS) > 0.5).float()
+    shape = tuple(images.shape)
+    print("CPU threads: {}, batch {} x 3 x {}^2, img/s over {} steps".format(torch.get_num_threads(), args.BS, args.imgSize, args.steps))
+    print("{:<14} {:<14} {:>10} {:>10} {:>12} {:>12}".format('backbone', 'setting', 'train', 'eval', 'warmup (s)', 'features'))
+    for name in names:
+        state = build_backbone(name, 'Random').state_dict()
+        reference = None
+        for setting, execution in SETTINGS:
+            model = build_backbone(name, 'Random')
+            model.load_state_dict(state)
+            model = execution.prepare(with_features(model, name)) # (features, logits) as in save_features1.py
+            warmup = execution.warmup(model, shape, 'cpu', precision, train=False)
+            t_eval, features = eval_steps(model, execution, precision, images, args.steps)
+            warmup += execution.warmup(model, shape, 'cpu', precision, train=True)
+            t_train = train_steps(model, execution, precision, images, labels, args.steps)
+            if reference is None:
+                reference, gap = features, 0.0
+            else:
+                gap = ((features-reference).norm()/reference.norm()).item()
+                # same fp32 math in another layout / fused: the features agree to rounding
+                assert gap < 1e-3, (name, setting, gap)
+            print("{:<14} {:<14} {:>10.2f} {:>10.2f} {:>12.1f} {:>12.1e}".format(
+                name, setting, args.BS/t_train, args.BS/t_eval, warmup, gap), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backbones", type=str, nargs='+', default=["senet154", "xception", "sexception", "resnet50", "densenet121"],
+                        help="names of backbones.BACKBONES without fixed ImageNet weights (no download); senet154 is a random SE-ResNeXt50")
+    parser.add_argument("--cold_start", type=int, default=1, help="1: time the model imports in fresh interpreters | 0: off")
+    parser.add_argument("--repeats", type=int, default=3, help="fresh interpreters per setting, the fastest is kept")
+    parser.add_argument("--throughput", type=int, default=1, help="1: eager vs channels_last vs compiled img/s table | 0: off")
+    parser.add_argument("--BS", type=int, default=4, help="BatchSize")
+    parser.add_argument("--imgSize", type=int, default=224, help="ImageSize (576 in training)")
+    parser.add_argument("--steps", type=int, default=3, help="timed steps per setting")
+    parser.add_argument("--threads", type=int, default=0, help="torch CPU threads | 0: torch default")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    if args.cold_start:
+        bench_cold_start(args.backbones, args.repeats)
+    if args.throughput:
+        bench_throughput(args.backbones, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from batch_transforms import TrainBatchTransform
+from bench_windowing import synthetic_slice
+from pe_dataset import PEDataset_val, PEDataset_val_batch, PEDataset_batch
+
+
+class SyntheticSlices(object):
+    """In-memory stand-in for VolumeCache, so only the preprocessing is timed"""
+    def __init__(self, slices):
+        self.slices = slices
+    def read_slice(self, image_id):
+        return self.slices[image_id]
+    def read_triplet(self, *image_ids):
+        return [self.slices[image_id] for image_id in image_ids]
+
+def train_transform_reference(x, image_size, rng):
+    # per-sample numpy/cv2 version of the train1.py albumentations pipeline
+    x = x * rng.uniform(0.8, 1.2)
+    h, w = x.shape[:2]
+    m = cv2.getRotationMatrix2D((w/2, h/2), rng.uniform(-20, 20), rng.uniform(0.8, 1.2))
+    m[0, 2] += rng.uniform(-0.2, 0.2)*w
+    m[1, 2] += rng.uniform(-0.2, 0.2)*h
+    x = cv2.warpAffine(x, m, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    size = int(0.4*image_size)
+    for _ in range(2):
+        y1, x1 = np.clip(rng.integers(0, h+1)-size//2, 0, h), np.clip(rng.integers(0, w+1)-size//2, 0, w)
+        x[y1:y1+size, x1:x1+size] = 0
+    x = (x - np.array([0.485, 0.456, 0.406], dtype=np.float32)) / np.array([0.229, 0.224, 0.225], dtype=np.float32)
+    return x.transpose(2, 0, 1)
+
+def timeit(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter()-start)/repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=512, help="slice size")
+    parser.add_argument("--imgSize", type=int, default=576, help="ImageSize")
+    parser.add_argument("--BS", type=int, default=20, help="BatchSize")
+    parser.add_argument("--repeat", type=int, default=5, help="timed batches")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1) # one DataLoader worker
+    rng = np.random.default_rng(0)
+    num_images = args.BS+2
+    slices = {'img{}'.format(k): (synthetic_slice(rng, args.size, np.int16), 1.0, -1024.0) for k in range(num_images)}
+    image_dict = {'img{}'.format(k): {'series_id': 'study_series', 'image_minus1': 'img{}'.format(max(k-1, 0)),
+                                      'image_plus1': 'img{}'.format(min(k+1, num_images-1)), 'pe_present_on_image': k % 2} for k in range(num_images)}
+    kwargs = dict(image_dict=image_dict, bbox_dict={'study_series': [56, 100, 456, 400]}, image_list=list(image_dict.keys()),
+                  target_size=args.imgSize, volume_cache=SyntheticSlices(slices))
+    indices = list(range(args.BS))
+
+    val, val_batch = PEDataset_val(**kwargs), PEDataset_val_batch(**kwargs)
+    assert torch.equal(torch.stack([val[i][0] for i in indices]), val_batch.__getitems__(indices)[0])
+    t_val = timeit(lambda: torch.utils.data.default_collate([val[i] for i in indices]), args.repeat)
+    t_val_batch = timeit(lambda: val_batch.__getitems__(indices), args.repeat)
+    print("validation, batch of {}:".format(args.BS))
+    print("  per sample ToTensor+Normalize: {:.1f} samples/s".format(args.BS/t_val))
+    print("  __getitems__                 : {:.1f} samples/s ({:.2f}x)".format(args.BS/t_val_batch, t_val/t_val_batch))
+
+    train = PEDataset_val(**kwargs)
+    train_batch = PEDataset_batch(transform=TrainBatchTransform(args.imgSize), **kwargs)
+    t_train = timeit(lambda: torch.utils.data.default_collate([(train_transform_reference(train.load_image(i), args.imgSize, rng), 0) for i in indices]), args.repeat)
+    t_train_batch = timeit(lambda: train_batch.__getitems__(indices), args.repeat)
+    print("training augmentation, batch of {}:".format(args.BS))
+    print("  per sample cv2/numpy         : {:.1f} samples/s".format(args.BS/t_train))
+    print("  __getitems__ + batch ops     : {:.1f} samples/s ({:.2f}x)".format(args.BS/t_train_batch, t_train/t_train_batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from pydicom.uid import ExplicitVRLittleEndian
+
+from bench_decode import ct_dataset
+from chunk_store import ChunkStore, build_chunk_store, zstandard
+from pe_dataset import read_dicom_slice
+from volume_cache import VolumeCache, build_volume_cache
+
+
+def phantom_slice(rng, size, z):
+    # stored values (RescaleIntercept=-1024) of a chest CT slice: air, body, lungs, vessels, spine, scanner noise
+    x = np.zeros((size, size), dtype=np.float32)
+    c = size//2
+    cv2.ellipse(x, (c, c), (int(0.42*size), int(0.30*size)), 0, 0, 360, 1064, -1)
+    for side in (-1, 1):
+        cv2.ellipse(x, (c+side*int(0.17*size), c-int(0.02*size)), (int(0.13*size), int(0.2*size)), 0, 0, 360, 174, -1)
+    for _ in range(40):
+        cv2.circle(x, tuple(int(v) for v in rng.integers(int(0.2*size), int(0.8*size), 2)), int(rng.integers(1, 6)), 1064, -1)
+    cv2.circle(x, (c+int(0.02*size*np.sin(z/7)), c+int(0.22*size)), int(0.05*size), 2024, -1)
+    x = cv2.GaussianBlur(x, (5, 5), 1.5)
+    x[x > 0] += rng.normal(0, 12, int((x > 0).sum()))
+    return np.clip(x, 0, 4095).astype(np.int16)
+
+def write_synthetic_dataset(data_dir, num_series, slices_per_series, size, rng):
+    # data_dir/<study>/<series>/<image>.dcm like the RSNA PE train directory, uncompressed
+    series_dict = {}
+    for s in range(num_series):
+        study, series = 'study{}'.format(s), 'series{}'.format(s)
+        os.makedirs(os.path.join(data_dir, study, series))
+        images = ['s{}_img{:04d}'.format(s, k) for k in range(slices_per_series)]
+        for k, image_id in enumerate(images):
+            pixels = phantom_slice(rng, size, k)
+            ds = ct_dataset(pixels, signed=True)
+            ds.RescaleIntercept = -1024
+            ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+            ds.PixelData = pixels.tobytes()
+            ds.save_as(os.path.join(data_dir, study, series, image_id+'.dcm'), enforce_file_format=True)
+        series_dict[study+'_'+series] = {'sorted_image_list': images}
+    return series_dict
+
+def directory_mb(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)/2**20
+
+def triplet_latency(read_triplet, triplets, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for triplet in triplets:
+            read_triplet(triplet)
+    return (time.perf_counter()-start)/(repeat*len(triplets))*1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--series", type=int, default=4, help="synthetic series")
+    parser.add_argument("--slices", type=int, default=64, help="slices per series")
+    parser.add_argument("--size", type=int, default=512, help="slice size")
+    parser.add_argument("--reads", type=int, default=200, help="random triplets to read")
+    parser.add_argument("--threads", type=int, default=3, help="ChunkStore decompression threads")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, 'dicom')+'/'
+        series_dict = write_synthetic_dataset(data_dir, args.series, args.slices, args.size, rng)
+        series_list = sorted(series_dict.keys())
+        all_images = [(series_id, k) for series_id in series_list for k in range(1, args.slices-1)]
+        picks = [all_images[i] for i in rng.integers(0, len(all_images), args.reads)]
+        triplet_ids = [[series_dict[s]['sorted_image_list'][k+d] for d in (-1, 0, 1)] for s, k in picks]
+        raw_mb = args.series*args.slices*args.size*args.size*2/2**20
+        print("{} series x {} slices of {}x{} int16, {:.1f} MB of pixels".format(args.series, args.slices, args.size, args.size, raw_mb))
+
+        def dicom_triplet(ids):
+            return [read_dicom_slice(data_dir+'study{0}/series{0}/'.format(i.split('_')[0][1:])+i+'.dcm') for i in ids]
+        print("  {:24s}: {:6.1f} MB ({:4.2f}x), {:6.2f} ms / random triplet".format("raw DICOM", directory_mb(data_dir), raw_mb/directory_mb(data_dir), triplet_latency(dicom_triplet, triplet_ids)))
+
+        build_volume_cache(series_dict, series_list, os.path.join(tmp, 'volumes'), data_dir=data_dir, num_workers=2)
+        volumes = VolumeCache(os.path.join(tmp, 'volumes'))
+        t = triplet_latency(lambda ids: [np.array(x) for x, _, _ in volumes.read_triplet(*ids)], triplet_ids)
+        print("  {:24s}: {:6.1f} MB ({:4.2f}x), {:6.2f} ms / random triplet".format("VolumeCache .npy", directory_mb(os.path.join(tmp, 'volumes')), raw_mb/directory_mb(os.path.join(tmp, 'volumes')), t))
+
+        reference = [[x for x, _, _ in volumes.read_triplet(*ids)] for ids in triplet_ids[:10]]
+        for codec, level in [('zlib', 1), ('zlib', 6)] + ([('zstd', 1), ('zstd', 3), ('zstd', 9)] if zstandard is not None else []):
+            store_dir = os.path.join(tmp, 'chunks_{}_{}'.format(codec, level))
+            build_chunk_store(series_dict, series_list, store_dir, data_dir=data_dir, codec=codec, level=level, num_workers=2)
+            mb = directory_mb(store_dir)
+            for threads in (0, args.threads):
+                store = ChunkStore(store_dir, threads=threads)
+                for ids, r in zip(triplet_ids, reference):
+                    assert all(np.array_equal(x, y) for (x, _, _), y in zip(store.read_triplet(*ids), r))
+                t = triplet_latency(lambda ids: store.read_triplet(*ids), triplet_ids)
+                name = "ChunkStore {} {}, {} thr".format(codec, level, threads)
+                print("  {:24s}: {:6.1f} MB ({:4.2f}x), {:6.2f} ms / random triplet".format(name, mb, raw_mb/mb, t))
+
+
+if __name__ == "__main__":
+    main()
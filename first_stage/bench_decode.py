@@ -0,0 +1,93 @@
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pydicom
+from PIL import Image
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, JPEG2000Lossless, RLELossless, generate_uid
+
+from bench_windowing import synthetic_slice
+from dicom_decode import DicomDecoder
+from pe_dataset import read_dicom_slice
+
+
+def ct_dataset(pixels, signed):
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = CTImageStorage
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.Rows, ds.Columns = pixels.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+    ds.PixelRepresentation = int(signed)
+    ds.RescaleSlope, ds.RescaleIntercept = 1, 0 if signed else -1024
+    return ds
+
+def write_series(directory, transfer_syntax, slices, signed=False):
+    # one single-frame CT file per slice, 12-bit stored values
+    paths = []
+    for k, pixels in enumerate(slices):
+        ds = ct_dataset(pixels, signed)
+        if transfer_syntax == JPEG2000Lossless:
+            buffer = io.BytesIO()
+            Image.fromarray(pixels).save(buffer, format='JPEG2000', irreversible=False, no_jp2=True)
+            ds.file_meta.TransferSyntaxUID = transfer_syntax
+            ds.PixelData = encapsulate([buffer.getvalue()])
+            ds['PixelData'].VR = 'OB'
+        elif transfer_syntax == RLELossless:
+            ds.compress(RLELossless, pixels)
+        else:
+            ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+            ds.PixelData = pixels.tobytes()
+        paths.append(os.path.join(directory, '{}_{:04d}.dcm'.format(transfer_syntax, k)))
+        ds.save_as(paths[-1], enforce_file_format=True)
+    return paths
+
+def timeit(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter()-start)/repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=512, help="slice size")
+    parser.add_argument("--slices", type=int, default=24, help="slices per synthetic series (one batch of triplets)")
+    parser.add_argument("--threads", type=int, nargs='+', default=[2, 4, 8], help="decode thread pool sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes over the series")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    unsigned = [synthetic_slice(rng, args.size, np.uint16) for _ in range(args.slices)]
+    signed = [(x.astype(np.int16)-1024) for x in unsigned]
+    print("backends:", DicomDecoder('auto').describe())
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, paths in (("JPEG 2000 lossless", write_series(tmp, JPEG2000Lossless, unsigned)),
+                            ("RLE lossless", write_series(tmp, RLELossless, unsigned)),
+                            ("RLE lossless, signed", write_series(tmp, RLELossless, signed, signed=True)),
+                            ("uncompressed", write_series(tmp, ExplicitVRLittleEndian, unsigned))):
+            reference = [read_dicom_slice(path)[0] for path in paths]
+            for threads in [0]+args.threads:
+                decoded = DicomDecoder('auto', threads=threads).read_batch(paths)
+                assert all(np.array_equal(x, r) and x.dtype == r.dtype for (x, _, _), r in zip(decoded, reference)), (name, threads)
+            print("{}, {} slices, {:.1f} MB on disk:".format(name, len(paths), sum(os.path.getsize(p) for p in paths)/2**20))
+            t_pydicom = timeit(lambda: [read_dicom_slice(path) for path in paths], args.repeat)
+            print("  pydicom pixel_array : {:7.1f} slices/s".format(len(paths)/t_pydicom))
+            for threads in [0]+args.threads:
+                decoder = DicomDecoder('auto', threads=threads)
+                t = timeit(lambda: decoder.read_batch(paths), args.repeat)
+                print("  auto, {} threads     : {:7.1f} slices/s ({:.2f}x)".format(threads, len(paths)/t, t_pydicom/t))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from bench_batch_fetch import SyntheticSlices
+from bench_windowing import synthetic_slice
+from pe_dataset import PEDataset
+from windowing import window
+
+# Bytes written and time per sample of the float64 reference pipeline vs the float32 policy; the
+# dtype of every stage is checked by tests/test_dtype_policy.py
+
+def reference_stages(slices, bbox, size):
+    # the original float64 pipeline: x*RescaleSlope+RescaleIntercept, window(), concatenate, crop, resize
+    rescaled = [pixels*slope+intercept for pixels, slope, intercept in slices]
+    windowed = [window(x, WL=100, WW=700) for x in rescaled]
+    x = np.concatenate([np.expand_dims(w, axis=2) for w in windowed], axis=2)
+    crop = x[bbox[1]:bbox[3],bbox[0]:bbox[2],:]
+    resized = cv2.resize(crop, (size, size))
+    return [("rescale", rescaled), ("window", windowed), ("concat", [x]), ("resize", [resized])]
+
+def policy_stages(dataset, index):
+    triplet = dataset.load_triplet(index)
+    crop = dataset.load_crop(index, triplet)
+    resized = cv2.resize(crop, (dataset.target_size, dataset.target_size))
+    return [("crop+rescale+window", [crop]), ("resize", [resized])]
+
+def timeit(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter()-start)/repeat*1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=512, help="slice size")
+    parser.add_argument("--imgSize", type=int, default=576, help="ImageSize")
+    parser.add_argument("--bbox", type=int, nargs=4, default=[56, 100, 456, 400], help="lung bbox x0 y0 x1 y1")
+    parser.add_argument("--repeat", type=int, default=50, help="timed samples")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # int16 goes through the window table, int32 through the window() fallback
+    slices = {'img{}'.format(k): (synthetic_slice(rng, args.size, np.int16 if k < 3 else np.int32), 1.0, -1024.0) for k in range(6)}
+    image_dict = {'img{}'.format(k): {'series_id': 'study_series', 'image_minus1': 'img{}'.format(3*(k//3)),
+                                      'image_plus1': 'img{}'.format(3*(k//3)+2), 'pe_present_on_image': 0} for k in range(6)}
+    kwargs = dict(image_dict=image_dict, bbox_dict={'study_series': args.bbox}, image_list=list(image_dict.keys()),
+                  target_size=args.imgSize, volume_cache=SyntheticSlices(slices))
+
+    triplet = [slices['img{}'.format(k)] for k in range(3)]
+    reference = reference_stages(triplet, args.bbox, args.imgSize)
+    dataset = PEDataset(transform=None, **kwargs)
+    assert np.allclose(reference[-1][1][0], dataset.load_image(1), rtol=0, atol=1e-5)
+    print("per sample, bytes written by each stage:")
+    for stage, arrays in reference:
+        print("  float64 {:20s}: {:6.2f} MB {}".format(stage, sum(x.nbytes for x in arrays)/2**20, arrays[0].dtype))
+    for uint8 in (False, True):
+        dataset = PEDataset(transform=None, uint8=uint8, **kwargs)
+        for stage, arrays in policy_stages(dataset, 1):
+            print("  policy  {:20s}: {:6.2f} MB {}".format(stage, sum(x.nbytes for x in arrays)/2**20, arrays[0].dtype))
+    total_reference = sum(x.nbytes for _, arrays in reference for x in arrays)
+    dataset = PEDataset(transform=None, **kwargs)
+    total_policy = sum(x.nbytes for _, arrays in policy_stages(dataset, 1) for x in arrays)
+    print("  total: float64 {:.2f} MB, float32 policy {:.2f} MB ({:.1f}x less)".format(total_reference/2**20, total_policy/2**20, total_reference/total_policy))
+
+    t_reference = timeit(lambda: reference_stages(triplet, args.bbox, args.imgSize), args.repeat)
+    t_policy = timeit(lambda: dataset.load_image(1), args.repeat)
+    t_fallback = timeit(lambda: dataset.load_image(4), args.repeat)
+    print("time per sample: float64 {:.2f} ms, float32 table {:.2f} ms, float32 window() fallback {:.2f} ms".format(t_reference, t_policy, t_fallback))
+
+
+if __name__ == "__main__":
+    main()
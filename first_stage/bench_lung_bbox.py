@@ -0,0 +1,39 @@
+import argparse
+import time
+
+import numpy as np
+
+from bench_chunk_store import phantom_slice
+from lung_bbox import series_bbox
+
+
+def phantom_lungs(size, margin):
+    # the two lung ellipses drawn by phantom_slice, plus the margin
+    c = size//2
+    x0, x1 = c-int(0.17*size)-int(0.13*size), c+int(0.17*size)+int(0.13*size)
+    y0, y1 = c-int(0.02*size)-int(0.2*size), c-int(0.02*size)+int(0.2*size)
+    return [x0-margin, y0-margin, x1+margin+1, y1+margin+1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=512, help="slice size")
+    parser.add_argument("--slices", type=int, default=256, help="slices per series")
+    parser.add_argument("--margin", type=int, default=16, help="pixels added around the lungs")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    slices = [(phantom_slice(rng, args.size, z), 1.0, -1024.0) for z in range(args.slices)]
+    expected = phantom_lungs(args.size, args.margin)
+    print("{} slices of {}x{}, lungs + margin {}".format(args.slices, args.size, args.size, expected))
+    for stride in (2, 4, 8):
+        start = time.perf_counter()
+        bbox = series_bbox(slices, stride=stride, margin=args.margin)
+        elapsed = time.perf_counter()-start
+        error = max(abs(a-b) for a, b in zip(bbox, expected))
+        print("  stride {}: {} in {:.3f} s per series ({:.2f} ms / slice), max edge error {} px".format(stride, bbox, elapsed, elapsed/args.slices*1000, error))
+        assert error <= stride+1, (bbox, expected)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+from metadata_store import MetadataStore, build_metadata_store, load_pickle
+
+SERIES_LABELS = ['negative_exam_for_pe', 'indeterminate', 'chronic_pe', 'acute_and_chronic_pe', 'central_pe',
+                 'leftsided_pe', 'rightsided_pe', 'rv_lv_ratio_gte_1', 'rv_lv_ratio_lt_1']
+
+
+def uid(rng):
+    # DICOM UIDs are ~60 character dotted numbers
+    return '1.2.826.0.1.3680043.8.498.' + '.'.join(str(v) for v in rng.integers(0, 2**31, 3))
+
+def synthetic_metadata(rng, num_series, slices_per_series):
+    image_dict, series_dict, bbox_dict = {}, {}, {}
+    for _ in range(num_series):
+        series_id = uid(rng)+'_'+uid(rng)
+        images = [uid(rng) for _ in range(slices_per_series)]
+        for k, image_id in enumerate(images):
+            image_dict[image_id] = {'series_id': series_id,
+                                    'image_minus1': images[max(k-1, 0)],
+                                    'image_plus1': images[min(k+1, len(images)-1)],
+                                    'pe_present_on_image': int(rng.random() < 0.05)}
+        series_dict[series_id] = {'sorted_image_list': images}
+        series_dict[series_id].update({label: int(rng.random() < 0.3) for label in SERIES_LABELS})
+        bbox_dict[series_id] = [int(v) for v in rng.integers(0, 200, 2)] + [int(v) for v in rng.integers(300, 512, 2)]
+    series_list = list(series_dict.keys())
+    split = len(series_list)*4//5
+    image_lists = [[i for s in series_list[:split] for i in series_dict[s]['sorted_image_list']],
+                   [i for s in series_list[split:] for i in series_dict[s]['sorted_image_list']]]
+    return {'image_dict': image_dict, 'series_dict': series_dict,
+            'image_list_train': image_lists[0], 'image_list_valid': image_lists[1],
+            'series_list_train': series_list[:split], 'series_list_valid': series_list[split:],
+            'bbox_dict_train': {s: bbox_dict[s] for s in series_list[:split]},
+            'bbox_dict_valid': {s: bbox_dict[s] for s in series_list[split:]}}
+
+def startup(paths, store):
+    # what a script does before training: load everything, then touch one sample
+    start = time.perf_counter()
+    objects = {name: load_pickle(path, store) for name, path in paths.items()}
+    opened = time.perf_counter()-start
+    image_id = objects['image_list_train'][len(objects['image_list_train'])//2]
+    record = objects['image_dict'][image_id]
+    series = objects['series_dict'][record['series_id']]
+    bbox = objects['bbox_dict_train'][record['series_id']]
+    first = time.perf_counter()-start
+    return objects, opened, first, (record['image_minus1'], record['pe_present_on_image'], series['sorted_image_list'][0], series['central_pe'], bbox)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--series", type=int, default=2000, help="number of synthetic series (7279 in the RSNA PE train set)")
+    parser.add_argument("--slices", type=int, default=240, help="slices per series")
+    parser.add_argument("--lookups", type=int, default=100000, help="random image_dict lookups to time")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    objects = synthetic_metadata(rng, args.series, args.slices)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {}
+        for name, obj in objects.items():
+            paths[name] = os.path.join(tmp, name+'.pickle')
+            with open(paths[name], 'wb') as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        start = time.perf_counter()
+        build_metadata_store(list(paths.values()), os.path.join(tmp, 'metadata'))
+        print("images {} series {}, conversion {:.2f} s".format(len(objects['image_dict']), len(objects['series_dict']), time.perf_counter()-start))
+        pickle_mb = sum(os.path.getsize(p) for p in paths.values())/2**20
+        store_mb = sum(os.path.getsize(os.path.join(tmp, 'metadata', f)) for f in os.listdir(os.path.join(tmp, 'metadata')))/2**20
+        print("on disk: pickle {:.1f} MB, store {:.1f} MB".format(pickle_mb, store_mb))
+
+        loaded, t_pickle, t_pickle_first, sample_pickle = startup(paths, None)
+        store = MetadataStore(os.path.join(tmp, 'metadata'))
+        opened, t_store, t_store_first, sample_store = startup(paths, store)
+        assert sample_pickle == sample_store, (sample_pickle, sample_store)
+        print("startup pickle: {:.3f} s load, {:.3f} s to first sample".format(t_pickle, t_pickle_first))
+        print("startup store : {:.3f} s open, {:.3f} s to first sample ({:.0f}x)".format(t_store, t_store_first, t_pickle_first/t_store_first))
+
+        keys = [loaded['image_list_train'][k] for k in rng.integers(0, len(loaded['image_list_train']), args.lookups)]
+        for name, image_dict in (("pickle", loaded['image_dict']), ("store ", opened['image_dict'])):
+            start = time.perf_counter()
+            for image_id in keys:
+                image_dict[image_id]['image_minus1']
+            print("image_dict[id]['image_minus1'] {}: {:.2f} us".format(name, (time.perf_counter()-start)/args.lookups*1e6))
+
+
+if __name__ == "__main__":
+    main()
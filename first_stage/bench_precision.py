@@ -0,0 +1,100 @@
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+from torch import optim
+
+from precision import Precision, to_float32
+from pretrainedmodels.senet import se_resnext50_32x4d
+from xception_copiedModel import xception
+
+
+class seresnext50(nn.Module):
+    # train2.py's seresnext50 with random weights
+    def __init__(self):
+        super().__init__()
+        self.net = se_resnext50_32x4d(num_classes=1000, pretrained=None)
+        self.avg_pool = nn.AdaptiveAvgPool2d(1)
+        self.last_linear = nn.Linear(self.net.last_linear.in_features, 1)
+    def forward(self, x):
+        x = self.avg_pool(self.net.features(x))
+        return self.last_linear(x.view(x.size(0), -1))
+
+def build_xception():
+    # train2.py's xception with random weights
+    model = xception(num_classes=1000, pretrained=None)
+    model.last_linear = nn.Sequential(nn.Linear(model.last_linear.in_features, 1))
+    return model
+
+BACKBONES = {'seresnext50': seresnext50, 'xception': build_xception}
+
+
+def train_steps(model, precision, images, labels, steps):
+    optimizer = optim.Adam(model.parameters(), lr=0.0004)
+    criterion = nn.BCEWithLogitsLoss()
+    model.train()
+    start = 0
+    for step in range(steps+1): # step 0 warms up the kernels
+        if step == 1:
+            start = time.perf_counter()
+        with precision.autocast():
+            logits = to_float32(model(images))
+        loss = criterion(logits.view(-1), labels)
+        loss.item()
+        optimizer.zero_grad()
+        precision.backward(loss)
+        precision.step(optimizer)
+    return (time.perf_counter()-start)/steps
+
+def eval_features(model, precision, images, steps):
+    # the logits of a random head barely move off its bias, so the pooled features entering it are compared
+    features = []
+    head = [m for m in model.modules() if isinstance(m, nn.Linear)][-1]
+    hook = head.register_forward_pre_hook(lambda module, inputs: features.append(inputs[0].float()))
+    model.eval()
+    with torch.no_grad():
+        for step in range(steps+1):
+            if step == 1:
+                start = time.perf_counter()
+            with precision.autocast():
+                to_float32(model(images))
+    hook.remove()
+    return (time.perf_counter()-start)/steps, features[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backbones", type=str, nargs='+', default=["seresnext50", "xception"], help="seresnext50 | xception")
+    parser.add_argument("--BS", type=int, default=8, help="BatchSize")
+    parser.add_argument("--imgSize", type=int, default=256, help="ImageSize")
+    parser.add_argument("--steps", type=int, default=3, help="timed steps per setting")
+    parser.add_argument("--threads", type=int, default=0, help="torch CPU threads | 0: torch default")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    print("CPU threads: {}, batch {} x 3 x {}^2".format(torch.get_num_threads(), args.BS, args.imgSize))
+    torch.manual_seed(0)
+    images = torch.randn(args.BS, 3, args.imgSize, args.imgSize)
+    labels = (torch.rand(args.BS) > 0.5).float()
+    for name in args.backbones:
+        state = BACKBONES[name]().state_dict()
+        times, features = {}, {}
+        for setting in ('fp32', 'bf16'):
+            precision = Precision(setting, 'cpu')
+            model = BACKBONES[name]()
+            model.load_state_dict(state)
+            t_eval, features[setting] = eval_features(model, precision, images, args.steps)
+            t_train = train_steps(model, precision, images, labels, args.steps)
+            times[setting] = (t_train, t_eval)
+            print("{} {}: train {:.1f} img/s, eval {:.1f} img/s".format(name, setting, args.BS/t_train, args.BS/t_eval))
+        gap = ((features['bf16']-features['fp32']).norm()/features['fp32'].norm()).item()
+        # bf16 keeps 8 mantissa bits: the features move by about a percent, not more
+        assert gap < 0.05, (name, gap)
+        print("{} bf16 speedup: train {:.2f}x, eval {:.2f}x, feature relative error {:.2%}".format(
+            name, times['fp32'][0]/times['bf16'][0], times['fp32'][1]/times['bf16'][1], gap))
+
+
+if __name__ == "__main__":
+    main()
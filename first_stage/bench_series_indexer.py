@@ -0,0 +1,71 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from bench_decode import ct_dataset
+from series_indexer import build_series_index
+
+
+def write_tree(data_dir, num_studies, slices_per_series, size, rng):
+    # <study>/<series>/<image>.dcm with random SOPInstanceUIDs, so file order says nothing about z
+    expected = {}
+    pixels = np.zeros((size, size), dtype=np.int16)
+    for _ in range(num_studies):
+        study, series = generate_uid(), generate_uid()
+        os.makedirs(os.path.join(data_dir, study, series))
+        z = np.sort(rng.uniform(-400, 0, slices_per_series))[::-1] # head first: z decreasing
+        images = []
+        for k in range(slices_per_series):
+            ds = ct_dataset(pixels, signed=True)
+            ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+            ds.ImagePositionPatient = [-175.0, -175.0, float(z[k])]
+            ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+            ds.InstanceNumber = int(rng.integers(1, 1000))
+            ds.PixelData = pixels.tobytes()
+            ds.save_as(os.path.join(data_dir, study, series, ds.SOPInstanceUID+'.dcm'), enforce_file_format=True)
+            images.append(ds.SOPInstanceUID)
+        expected[study+'_'+series] = images[::-1] # sorted along the normal (+z)
+    return expected
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--studies", type=int, default=20, help="synthetic studies, one series each")
+    parser.add_argument("--slices", type=int, default=100, help="slices per series")
+    parser.add_argument("--size", type=int, default=64, help="slice size (pixels are not read)")
+    parser.add_argument("--worker", type=int, default=4, help="Number of workers")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir, out_dir = os.path.join(tmp, 'dicom')+'/', os.path.join(tmp, 'index')
+        expected = write_tree(data_dir, args.studies, args.slices, args.size, rng)
+
+        start = time.perf_counter()
+        image_dict, series_dict, num_read = build_series_index(data_dir, out_dir, num_workers=args.worker, unlabeled=True)
+        t_full = time.perf_counter()-start
+        assert {s: series_dict[s]['sorted_image_list'] for s in series_dict} == expected
+        for images in expected.values():
+            assert image_dict[images[0]]['image_minus1'] == images[0] and image_dict[images[-1]]['image_plus1'] == images[-1]
+            assert all(image_dict[images[k]]['image_plus1'] == images[k+1] for k in range(len(images)-1))
+        print("full index: {} studies, {} images in {:.2f} s".format(num_read, len(image_dict), t_full))
+
+        start = time.perf_counter()
+        _, _, num_read = build_series_index(data_dir, out_dir, num_workers=args.worker, unlabeled=True)
+        print("rerun, nothing changed: {} studies read in {:.2f} s".format(num_read, time.perf_counter()-start))
+
+        series_id = sorted(expected)[0]
+        path = os.path.join(data_dir, *series_id.split('_'), expected[series_id][0]+'.dcm')
+        os.utime(path, ns=(time.time_ns(), time.time_ns()))
+        start = time.perf_counter()
+        image_dict, series_dict, num_read = build_series_index(data_dir, out_dir, num_workers=args.worker, unlabeled=True)
+        assert num_read == 1 and {s: series_dict[s]['sorted_image_list'] for s in series_dict} == expected
+        print("rerun, one file touched: {} study read in {:.2f} s".format(num_read, time.perf_counter()-start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from bench_batch_fetch import SyntheticSlices, train_transform_reference
+from bench_windowing import synthetic_slice
+from pe_dataset import PEDataset
+from stage_timers import StageTimers
+
+
+def epoch_times(datasets, indices, repeat):
+    # fastest pass of each dataset, passes interleaved so drift hits both alike
+    best = [float('inf')]*len(datasets)
+    for _ in range(repeat):
+        for k, dataset in enumerate(datasets):
+            start = time.perf_counter()
+            for index in indices:
+                dataset[index]
+            best[k] = min(best[k], time.perf_counter()-start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=512, help="slice size")
+    parser.add_argument("--imgSize", type=int, default=576, help="ImageSize")
+    parser.add_argument("--samples", type=int, default=40, help="samples per pass")
+    parser.add_argument("--repeat", type=int, default=10, help="passes, the fastest is kept")
+    parser.add_argument("--worker", type=int, default=2, help="DataLoader workers for the aggregated report")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    num_images = args.samples+2
+    slices = {'img{}'.format(k): (synthetic_slice(rng, args.size, np.int16), 1.0, -1024.0) for k in range(num_images)}
+    image_dict = {'img{}'.format(k): {'series_id': 'study_series', 'image_minus1': 'img{}'.format(max(k-1, 0)),
+                                      'image_plus1': 'img{}'.format(min(k+1, num_images-1)), 'pe_present_on_image': k % 2} for k in range(num_images)}
+    transform = lambda image: {'image': train_transform_reference(image, args.imgSize, rng).transpose(1, 2, 0)}
+    kwargs = dict(image_dict=image_dict, bbox_dict={'study_series': [56, 100, 456, 400]}, image_list=list(image_dict.keys()),
+                  target_size=args.imgSize, transform=transform, volume_cache=SyntheticSlices(slices))
+    indices = list(range(args.samples))
+
+    # in-memory slices: no I/O to hide the timer cost, the worst case for the overhead
+    timers = StageTimers()
+    t_off, t_on = epoch_times([PEDataset(**kwargs), PEDataset(timers=timers, **kwargs)], indices, args.repeat)
+    print("per sample: timers off {:.3f} ms, on {:.3f} ms, measured overhead {:+.2%}".format(t_off/args.samples*1000, t_on/args.samples*1000, t_on/t_off-1))
+    laps = int(timers.table()[0, :, :-1].sum())//(args.samples*args.repeat)
+    start = time.perf_counter()
+    for _ in range(10000):
+        timers.lap('read', 0)
+    t_lap = (time.perf_counter()-start)/10000
+    print("lap(): {:.2f} us x {} per sample = {:.3%} of a sample".format(t_lap*1e6, laps, t_lap*laps/(t_off/args.samples)))
+    timers.reset()
+
+    timers = StageTimers(num_workers=args.worker)
+    loader = DataLoader(PEDataset(timers=timers, **kwargs), batch_size=8, num_workers=args.worker)
+    for _ in loader:
+        pass
+    print(timers.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from windowing import WindowLUT, window
+
+
+def synthetic_slice(rng, size, dtype):
+    # stored values of a CT slice with RescaleIntercept=-1024: air, soft tissue, contrast, bone
+    x = rng.normal(1064, 200, (size, size))
+    x[:size//8] = 24
+    x[-size//16:, :size//4] = 2600
+    return np.clip(x, 0, 4095).astype(dtype)
+
+def window_reference(slices):
+    # the original first-stage pipeline: float64 rescale, window() per slice, concatenate
+    x = [np.expand_dims(window(pixels*slope+intercept, WL=100, WW=700), axis=2) for pixels, slope, intercept in slices]
+    return np.concatenate(x, axis=2)
+
+def timeit(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter()-start)/repeat*1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=512, help="slice size")
+    parser.add_argument("--repeat", type=int, default=200, help="timed iterations")
+    parser.add_argument("--bbox", type=int, nargs=4, default=[56, 100, 456, 400], help="lung bbox x0 y0 x1 y1")
+    parser.add_argument("--target_size", type=int, default=576, help="resize target")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for dtype in (np.int16, np.uint16):
+        slices = [(synthetic_slice(rng, args.size, dtype), 1.0, -1024.0) for _ in range(3)]
+        reference = window_reference(slices)
+        lut = WindowLUT(WL=100, WW=700)
+        out = np.empty(reference.shape, dtype=np.float32)
+        result = lut.window_triplet(slices, out=out)
+        print("{}: max abs diff vs window() {:.3g}".format(np.dtype(dtype).name, np.abs(result-reference).max()))
+        assert np.allclose(result, reference, rtol=0, atol=1e-6)
+
+        lut_uint8 = WindowLUT(WL=100, WW=700, dtype=np.uint8)
+        assert np.abs(lut_uint8.window_triplet(slices).astype(np.float64)-np.round(reference*255.0)).max() == 0
+
+        t_reference = timeit(lambda: window_reference(slices), args.repeat)
+        t_lut = timeit(lambda: lut.window_triplet(slices, out=out), args.repeat)
+        t_lut_uint8 = timeit(lambda: lut_uint8.window_triplet(slices), args.repeat)
+        print("  window() float64 : {:.3f} ms / sample".format(t_reference))
+        print("  LUT float32      : {:.3f} ms / sample ({:.1f}x)".format(t_lut, t_reference/t_lut))
+        print("  LUT uint8        : {:.3f} ms / sample ({:.1f}x)".format(t_lut_uint8, t_reference/t_lut_uint8))
+
+    # per-stage timing: window full slices then crop (old order) vs crop stored pixels then window
+    bbox, size = args.bbox, (args.target_size, args.target_size)
+    slices = [(synthetic_slice(rng, args.size, np.int16), 1.0, -1024.0) for _ in range(3)]
+    lut = WindowLUT(WL=100, WW=700)
+    full = lut.window_triplet(slices)
+    cropped = full[bbox[1]:bbox[3],bbox[0]:bbox[2],:]
+    crop_first = lut.window_triplet(slices, bbox=bbox)
+    assert np.array_equal(np.ascontiguousarray(cropped), crop_first)
+    assert np.array_equal(cv2.resize(cropped, size), cv2.resize(crop_first, size))
+    stages = [
+        ("window full + crop ", full.size, lambda: lut.window_triplet(slices)[bbox[1]:bbox[3],bbox[0]:bbox[2],:]),
+        ("crop + window      ", crop_first.size, lambda: lut.window_triplet(slices, bbox=bbox)),
+        ("resize             ", crop_first.size, lambda: cv2.resize(crop_first, size)),
+        ("reference total    ", full.size, lambda: cv2.resize(window_reference(slices)[bbox[1]:bbox[3],bbox[0]:bbox[2],:], size)),
+        ("crop-first total   ", crop_first.size, lambda: cv2.resize(lut.window_triplet(slices, bbox=bbox), size)),
+    ]
+    print("stage timing, bbox {}:".format(bbox))
+    for name, pixels, fn in stages:
+        print("  {}: {:.3f} ms / sample, {} input values".format(name, timeit(fn, args.repeat), pixels))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import contextlib
+import functools
+import math
+import time
+
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+# Segment-level activation checkpointing of the backbones: the forward keeps only the input of each
+# segment of blocks and the backward recomputes the activations inside it, one more forward for memory.
+#   SENet (seresnet50 / seresnext50 / ...): the blocks of layer1-layer4, pretrainedmodels/senet.py
+#   Xception / SE-Xception: block1-block12, xception_copiedModel.py
+#   DenseNet: densenet.py's / torchvision's memory_efficient dense layers (on / off)
+
+
+@contextlib.contextmanager
+def frozen_running_stats(blocks):
+    # the recomputation is a second train-mode forward of the batch: its BatchNorms must not move
+    # the running statistics again
+    norms = [m for block in blocks for m in block.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+    saved = [(m.momentum, m.num_batches_tracked.clone()) for m in norms]
+    for m in norms:
+        m.momentum = 0.0
+    try:
+        yield
+    finally:
+        for m, (momentum, tracked) in zip(norms, saved):
+            m.momentum = momentum
+            m.num_batches_tracked.copy_(tracked)
+
+def run_blocks(blocks, x):
+    for block in blocks:
+        x = block(x)
+    return x
+
+def checkpoint_blocks(blocks, x, segments):
+    """Runs `blocks` in `segments` segments, all but the last checkpointed (as checkpoint_sequential)."""
+    size = int(math.ceil(len(blocks)/float(min(segments, len(blocks)))))
+    starts = range(0, len(blocks), size)
+    for start in starts[:-1]:
+        segment = blocks[start:start+size]
+        x = checkpoint(run_blocks, segment, x, use_reentrant=False,
+                       context_fn=lambda segment=segment: (contextlib.nullcontext(), frozen_running_stats(segment)))
+    return run_blocks(blocks[starts[-1]:], x)
+
+
+def set_checkpointing(model, segments):
+    """Checkpoint the backbone of `model` in `segments` segments (0: off), returns the modules set."""
+    found = 0
+    for module in model.modules():
+        if hasattr(module, 'checkpoint_blocks'):
+            module.checkpoint_blocks = functools.partial(checkpoint_blocks, segments=segments) if segments > 0 else None
+            found += 1
+        elif hasattr(module, 'memory_efficient'):
+            module.memory_efficient = segments > 0
+            found += 1
+    if found == 0 and segments > 0:
+        raise ValueError('no checkpointing support in {}: SENet, Xception / SE-Xception and DenseNet backbones only'.format(type(model).__name__))
+    return found
+
+
+def saved_activations(model, images, precision):
+    """(bytes kept for the backward, peak CUDA bytes or 0, seconds) of a forward + backward of `model`.
+
+    The bytes are those of the distinct storages saved by autograd, parameters excluded; the tensors
+    saved inside a checkpointed segment are dropped by the checkpoint and do not reach the hook.
+    """
+    parameters = set(p.data_ptr() for p in model.parameters())
+    storages = {}
+    def pack(tensor):
+        ptr = tensor.untyped_storage().data_ptr()
+        if ptr not in parameters:
+            storages[ptr] = tensor.untyped_storage().nbytes()
+        return tensor
+    if images.is_cuda:
+        torch.cuda.synchronize(images.device)
+        torch.cuda.reset_peak_memory_stats(images.device)
+        base = torch.cuda.memory_allocated(images.device)
+    start = time.perf_counter()
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        with precision.autocast():
+            logits = model(images)
+    logits = logits[-1] if isinstance(logits, (tuple, list)) else logits
+    logits.float().mean().backward()
+    peak = 0
+    if images.is_cuda:
+        torch.cuda.synchronize(images.device)
+        peak = torch.cuda.max_memory_allocated(images.device)-base
+    return sum(storages.values()), peak, time.perf_counter()-start
+
+
+def memory_speed_report(model, segments, shape, device, precision):
+    """Activation memory and step time of one train step without and with `segments` checkpointing.
+
+    A probe batch of `shape` (small, the run without checkpointing must fit); the memory is given
+    per sample. The model is left with `segments`, its gradients dropped and BatchNorm statistics
+    restored.
+    """
+    images = torch.randn(*shape, device=device)
+    buffers = [b.detach().clone() for b in model.buffers()]
+    model.train()
+    results = []
+    for setting in (0, segments, 0, segments): # the first pair warms up
+        set_checkpointing(model, setting)
+        results.append(saved_activations(model, images, precision))
+        model.zero_grad(set_to_none=True)
+    with torch.no_grad():
+        for b, saved in zip(model.buffers(), buffers):
+            b.copy_(saved)
+    set_checkpointing(model, segments)
+    (off, peak_off, t_off), (on, peak_on, t_on) = results[2], results[3]
+    mb = lambda n: n/float(shape[0])/2**20
+    msg = 'activation checkpointing, {} segments: saved activations {:.1f} -> {:.1f} MB per sample ({:+.0%})'.format(
+        segments, mb(off), mb(on), on/float(max(off, 1))-1)
+    if peak_off > 0:
+        msg += ', CUDA peak {:.1f} -> {:.1f} MB per sample'.format(mb(peak_off), mb(peak_on))
+    return msg + ', step {:.2f} -> {:.2f} s ({:+.0%})'.format(t_off, t_on, t_on/t_off-1)
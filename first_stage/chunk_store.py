@@ -0,0 +1,195 @@
+import argparse
+import os
+import pickle
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+from lung_bbox import downsample_hu, estimate_bbox
+from pe_dataset import DATA_DIR, read_dicom_slice
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed version of the volume cache, one independently compressed chunk per slice:
+#   <store_dir>/<series_id>.chunks  the chunks of the series back to back, each the byte-shuffled
+#                                   int16 slice (all low bytes, then all high bytes) compressed with codec
+#   <store_dir>/index.npz           VolumeCache index (image_ids, series_index, z, slope, intercept,
+#                                   series_ids) + offset, nbytes of every chunk, rows, cols per series, codec
+#   <store_dir>/bbox_dict.pickle    lung_bbox.py estimate of every series, in the bbox_dict format
+# Shuffling puts the nearly constant high bytes of CT values together (zstd ratio 3.7-4.3x -> 5.1x on bench data).
+
+
+def shuffle(pixels):
+    # shifts and masks instead of a transposed byte copy, which is ~15x slower
+    v = pixels.reshape(-1).view(np.uint16)
+    return (v & 0xFF).astype(np.uint8).tobytes() + (v >> 8).astype(np.uint8).tobytes()
+
+def unshuffle(data, shape):
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(2, -1)
+    out = np.left_shift(planes[1], 8, dtype=np.uint16)
+    out |= planes[0]
+    return out.view(np.int16).reshape(shape)
+
+def compress(data, codec, level):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+def decompress(data, codec):
+    # both release the GIL, so the chunks of a triplet decompress in parallel on a thread pool
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def default_codec():
+    return 'zstd' if zstandard is not None else 'zlib'
+
+def convert_series(job):
+    series_index, series_id, sorted_image_list, data_dir, store_dir, codec, level = job
+    study_id, series_uid = series_id.split('_')
+    series_dir = data_dir+study_id+'/'+series_uid+'/'
+    offsets, nbytes, slope, intercept, hu = [], [], [], [], []
+    offset = 0
+    with open(os.path.join(store_dir, series_id+'.chunks'), 'wb') as f:
+        for image_id in sorted_image_list:
+            pixels, s, i = read_dicom_slice(series_dir+image_id+'.dcm')
+            if pixels.dtype != np.int16:
+                if pixels.min() < -32768 or pixels.max() > 32767:
+                    raise ValueError('{} does not fit int16'.format(image_id))
+                pixels = pixels.astype(np.int16)
+            chunk = compress(shuffle(pixels), codec, level)
+            f.write(chunk)
+            offsets.append(offset)
+            nbytes.append(len(chunk))
+            slope.append(float(s))
+            intercept.append(float(i))
+            hu.append(downsample_hu(pixels, s, i))
+            offset += len(chunk)
+    return series_index, sorted_image_list, offsets, nbytes, slope, intercept, pixels.shape, estimate_bbox(np.stack(hu), pixels.shape)
+
+def build_chunk_store(series_dict, series_list, store_dir, data_dir=DATA_DIR, codec=None, level=3, num_workers=8):
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    codec = codec or default_codec()
+    jobs = [(k, series_id, series_dict[series_id]['sorted_image_list'], data_dir, store_dir, codec, level) for k, series_id in enumerate(series_list)]
+    image_ids, series_index, z, offset, nbytes, slope, intercept = [], [], [], [], [], [], []
+    rows, cols = np.zeros(len(series_list), dtype=np.int32), np.zeros(len(series_list), dtype=np.int32)
+    bbox_dict = {}
+    with Pool(num_workers) as pool:
+        for k, sorted_image_list, o, n, s, i, shape, bbox in tqdm(pool.imap_unordered(convert_series, jobs), total=len(jobs)):
+            image_ids += sorted_image_list
+            series_index.append(np.full(len(sorted_image_list), k, dtype=np.int32))
+            z.append(np.arange(len(sorted_image_list), dtype=np.int32))
+            offset.append(np.array(o, dtype=np.int64))
+            nbytes.append(np.array(n, dtype=np.int64))
+            slope.append(np.array(s, dtype=np.float64))
+            intercept.append(np.array(i, dtype=np.float64))
+            rows[k], cols[k] = shape
+            bbox_dict[series_list[k]] = bbox
+    with open(os.path.join(store_dir, 'bbox_dict.pickle'), 'wb') as f:
+        pickle.dump(bbox_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
+    image_ids = np.array(image_ids, dtype='S')
+    order = np.argsort(image_ids)
+    np.savez(os.path.join(store_dir, 'index.npz'),
+             image_ids=image_ids[order],
+             series_index=np.concatenate(series_index)[order],
+             z=np.concatenate(z)[order],
+             slope=np.concatenate(slope)[order],
+             intercept=np.concatenate(intercept)[order],
+             offset=np.concatenate(offset)[order],
+             nbytes=np.concatenate(nbytes)[order],
+             series_ids=np.array(series_list, dtype='S'),
+             rows=rows,
+             cols=cols,
+             codec=codec)
+
+
+class ChunkStore(object):
+    """Drop-in for VolumeCache reading the per-slice chunks written by build_chunk_store.
+
+    Every read_slice is one pread of the compressed chunk plus its decompression; read_triplet
+    issues its three on a per-worker pool of `threads` threads (0 => one after the other).
+    """
+    def __init__(self, store_dir, threads=0, max_files=256):
+        self.store_dir = store_dir
+        index = np.load(os.path.join(store_dir, 'index.npz'))
+        self.image_ids = index['image_ids']
+        self.series_index = index['series_index']
+        self.z = index['z']
+        self.slope = index['slope']
+        self.intercept = index['intercept']
+        self.offset = index['offset']
+        self.nbytes = index['nbytes']
+        self.series_ids = [s.decode() for s in index['series_ids']]
+        self.rows = index['rows']
+        self.cols = index['cols']
+        self.codec = str(index['codec'])
+        if self.codec == 'zstd' and zstandard is None:
+            raise ImportError('{} is zstd compressed, pip install zstandard'.format(store_dir))
+        self.threads = threads
+        self.max_files = max_files
+        self.files = {} # opened lazily, per DataLoader worker
+        self.files_pid = None
+        self.pool = None
+    def row(self, image_id):
+        row = np.searchsorted(self.image_ids, image_id.encode())
+        if row == len(self.image_ids) or self.image_ids[row] != image_id.encode():
+            raise KeyError(image_id)
+        return row
+    def file(self, series_index):
+        if self.files_pid != os.getpid(): # descriptors and threads do not survive the fork into DataLoader workers
+            self.files = {}
+            self.pool = ThreadPoolExecutor(self.threads) if self.threads > 0 else None
+            self.files_pid = os.getpid()
+        if series_index not in self.files:
+            if len(self.files) >= self.max_files:
+                for fd in self.files.values():
+                    os.close(fd)
+                self.files = {}
+            self.files[series_index] = os.open(os.path.join(self.store_dir, self.series_ids[series_index]+'.chunks'), os.O_RDONLY)
+        return self.files[series_index]
+    def read_row(self, row):
+        s = self.series_index[row]
+        data = os.pread(self.file(s), int(self.nbytes[row]), int(self.offset[row]))
+        return unshuffle(decompress(data, self.codec), (self.rows[s], self.cols[s])), self.slope[row], self.intercept[row]
+    def read_slice(self, image_id):
+        return self.read_row(self.row(image_id))
+    def read_triplet(self, image_minus1, image_id, image_plus1):
+        rows = [self.row(image_minus1), self.row(image_id), self.row(image_plus1)]
+        self.file(self.series_index[rows[1]])
+        if self.pool is None:
+            return [self.read_row(row) for row in rows]
+        return list(self.pool.map(self.read_row, rows))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--series_dict", type=str, default="../process_input/split2/series_dict.pickle", help="series_dict with sorted_image_list")
+    parser.add_argument("--bbox_dict", type=str, nargs='+', default=["../lung_localization/split2/bbox_dict_train.pickle", "../lung_localization/split2/bbox_dict_valid.pickle"], help="series to convert")
+    parser.add_argument("--data_dir", type=str, default=DATA_DIR, help="RSNA PE train directory")
+    parser.add_argument("--store_dir", type=str, default="../process_input/split2/chunk_store/", help="output directory")
+    parser.add_argument("--codec", type=str, default=default_codec(), help="zstd (pip install zstandard) | zlib")
+    parser.add_argument("--level", type=int, default=3, help="compression level")
+    parser.add_argument("--worker", type=int, default=12, help="Number of workers")
+    args = parser.parse_args()
+
+    with open(args.series_dict, 'rb') as f:
+        series_dict = pickle.load(f)
+    series_list = set()
+    for path in args.bbox_dict:
+        with open(path, 'rb') as f:
+            series_list.update(pickle.load(f).keys())
+    series_list = sorted(series_list)
+    print("Series to convert:", len(series_list))
+    build_chunk_store(series_dict, series_list, args.store_dir, data_dir=args.data_dir, codec=args.codec, level=args.level, num_workers=args.worker)
+    print("Chunk store written to", args.store_dir)
+
+
+if __name__ == "__main__":
+    main()
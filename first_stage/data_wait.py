@@ -0,0 +1,76 @@
+import os
+import time
+
+# Share of the step time spent waiting for the next batch, above which the loop is input bound,
+# and below which the loader keeps up with compute
+STARVED = 0.3
+FED = 0.05
+
+
+class DataWaitMeter(object):
+    """Splits the training steps into the time blocked on the DataLoader and the compute time.
+
+    for j, (images, labels) in enumerate(meter.iterate(generator)): ...
+    The loops call loss.item() every step, which waits for the GPU, so the host time between
+    two batches is the compute of the step; no extra synchronization is added. The first batch
+    of an epoch waits for the workers to start and is kept out of the window.
+    """
+    def __init__(self):
+        self.reset()
+    def reset(self):
+        self.steps, self.wait, self.compute = 0, 0.0, 0.0
+    def iterate(self, generator):
+        iterator = iter(generator)
+        first = True
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            now = time.perf_counter()
+            yield batch
+            if not first:
+                self.steps += 1
+                self.wait += now-start
+                self.compute += time.perf_counter()-now
+            first = False
+    def fraction(self):
+        return self.wait/max(self.wait+self.compute, 1e-9)
+    def summary(self, args=None):
+        steps = max(self.steps, 1)
+        msg = 'data wait: {:.0%} of {} steps, wait {:.1f} ms compute {:.1f} ms per step'.format(
+            self.fraction(), self.steps, self.wait/steps*1000, self.compute/steps*1000)
+        if args is not None:
+            msg += ' | ' + advice(self.fraction(), args)
+        return msg
+
+
+def advice(fraction, args):
+    # next loader settings to try, from the flags of train1.py / train2.py
+    if fraction < FED:
+        return 'compute bound: the loader keeps up, a larger --BS (or fewer --worker) is free'
+    flag = lambda name: getattr(args, name, 0)
+    workers = flag('worker')
+    cpus = (os.cpu_count() or 1)//int(os.environ.get('LOCAL_WORLD_SIZE', 1)) # per rank
+    tips = []
+    if fraction < STARVED and workers > 0:
+        # bursty: the workers keep up on average, a deeper queue absorbs the slow batches
+        tips.append('--prefetch {}'.format(2*flag('prefetch')))
+    if workers < cpus:
+        tips.append('--worker {} ({} cpus per rank)'.format(min(2*max(workers, 1), cpus), cpus))
+    if fraction >= STARVED:
+        if not flag('shard_dir'):
+            if not flag('volume_cache') and not flag('chunk_store'):
+                tips.append('--chunk_store')
+            if not flag('batch_fetch'):
+                tips.append('--batch_fetch 1')
+            if not flag('io_threads'):
+                tips.append('--io_threads 3')
+        if not flag('uint8_transport'):
+            tips.append('--uint8_transport 1')
+        if workers > 0:
+            tips.append('--prefetch {}'.format(2*flag('prefetch')))
+    if not flag('stage_timers'):
+        tips.append('--stage_timers 1 to find the slow stage')
+    return '{}: try {}'.format('input bound' if fraction >= STARVED else 'data stalls', ', '.join(tips))
@@ -0,0 +1,67 @@
+import os
+
+import torch
+
+# torch.distributed setup of train1.py / train2.py, launched by torchrun (LOCAL_RANK / LOCAL_WORLD_SIZE
+# in the environment) or by torch.distributed.launch (--local_rank)
+#   backend auto: nccl on the GPUs, gloo with the ranks on the CPU when there is no CUDA
+BACKENDS = ('auto', 'nccl', 'gloo')
+
+
+def init_distributed(args):
+    """Initializes the process group of --backend, sets args.local_rank and returns the device.
+
+    CPU ranks get --threads torch threads, by default the cores of the node split between its
+    ranks (torchrun otherwise leaves each rank with OMP_NUM_THREADS=1).
+    """
+    if args.local_rank < 0:
+        args.local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    backend = args.backend
+    if backend == 'auto':
+        backend = 'nccl' if torch.cuda.is_available() else 'gloo'
+    if backend == 'nccl' or torch.cuda.is_available():
+        torch.cuda.set_device(args.local_rank)
+        device = torch.device('cuda', args.local_rank)
+    else:
+        device = torch.device('cpu')
+        threads = args.threads or max(1, (os.cpu_count() or 1)//int(os.environ.get('LOCAL_WORLD_SIZE', 1)))
+        torch.set_num_threads(threads)
+    torch.distributed.init_process_group(backend=backend)
+    if args.local_rank == 0:
+        print('torch.distributed: {} x {} on {}{}'.format(backend, torch.distributed.get_world_size(), device.type,
+              ', {} threads per rank'.format(torch.get_num_threads()) if device.type == 'cpu' else ''))
+    return device
+
+
+def freeze_unused_parameters(model, shape, device, precision):
+    """Names of the parameters without gradient after a train step on a random batch of `shape`,
+    which are set to requires_grad=False.
+
+    Such parameters (e.g. the unused 1000-class last_linear of the SE nets) made every DDP wrap
+    use find_unused_parameters=True; Adam never updated them. With none left DDP can run with
+    static_graph. The gradients are dropped and the BatchNorm running statistics restored.
+    """
+    images = torch.randn(*shape, device=device)
+    buffers = [b.detach().clone() for b in model.buffers()]
+    model.train()
+    with precision.autocast():
+        logits = model(images)
+    logits = logits[-1] if isinstance(logits, (tuple, list)) else logits
+    logits.float().mean().backward()
+    unused = [name for name, p in model.named_parameters() if p.requires_grad and p.grad is None]
+    for name, p in model.named_parameters():
+        if name in unused:
+            p.requires_grad_(False)
+    with torch.no_grad():
+        for b, saved in zip(model.buffers(), buffers):
+            b.copy_(saved)
+    model.zero_grad(set_to_none=True)
+    return unused
+
+
+def ddp_options(args):
+    # DistributedDataParallel keyword arguments of --find_unused on args.device
+    options = {'find_unused_parameters': args.find_unused == 1, 'static_graph': args.find_unused < 0}
+    if args.device.type == 'cuda':
+        options.update(device_ids=[args.local_rank], output_device=args.local_rank)
+    return options
@@ -0,0 +1,120 @@
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pydicom
+from pydicom import encaps
+
+# Decoders for compressed (encapsulated) pixel data, tried in this order for each transfer syntax.
+# All of them release the GIL while decoding, so a thread pool decodes several frames at once;
+# pydicom's pixel_array is the fallback for everything else (uncompressed, RLE, multi-frame, colour).
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
+try:
+    import libjpeg
+except ImportError:
+    libjpeg = None
+try:
+    import openjpeg
+except ImportError:
+    openjpeg = None
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+JPEG_BASELINE = '1.2.840.10008.1.2.4.50'
+JPEG_LOSSLESS = '1.2.840.10008.1.2.4.57'
+JPEG_LOSSLESS_SV1 = '1.2.840.10008.1.2.4.70'
+JPEG_LS_LOSSLESS = '1.2.840.10008.1.2.4.80'
+JPEG_LS_NEAR_LOSSLESS = '1.2.840.10008.1.2.4.81'
+JPEG_2000_LOSSLESS = '1.2.840.10008.1.2.4.90'
+JPEG_2000 = '1.2.840.10008.1.2.4.91'
+FASTEST_FIRST = ['imagecodecs', 'libjpeg', 'openjpeg', 'pillow']
+
+
+def decode_pillow(frame):
+    return np.array(Image.open(io.BytesIO(frame)))
+
+def backend_decoders(name):
+    # transfer syntax -> decode(frame bytes) -> ndarray, empty when the codec is not installed
+    if name == 'imagecodecs' and imagecodecs is not None:
+        return {JPEG_BASELINE: imagecodecs.jpeg8_decode, JPEG_LOSSLESS: imagecodecs.ljpeg_decode, JPEG_LOSSLESS_SV1: imagecodecs.ljpeg_decode,
+                JPEG_LS_LOSSLESS: imagecodecs.jpegls_decode, JPEG_LS_NEAR_LOSSLESS: imagecodecs.jpegls_decode,
+                JPEG_2000_LOSSLESS: imagecodecs.jpeg2k_decode, JPEG_2000: imagecodecs.jpeg2k_decode}
+    if name == 'libjpeg' and libjpeg is not None:
+        return {syntax: libjpeg.decode for syntax in (JPEG_BASELINE, JPEG_LOSSLESS, JPEG_LOSSLESS_SV1, JPEG_LS_LOSSLESS, JPEG_LS_NEAR_LOSSLESS)}
+    if name == 'openjpeg' and openjpeg is not None:
+        return {JPEG_2000_LOSSLESS: openjpeg.decode, JPEG_2000: openjpeg.decode}
+    if name == 'pillow' and Image is not None and features.check('jpg_2000'):
+        # no lossless JPEG decoder, and the JPEG 2000 sign is not applied, see decodable()
+        return {JPEG_2000_LOSSLESS: decode_pillow, JPEG_2000: decode_pillow}
+    if name not in FASTEST_FIRST:
+        raise ValueError('unknown DICOM decode backend {}'.format(name))
+    return {}
+
+
+def sign_extend(pixels, bits_stored):
+    # codecs return the stored bits of signed data as unsigned values, pixel_array returns them sign extended
+    shift = 8*pixels.dtype.itemsize - bits_stored
+    signed = pixels.view(pixels.dtype.str.replace('u', 'i'))
+    return (signed << shift) >> shift
+
+def decodable(data, name):
+    # single-frame grayscale slices only, everything else is left to pixel_array
+    if int(data.get('SamplesPerPixel', 1)) != 1 or int(data.get('NumberOfFrames', 1) or 1) != 1:
+        return False
+    return not (name == 'pillow' and data.PixelRepresentation == 1)
+
+
+class DicomDecoder(object):
+    """read_dicom_slice with the compressed pixel data decoded by the fastest installed codec.
+
+    backend 'auto' picks, per transfer syntax, the first available of FASTEST_FIRST; a name
+    restricts it to that codec. read_batch() reads and decodes a batch of files on a pool
+    of `threads` threads (0 => one after the other in the calling thread).
+    """
+    def __init__(self, backend='auto', threads=0):
+        self.backends = {}  # transfer syntax -> (backend name, decode)
+        for name in reversed(FASTEST_FIRST if backend == 'auto' else [backend]):
+            self.backends.update({syntax: (name, decode) for syntax, decode in backend_decoders(name).items()})
+        if backend != 'auto' and not self.backends:
+            raise ImportError('DICOM decode backend {} is not installed'.format(backend))
+        self.threads = threads
+        self.pool = None
+        self.pool_pid = None
+    def decode(self, data):
+        name, decode = self.backends.get(str(data.file_meta.TransferSyntaxUID), (None, None))
+        if name is None or not decodable(data, name):
+            return data.pixel_array
+        frame = next(encaps.generate_frames(data.PixelData, number_of_frames=1))
+        pixels = decode(frame).reshape(data.Rows, data.Columns)
+        if data.PixelRepresentation == 1 and pixels.dtype.kind == 'u':
+            pixels = sign_extend(pixels, data.BitsStored)
+        return pixels
+    def read(self, path, timers=None):
+        # (pixels, slope, intercept), same values as pydicom's pixel_array
+        t = time.perf_counter_ns() if timers is not None else 0
+        data = pydicom.dcmread(path)
+        if timers is not None:
+            t = timers.lap('read', t)
+        pixels = self.decode(data)
+        if timers is not None:
+            timers.lap('decode', t)
+        return pixels, data.RescaleSlope, data.RescaleIntercept
+    def map(self, fn, items):
+        if self.threads <= 0 or len(items) < 2:
+            return [fn(item) for item in items]
+        if self.pool_pid != os.getpid(): # threads do not survive the fork into DataLoader workers
+            self.pool = ThreadPoolExecutor(self.threads)
+            self.pool_pid = os.getpid()
+        return list(self.pool.map(fn, items))
+    def read_batch(self, paths, timers=None):
+        # each pool thread reads and decodes one file, so the reads overlap the decodes too
+        return self.map(lambda path: self.read(path, timers), paths)
+    def describe(self):
+        return ', '.join('{}: {}'.format(pydicom.uid.UID(syntax).name, name) for syntax, (name, _) in sorted(self.backends.items())) or 'pydicom only'
@@ -0,0 +1,122 @@
+import argparse
+import os
+import pickle
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pydicom
+from tqdm import tqdm
+
+from pe_dataset import DATA_DIR, read_dicom_slice
+
+# Header-only index of every slice, one column per field, sorted by image id:
+#   image_ids, paths (relative to data_dir), slope, intercept, rows, cols,
+#   offset (byte offset of the raw pixel data, -1 => decode with pydicom),
+#   transfer_syntax (code into transfer_syntaxes), signed
+IMPLICIT_VR_LITTLE_ENDIAN = '1.2.840.10008.1.2'
+EXPLICIT_VR_LITTLE_ENDIAN = '1.2.840.10008.1.2.1'
+PIXEL_DATA_TAG = b'\xe0\x7f\x10\x00'
+
+
+def pixel_data_offset(f, transfer_syntax):
+    # f is positioned on the (7FE0,0010) element by dcmread(stop_before_pixels=True)
+    start = f.tell()
+    header = f.read(12)
+    if header[:4] != PIXEL_DATA_TAG:
+        return -1
+    if transfer_syntax == IMPLICIT_VR_LITTLE_ENDIAN:
+        length, offset = struct.unpack('<I', header[4:8])[0], start+8
+    elif transfer_syntax == EXPLICIT_VR_LITTLE_ENDIAN:
+        length, offset = struct.unpack('<I', header[8:12])[0], start+12
+    else: # big endian or compressed (encapsulated) pixel data
+        return -1
+    if length == 0xFFFFFFFF:
+        return -1
+    return offset
+
+def scan_header(job):
+    image_id, path = job
+    with open(path, 'rb') as f:
+        data = pydicom.dcmread(f, stop_before_pixels=True)
+        transfer_syntax = str(data.file_meta.TransferSyntaxUID)
+        offset = pixel_data_offset(f, transfer_syntax)
+    if data.BitsAllocated != 16:
+        offset = -1
+    return (image_id, float(data.RescaleSlope), float(data.RescaleIntercept), int(data.Rows), int(data.Columns),
+            offset, transfer_syntax, int(data.PixelRepresentation))
+
+def build_dicom_index(image_dict, index_path, data_dir=DATA_DIR, num_threads=32):
+    image_ids = sorted(image_dict.keys())
+    paths = []
+    for image_id in image_ids:
+        study_id, series_id = image_dict[image_id]['series_id'].split('_')
+        paths.append(study_id+'/'+series_id+'/'+image_id+'.dcm')
+    with ThreadPoolExecutor(num_threads) as pool:
+        headers = list(tqdm(pool.map(scan_header, [(image_id, data_dir+path) for image_id, path in zip(image_ids, paths)]), total=len(image_ids)))
+    transfer_syntaxes = sorted(set(h[6] for h in headers))
+    np.savez(index_path,
+             image_ids=np.array(image_ids, dtype='S'),
+             paths=np.array(paths, dtype='S'),
+             slope=np.array([h[1] for h in headers], dtype=np.float64),
+             intercept=np.array([h[2] for h in headers], dtype=np.float64),
+             rows=np.array([h[3] for h in headers], dtype=np.uint16),
+             cols=np.array([h[4] for h in headers], dtype=np.uint16),
+             offset=np.array([h[5] for h in headers], dtype=np.int64),
+             transfer_syntax=np.array([transfer_syntaxes.index(h[6]) for h in headers], dtype=np.uint8),
+             transfer_syntaxes=np.array(transfer_syntaxes, dtype='S'),
+             signed=np.array([h[7] for h in headers], dtype=np.uint8))
+
+
+class DicomIndex(object):
+    """Reads raw pixel bytes at the offsets stored by build_dicom_index, no header parsing"""
+    def __init__(self, index_path, data_dir=DATA_DIR, decoder=None):
+        self.data_dir = data_dir
+        self.decoder = decoder # DicomDecoder for the compressed slices, None => pydicom's pixel_array
+        index = np.load(index_path)
+        self.image_ids = index['image_ids']
+        self.paths = index['paths']
+        self.slope = index['slope']
+        self.intercept = index['intercept']
+        self.rows = index['rows']
+        self.cols = index['cols']
+        self.offset = index['offset']
+        self.transfer_syntax = index['transfer_syntax']
+        self.transfer_syntaxes = [s.decode() for s in index['transfer_syntaxes']]
+        self.signed = index['signed']
+    def row(self, image_id):
+        row = np.searchsorted(self.image_ids, image_id.encode())
+        if row == len(self.image_ids) or self.image_ids[row] != image_id.encode():
+            raise KeyError(image_id)
+        return row
+    def read_slice(self, image_id):
+        # (pixels, slope, intercept), same values as pydicom's pixel_array
+        row = self.row(image_id)
+        path = self.data_dir+self.paths[row].decode()
+        if self.offset[row] < 0:
+            pixels, _, _ = self.decoder.read(path) if self.decoder is not None else read_dicom_slice(path)
+        else:
+            with open(path, 'rb') as f:
+                f.seek(self.offset[row])
+                pixels = np.fromfile(f, dtype='<i2' if self.signed[row] else '<u2', count=int(self.rows[row])*int(self.cols[row]))
+            pixels = pixels.reshape(self.rows[row], self.cols[row])
+        return pixels, self.slope[row], self.intercept[row]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image_dict", type=str, default="../process_input/split2/image_dict.pickle", help="slices to index")
+    parser.add_argument("--data_dir", type=str, default=DATA_DIR, help="RSNA PE train directory")
+    parser.add_argument("--index_path", type=str, default="../process_input/split2/dicom_index.npz", help="output file")
+    parser.add_argument("--threads", type=int, default=32, help="Number of reader threads")
+    args = parser.parse_args()
+
+    with open(args.image_dict, 'rb') as f:
+        image_dict = pickle.load(f)
+    print("Slices to index:", len(image_dict))
+    build_dicom_index(image_dict, args.index_path, data_dir=args.data_dir, num_threads=args.threads)
+    print("DICOM index written to", args.index_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import time
+
+import torch
+
+# Execution of the CNN backbones: NHWC (channels_last) tensors, which cudnn / oneDNN convolve without
+# the NCHW transposes, and torch.compile graphs of the forward / backward.
+#   compile mode '' runs eager, the others are torch.compile's modes
+COMPILE_MODES = ('', 'default', 'reduce-overhead', 'max-autotune')
+
+
+class Execution(object):
+    """--channels_last / --compile of train1.py / train2.py / save_features1.py.
+
+    model = execution.prepare(model) before DDP / DataParallel, images = execution.inputs(images)
+    per batch, and execution.warmup(...) once before the loop, so that the compilation and the
+    cudnn / oneDNN algorithm search are not part of the first timed steps.
+    """
+    def __init__(self, channels_last=0, compile=''):
+        self.channels_last = bool(channels_last)
+        self.compile = compile
+    @property
+    def enabled(self):
+        return self.channels_last or bool(self.compile)
+    def prepare(self, model):
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        if self.compile:
+            if not hasattr(model, 'compile'):
+                raise RuntimeError('--compile needs torch>=2.2 (nn.Module.compile)')
+            # in place: the state_dict keys and the checkpoints stay those of the eager model
+            model.compile(mode=None if self.compile == 'default' else self.compile)
+        return model
+    def inputs(self, images):
+        return images.contiguous(memory_format=torch.channels_last) if self.channels_last else images
+    def warmup(self, model, shape, device, precision, train=True):
+        """One step on a random batch of `shape`, returns its seconds.
+
+        train: forward + backward in train mode; the gradients are dropped and the BatchNorm
+        running statistics restored, so the warmup does not change the model.
+        """
+        if not self.enabled:
+            return 0.0
+        start = time.perf_counter()
+        images = self.inputs(torch.randn(*shape, device=device))
+        buffers = [b.detach().clone() for b in model.buffers()]
+        model.train(train)
+        with torch.set_grad_enabled(train):
+            with precision.autocast():
+                logits = model(images)
+            if train:
+                logits = logits[-1] if isinstance(logits, (tuple, list)) else logits
+                logits.float().mean().backward()
+        with torch.no_grad():
+            for b, saved in zip(model.buffers(), buffers):
+                b.copy_(saved)
+        model.zero_grad(set_to_none=True)
+        if torch.device(device).type == 'cuda':
+            torch.cuda.synchronize(device)
+        return time.perf_counter()-start
+    def describe(self):
+        return 'channels_last: {}, compile: {}'.format(int(self.channels_last), self.compile or 'eager')
@@ -0,0 +1,69 @@
+import contextlib
+import math
+
+from torch.optim.lr_scheduler import LambdaLR
+
+
+def accumulation_steps(effective_batch, batch_size, world_size):
+    # micro-batches per optimizer step so that batch_size*world_size*steps reaches effective_batch
+    if effective_batch <= 0:
+        return 1
+    return max(1, int(math.ceil(effective_batch/float(batch_size*world_size))))
+
+
+class GradAccumulator(object):
+    """Optimizer step every `steps` micro-batches of an epoch.
+
+    for j, batch in enumerate(accumulator.iterate(generator)):
+        with accumulator.sync(j): precision.backward(loss/accumulator.steps)
+        if accumulator.boundary(j): accumulator.rescale(j), step, zero_grad, scheduler.step()
+    sync() is DDP's no_sync() off the boundaries, so gradients are all-reduced once per
+    optimizer step. iterate() reads one batch ahead and ends the last group on StopIteration:
+    len() of a DataLoader over an IterableDataset (--shard_dir) is only an estimate. rescale()
+    makes the last, shorter group of an epoch the mean over its own micro-batches.
+    The first micro-batch is always all-reduced: DDP's static_graph records the graph on a
+    synchronized backward, and an early average of a part of the sum leaves the step unchanged.
+    """
+    def __init__(self, model, steps):
+        self.model = model
+        self.steps = steps
+        self.synced = False
+        self.last = False
+    def iterate(self, generator):
+        iterator = iter(generator)
+        self.last = False
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return
+        while True:
+            try:
+                following = next(iterator)
+            except StopIteration:
+                self.last = True
+                yield batch
+                return
+            yield batch
+            batch = following
+    def boundary(self, j):
+        return (j+1) % self.steps == 0 or self.last
+    def rescale(self, j):
+        # the micro-batch losses were divided by steps: gradients of a group of n < steps * steps/n
+        n = j % self.steps + 1
+        if n < self.steps:
+            for p in self.model.parameters():
+                if p.grad is not None:
+                    p.grad.mul_(self.steps/float(n))
+    def sync(self, j):
+        if self.boundary(j) or not self.synced or not hasattr(self.model, 'no_sync'):
+            self.synced = True
+            return contextlib.nullcontext()
+        return self.model.no_sync()
+
+def linear_schedule_with_warmup(optimizer, num_warmup_steps, num_training_steps):
+    # transformers.get_linear_schedule_with_warmup, without importing transformers
+    def lr_lambda(step):
+        if step < num_warmup_steps:
+            return float(step)/float(max(1, num_warmup_steps))
+        return max(0.0, float(num_training_steps-step)/float(max(1, num_training_steps-num_warmup_steps)))
+    return LambdaLR(optimizer, lr_lambda)
@@ -0,0 +1,109 @@
+import argparse
+import os
+import pickle
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import ndimage
+from tqdm import tqdm
+
+from pe_dataset import DATA_DIR, read_dicom_slice
+
+# Lung region of a series from its CT values, in the bbox_dict format of ../lung_localization:
+#   bbox_dict[series_id] = [x0, y0, x1, y1], the crop x[y0:y1, x0:x1] of every stored slice.
+# Air (HU < AIR_HU) on an in-plane downsampled volume is labelled in 3D; air connected to the
+# image border is outside the body, the remaining large components are the lungs and airways,
+# and the box is their union over all slices plus a margin.
+AIR_HU = -400
+
+
+def downsample_hu(pixels, slope, intercept, stride=4):
+    # strided view of the stored pixels, rescaled in float32
+    return pixels[::stride, ::stride].astype(np.float32)*np.float32(slope)+np.float32(intercept)
+
+def estimate_bbox(hu, shape, stride=4, margin=16, min_fraction=0.1):
+    # hu: (slices, h, w) downsample_hu volume, shape: (H, W) of the stored slices
+    air = hu < AIR_HU
+    labels, num = ndimage.label(air)
+    if num == 0:
+        return [0, 0, shape[1], shape[0]]
+    outside = np.unique(np.concatenate([labels[:, 0, :].ravel(), labels[:, -1, :].ravel(), labels[:, :, 0].ravel(), labels[:, :, -1].ravel()]))
+    sizes = np.bincount(labels.ravel(), minlength=num+1)
+    sizes[0] = 0
+    sizes[outside] = 0
+    if sizes.max() == 0:
+        return [0, 0, shape[1], shape[0]]
+    lungs = sizes >= min_fraction*sizes.max() # drops bowel gas and noise, keeps both lungs and the trachea
+    mask = lungs[labels].any(axis=0)
+    ys, xs = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+    x0, x1 = xs[0]*stride-margin, (xs[-1]+1)*stride+margin
+    y0, y1 = ys[0]*stride-margin, (ys[-1]+1)*stride+margin
+    return [int(max(x0, 0)), int(max(y0, 0)), int(min(x1, shape[1])), int(min(y1, shape[0]))]
+
+def series_bbox(slices, stride=4, margin=16):
+    # [(pixels, slope, intercept)] of one series -> bbox
+    hu = np.stack([downsample_hu(pixels, slope, intercept, stride) for pixels, slope, intercept in slices])
+    return estimate_bbox(hu, slices[0][0].shape, stride=stride, margin=margin)
+
+_volume_cache = None # VolumeCache/ChunkStore handed to the processes through fork
+
+def bbox_job(job):
+    series_id, sorted_image_list, data_dir, stride, margin = job
+    if _volume_cache is not None:
+        slices = [_volume_cache.read_slice(image_id) for image_id in sorted_image_list]
+    else:
+        study_id, series_uid = series_id.split('_')
+        slices = [read_dicom_slice(data_dir+study_id+'/'+series_uid+'/'+image_id+'.dcm') for image_id in sorted_image_list]
+    return series_id, series_bbox(slices, stride=stride, margin=margin)
+
+def build_bbox_dict(series_dict, series_list, bbox_path=None, data_dir=DATA_DIR, volume_cache=None, stride=4, margin=16, num_workers=8):
+    # bbox_path caches the result: series already in it are not estimated again
+    global _volume_cache
+    bbox_dict = {}
+    if bbox_path is not None and os.path.exists(bbox_path):
+        with open(bbox_path, 'rb') as f:
+            bbox_dict = pickle.load(f)
+    _volume_cache = volume_cache
+    jobs = [(series_id, series_dict[series_id]['sorted_image_list'], data_dir, stride, margin) for series_id in series_list if series_id not in bbox_dict]
+    with Pool(num_workers) as pool:
+        for series_id, bbox in tqdm(pool.imap_unordered(bbox_job, jobs), total=len(jobs)):
+            bbox_dict[series_id] = bbox
+    if bbox_path is not None and jobs:
+        with open(bbox_path, 'wb') as f:
+            pickle.dump(bbox_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return bbox_dict
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--series_dict", type=str, default="../process_input/split2/series_dict.pickle", help="series_dict with sorted_image_list")
+    parser.add_argument("--split", type=str, nargs='+', default=["train", "valid"], help="series_list_<split> to estimate, written to bbox_dict_<split>")
+    parser.add_argument("--out_dir", type=str, default="../lung_localization/split2/", help="output directory of the bbox_dict pickles")
+    parser.add_argument("--data_dir", type=str, default=DATA_DIR, help="RSNA PE train directory")
+    parser.add_argument("--volume_cache", type=str, default="", help="volume_cache.py output directory | empty: read DICOM")
+    parser.add_argument("--chunk_store", type=str, default="", help="chunk_store.py output directory | empty: off")
+    parser.add_argument("--stride", type=int, default=4, help="in-plane downsampling")
+    parser.add_argument("--margin", type=int, default=16, help="pixels added around the lungs")
+    parser.add_argument("--worker", type=int, default=12, help="Number of workers")
+    args = parser.parse_args()
+
+    from volume_cache import VolumeCache # both import lung_bbox
+    from chunk_store import ChunkStore
+    volume_cache = VolumeCache(args.volume_cache) if args.volume_cache else None
+    if args.chunk_store:
+        volume_cache = ChunkStore(args.chunk_store)
+    with open(args.series_dict, 'rb') as f:
+        series_dict = pickle.load(f)
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    for split in args.split:
+        with open(os.path.join(os.path.dirname(args.series_dict), 'series_list_'+split+'.pickle'), 'rb') as f:
+            series_list = pickle.load(f)
+        bbox_path = os.path.join(args.out_dir, 'bbox_dict_'+split+'.pickle')
+        print("Series to localize ({}): {}".format(split, len(series_list)))
+        build_bbox_dict(series_dict, series_list, bbox_path, data_dir=args.data_dir, volume_cache=volume_cache, stride=args.stride, margin=args.margin, num_workers=args.worker)
+        print("bbox_dict written to", bbox_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import glob
+import json
+import os
+import pickle
+from collections.abc import Mapping
+
+import numpy as np
+
+# Memory-mapped replacement for the process_input / lung_localization pickles. One .npy per
+# column, opened with mmap_mode='r' on first access, so opening the store only reads the
+# manifest and forked DataLoader workers share the pages instead of copying dicts of dicts:
+#   image_ids.npy             S      sorted SOPInstanceUIDs, the row order of every image column
+#   image_series.npy          int32  row into series_ids.npy
+#   image_minus1.npy          int32  row of the previous slice
+#   image_plus1.npy           int32  row of the next slice
+#   image_pe_present.npy      uint8  pe_present_on_image
+#   series_ids.npy            S      sorted (interned) 'study_series' strings, the row order of every series column
+#   series_<field>.npy               one column per scalar series_dict field (the exam labels)
+#   series_image_offsets.npy  int64  sorted_image_list of series row r is
+#   series_image_rows.npy     int32  image rows [offsets[r]:offsets[r+1]]
+#   series_dict_rows.npy      int32  series rows that are keys of series_dict
+#   image_list_<name>.npy     int32  image rows
+#   series_list_<name>.npy    int32  series rows
+#   bbox_dict_<name>.npy      int32  [x0, y0, x1, y1] per series row, -1 where the series has no box
+#   manifest.json                    entries, series fields and the source pickles they were converted from
+IMAGE_FIELDS = ('series_id', 'image_minus1', 'image_plus1', 'pe_present_on_image')
+
+
+def rows(table, keys):
+    return np.searchsorted(table, np.array(keys, dtype='S')).astype(np.int32)
+
+def build_image_table(image_dict, store_dir, series_ids):
+    image_ids = np.array(sorted(image_dict.keys()), dtype='S')
+    ids = [image_id.decode() for image_id in image_ids]
+    np.save(os.path.join(store_dir, 'image_ids.npy'), image_ids)
+    np.save(os.path.join(store_dir, 'image_series.npy'), rows(series_ids, [image_dict[i]['series_id'] for i in ids]))
+    np.save(os.path.join(store_dir, 'image_minus1.npy'), rows(image_ids, [image_dict[i]['image_minus1'] for i in ids]))
+    np.save(os.path.join(store_dir, 'image_plus1.npy'), rows(image_ids, [image_dict[i]['image_plus1'] for i in ids]))
+    np.save(os.path.join(store_dir, 'image_pe_present.npy'), np.array([image_dict[i]['pe_present_on_image'] for i in ids], dtype=np.uint8))
+    return image_ids
+
+def build_series_table(series_dict, store_dir, series_ids, image_ids):
+    ids = [series_id.decode() for series_id in series_ids]
+    fields = sorted(k for k, v in next(iter(series_dict.values())).items() if np.isscalar(v))
+    for field in fields:
+        np.save(os.path.join(store_dir, 'series_'+field+'.npy'), np.array([series_dict[s][field] if s in series_dict else 0 for s in ids]))
+    sorted_image_lists = [series_dict[s]['sorted_image_list'] if s in series_dict else [] for s in ids]
+    np.save(os.path.join(store_dir, 'series_image_offsets.npy'), np.cumsum([0]+[len(l) for l in sorted_image_lists], dtype=np.int64))
+    np.save(os.path.join(store_dir, 'series_image_rows.npy'), rows(image_ids, [i for l in sorted_image_lists for i in l]))
+    np.save(os.path.join(store_dir, 'series_dict_rows.npy'), rows(series_ids, sorted(series_dict.keys())))
+    return fields
+
+def build_bbox_table(bbox_dict, path, series_ids):
+    boxes = np.full((len(series_ids), 4), -1, dtype=np.int32)
+    for series_id, bbox in bbox_dict.items():
+        assert min(bbox) >= 0, (series_id, bbox)
+        boxes[rows(series_ids, [series_id])[0]] = bbox
+    np.save(path, boxes)
+
+def build_metadata_store(pickle_paths, store_dir):
+    # pickle_paths: image_dict, series_dict, image_list_*, series_list_*, bbox_dict_* pickles
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    objects, sources = {}, {}
+    for path in pickle_paths:
+        name = os.path.basename(path)[:-len('.pickle')]
+        assert name not in objects, 'two sources for '+name
+        with open(path, 'rb') as f:
+            objects[name] = pickle.load(f)
+        stat = os.stat(path)
+        sources[os.path.realpath(path)] = {'name': name, 'size': stat.st_size, 'mtime': stat.st_mtime}
+    image_dict = objects['image_dict']
+    series_ids = set(v['series_id'] for v in image_dict.values())
+    for name, obj in objects.items():
+        if name == 'series_dict' or name.startswith('bbox_dict_'):
+            series_ids.update(obj.keys())
+        elif name.startswith('series_list_'):
+            series_ids.update(obj)
+    series_ids = np.array(sorted(series_ids), dtype='S')
+    np.save(os.path.join(store_dir, 'series_ids.npy'), series_ids)
+    image_ids = build_image_table(image_dict, store_dir, series_ids)
+    fields = []
+    for name, obj in objects.items():
+        if name == 'series_dict':
+            fields = build_series_table(obj, store_dir, series_ids, image_ids)
+        elif name.startswith('image_list_'):
+            np.save(os.path.join(store_dir, name+'.npy'), rows(image_ids, obj))
+        elif name.startswith('series_list_'):
+            np.save(os.path.join(store_dir, name+'.npy'), rows(series_ids, obj))
+        elif name.startswith('bbox_dict_'):
+            build_bbox_table(obj, os.path.join(store_dir, name+'.npy'), series_ids)
+    with open(os.path.join(store_dir, 'manifest.json'), 'w') as f:
+        json.dump({'entries': sorted(objects.keys()), 'series_fields': fields, 'sources': sources}, f, indent=1)
+
+
+class StringColumn(object):
+    """Read-only list of strings kept as rows into one fixed-width bytes array (no per-item PyObjects)"""
+    def __init__(self, values, rows=None):
+        self.values = values if isinstance(values, np.ndarray) else np.array(values, dtype='S')
+        self.rows = rows
+    def __len__(self):
+        return len(self.values) if self.rows is None else len(self.rows)
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return StringColumn(self.values, np.arange(len(self))[index] if self.rows is None else self.rows[index])
+        return (self.values[index] if self.rows is None else self.values[self.rows[index]]).decode()
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class Table(Mapping):
+    """Read-only mapping over the rows of a sorted id column"""
+    def __init__(self, ids):
+        self.ids = ids
+    def row(self, key):
+        row = np.searchsorted(self.ids, key.encode())
+        if row == len(self.ids) or self.ids[row] != key.encode():
+            raise KeyError(key)
+        return row
+    def __contains__(self, key):
+        try:
+            self.row(key)
+        except KeyError:
+            return False
+        return True
+    def __iter__(self):
+        return (key.decode() for key in self.ids)
+    def __len__(self):
+        return len(self.ids)
+
+
+class Record(Mapping):
+    """Dict-like view of one row of a Table"""
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+    def __getitem__(self, key):
+        return self.table.field(self.row, key)
+    def __iter__(self):
+        return iter(self.table.fields)
+    def __len__(self):
+        return len(self.table.fields)
+
+
+class ImageTable(Table):
+    """image_dict backed by the image columns"""
+    fields = IMAGE_FIELDS
+    def __init__(self, store):
+        super().__init__(store.column('image_ids'))
+        self.image_series = store.column('image_series')
+        self.image_minus1 = store.column('image_minus1')
+        self.image_plus1 = store.column('image_plus1')
+        self.pe_present = store.column('image_pe_present')
+        self.series_ids = store.column('series_ids')
+    def field(self, row, key):
+        if key == 'series_id':
+            return self.series_ids[self.image_series[row]].decode()
+        elif key == 'image_minus1':
+            return self.ids[self.image_minus1[row]].decode()
+        elif key == 'image_plus1':
+            return self.ids[self.image_plus1[row]].decode()
+        elif key == 'pe_present_on_image':
+            return int(self.pe_present[row])
+        raise KeyError(key)
+    def __getitem__(self, image_id):
+        return Record(self, self.row(image_id))
+
+
+class SeriesTable(Table):
+    """series_dict backed by the series columns"""
+    def __init__(self, store):
+        # series_ids also holds the series that only appear in image_dict / bbox_dict
+        self.present = np.array(store.column('series_dict_rows'))
+        super().__init__(store.column('series_ids')[self.present])
+        self.offsets = store.column('series_image_offsets')
+        self.image_ids = store.column('image_ids')
+        self.image_rows = store.column('series_image_rows')
+        self.fields = ['sorted_image_list']+store.manifest['series_fields']
+        self.columns = {field: store.column('series_'+field) for field in store.manifest['series_fields']}
+    def field(self, row, key):
+        row = self.present[row]
+        if key == 'sorted_image_list':
+            return StringColumn(self.image_ids, self.image_rows[self.offsets[row]:self.offsets[row+1]])
+        return self.columns[key][row].item()
+    def __getitem__(self, series_id):
+        return Record(self, self.row(series_id))
+
+
+class BboxTable(Table):
+    """bbox_dict_<name> backed by one (num_series, 4) column"""
+    def __init__(self, store, name):
+        series_ids = store.column('series_ids')
+        boxes = store.column(name)
+        present = np.flatnonzero(boxes[:, 0] >= 0)
+        super().__init__(series_ids[present])
+        self.boxes = boxes[present]
+    def __getitem__(self, series_id):
+        return [int(v) for v in self.boxes[self.row(series_id)]]
+
+
+class MetadataStore(object):
+    """Opens the columns written by build_metadata_store on first access"""
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.entries = {}
+    def column(self, name):
+        return np.load(os.path.join(self.store_dir, name+'.npy'), mmap_mode='r')
+    def get(self, name):
+        # name is the basename of the source pickle: image_dict, series_dict, image_list_train, bbox_dict_valid, ...
+        if name not in self.manifest['entries']:
+            raise KeyError(name)
+        if name not in self.entries:
+            if name == 'image_dict':
+                self.entries[name] = ImageTable(self)
+            elif name == 'series_dict':
+                self.entries[name] = SeriesTable(self)
+            elif name.startswith('image_list_'):
+                self.entries[name] = StringColumn(self.column('image_ids'), self.column(name))
+            elif name.startswith('series_list_'):
+                self.entries[name] = StringColumn(self.column('series_ids'), self.column(name))
+            elif name.startswith('bbox_dict_'):
+                self.entries[name] = BboxTable(self, name)
+        return self.entries[name]
+    def source(self, pickle_path):
+        # entry converted from pickle_path, None if it was not converted or the pickle changed since
+        source = self.manifest['sources'].get(os.path.realpath(pickle_path))
+        if source is None:
+            return None
+        if os.path.exists(pickle_path):
+            stat = os.stat(pickle_path)
+            if stat.st_size != source['size'] or stat.st_mtime != source['mtime']:
+                print("[INFO] metadata store is stale for", pickle_path)
+                return None
+        return self.get(source['name'])
+
+
+def load_pickle(path, store=None, pickle_module=pickle):
+    """store entry converted from path if there is one, else the unpickled file"""
+    entry = store.source(path) if store is not None else None
+    if entry is not None:
+        return entry
+    with open(path, 'rb') as f:
+        return pickle_module.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--process_dir", type=str, default="../process_input/split2/", help="image_dict, series_dict, image_list_*, series_list_* pickles")
+    parser.add_argument("--bbox_dir", type=str, default="../lung_localization/split2/", help="bbox_dict_* pickles")
+    parser.add_argument("--store_dir", type=str, default="../process_input/split2/metadata/", help="output directory")
+    args = parser.parse_args()
+
+    pickle_paths = [os.path.join(args.process_dir, 'image_dict.pickle'), os.path.join(args.process_dir, 'series_dict.pickle')]
+    pickle_paths += sorted(glob.glob(os.path.join(args.process_dir, 'image_list_*.pickle')))
+    pickle_paths += sorted(glob.glob(os.path.join(args.process_dir, 'series_list_*.pickle')))
+    pickle_paths += sorted(glob.glob(os.path.join(args.bbox_dir, 'bbox_dict_*.pickle')))
+    pickle_paths = [path for path in pickle_paths if os.path.exists(path)]
+    print("Converting:", *pickle_paths, sep='\n  ')
+    build_metadata_store(pickle_paths, args.store_dir)
+    print("Metadata store written to", args.store_dir)
+
+
+if __name__ == "__main__":
+    main()
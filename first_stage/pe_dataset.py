@@ -0,0 +1,198 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+import pydicom
+import torch
+from torchvision import transforms
+from torch.utils.data import Dataset
+
+from batch_transforms import normalize_
+from val_cache import ValCache
+from windowing import WindowLUT, check_dtype, window
+
+DATA_DIR = ' '
+
+def read_dicom_slice(path, timers=None):
+    """Returns (stored pixels, RescaleSlope, RescaleIntercept) of one DICOM slice"""
+    if timers is None:
+        data = pydicom.dcmread(path)
+        return data.pixel_array, data.RescaleSlope, data.RescaleIntercept
+    t = time.perf_counter_ns()
+    data = pydicom.dcmread(path)
+    t = timers.lap('read', t)
+    pixels = data.pixel_array
+    timers.lap('decode', t)
+    return pixels, data.RescaleSlope, data.RescaleIntercept
+
+def batch_collate(batch):
+    # __getitems__ of the *_batch datasets already returns the collated (images, labels)
+    return batch
+
+
+class PEDataset(Dataset):
+    def __init__(self, image_dict, bbox_dict, image_list, target_size, transform, data_dir=DATA_DIR, volume_cache=None, slice_cache=None, dicom_index=None, io_threads=0, uint8=False, decoder=None, timers=None):
+        self.image_dict=image_dict  # 1790594
+        self.bbox_dict=bbox_dict  # should be 6,279
+        self.image_list=image_list  # should be 6,279
+        self.target_size=target_size
+        self.transform=transform
+        self.data_dir=data_dir
+        self.volume_cache=volume_cache  # VolumeCache or None => read DICOM files
+        self.slice_cache=slice_cache  # SliceCache or None => decode every slice of every triplet
+        self.dicom_index=dicom_index  # DicomIndex or None => parse every DICOM header
+        self.io_threads=io_threads  # 0 => read the slices of a triplet one after the other
+        self.decoder=decoder  # DicomDecoder or None => pydicom's pixel_array
+        self.timers=timers  # StageTimers or None => no clock calls
+        self.io_pool=None
+        self.io_pool_pid=None
+        self.uint8=uint8  # True => emit uint8 round(255*x) images, normalized after the transfer to the GPU
+        self.window_lut=WindowLUT(WL=100, WW=700, dtype=np.uint8 if uint8 else np.float32)
+    def __len__(self):
+        return len(self.image_list)
+    def triplet_ids(self, index):
+        image_id = self.image_list[index]
+        return self.image_dict[image_id]['image_minus1'], image_id, self.image_dict[image_id]['image_plus1']
+    def clock(self):
+        # stage timing: ns start for lap(), no clock call without timers
+        return time.perf_counter_ns() if self.timers is not None else 0
+    def lap(self, stage, start):
+        return self.timers.lap(stage, start) if self.timers is not None else 0
+    def dicom_path(self, image_id):
+        study_id, series_id = self.image_dict[image_id]['series_id'].split('_')
+        return self.data_dir+study_id+'/'+series_id+'/'+image_id+'.dcm'
+    def read_slice(self, image_id):
+        # (pixels, slope, intercept)
+        if self.volume_cache is not None or self.dicom_index is not None:
+            t = self.clock()
+            x = (self.volume_cache or self.dicom_index).read_slice(image_id)
+            self.lap('read', t)
+            return x
+        if self.decoder is not None:
+            return self.decoder.read(self.dicom_path(image_id), self.timers)
+        return read_dicom_slice(self.dicom_path(image_id), self.timers)
+    def read_slices(self, image_ids):
+        # read_slice of every id, issued concurrently on the I/O thread pool when io_threads > 0
+        if self.decoder is not None and self.decoder.threads > 0 and self.volume_cache is None and self.dicom_index is None:
+            return self.decoder.read_batch([self.dicom_path(image_id) for image_id in image_ids], self.timers) # frames decoded on the decoder's pool
+        if self.io_threads <= 0 or len(image_ids) < 2:
+            return [self.read_slice(image_id) for image_id in image_ids]
+        if self.io_pool_pid != os.getpid(): # threads do not survive the fork into DataLoader workers
+            self.io_pool = ThreadPoolExecutor(self.io_threads)
+            self.io_pool_pid = os.getpid()
+        return list(self.io_pool.map(self.read_slice, image_ids))
+    def load_triplet(self, index):
+        # (minus1, center, plus1) as [(pixels, slope, intercept), ...]
+        image_ids = self.triplet_ids(index)
+        if self.slice_cache is not None:
+            # read the misses together, then go through the cache (not thread-safe) in order
+            misses = [image_id for image_id in set(image_ids) if image_id not in self.slice_cache]
+            slices = dict(zip(misses, self.read_slices(misses)))
+            return [self.slice_cache.get(image_id, lambda i: slices[i] if i in slices else self.read_slice(i)) for image_id in image_ids]
+        if self.volume_cache is not None:
+            t = self.clock()
+            triplet = self.volume_cache.read_triplet(*image_ids)
+            self.lap('read', t)
+            return triplet
+        return self.read_slices(image_ids)
+    def load_triplets(self, indices):
+        # triplets of a whole batch; without a cache all the slices of the batch are read concurrently
+        concurrent = self.io_threads > 0 or (self.decoder is not None and self.decoder.threads > 0)
+        if not concurrent or self.slice_cache is not None or self.volume_cache is not None:
+            return [self.load_triplet(index) for index in indices]
+        slices = iter(self.read_slices([image_id for index in indices for image_id in self.triplet_ids(index)]))
+        return [[next(slices) for _ in range(3)] for _ in indices]
+    def load_crop(self, index, triplet=None):
+        # lung-cropped, windowed HxWx3 image at the stored resolution
+        if triplet is None:
+            triplet = self.load_triplet(index)
+        bbox = self.bbox_dict[self.image_dict[self.image_list[index]]['series_id']]
+        t = self.clock()
+        x = self.window_lut.window_triplet(triplet, bbox=bbox) # crop + rescale + window(WL=100, WW=700) + concat
+        self.lap('window', t)
+        return check_dtype(x, 'window')
+    def load_image(self, index):
+        # lung-cropped, windowed and resized HxWx3 image
+        x = self.load_crop(index)
+        t = self.clock()
+        x = cv2.resize(x, (self.target_size,self.target_size))
+        self.lap('resize', t)
+        return check_dtype(x, 'resize')
+    def load_batch(self, indices):
+        # resized images written in place into one NHWC buffer, returned as its NCHW (channels_last) view
+        x = torch.empty((len(indices), self.target_size, self.target_size, 3), dtype=torch.uint8 if self.uint8 else torch.float32)
+        buffer = x.numpy()
+        for k, (index, triplet) in enumerate(zip(indices, self.load_triplets(indices))):
+            crop = self.load_crop(index, triplet)
+            t = self.clock()
+            cv2.resize(crop, (self.target_size,self.target_size), dst=buffer[k])
+            self.lap('resize', t)
+        return x.permute(0, 3, 1, 2)
+    def labels(self, indices):
+        return torch.tensor([self.image_dict[self.image_list[index]]['pe_present_on_image'] for index in indices])
+    def __getitem__(self,index):
+        start = self.clock()
+        x = self.load_image(index)
+        if self.transform is not None: # None with uint8=True, augmented on the GPU
+            t = self.clock()
+            x = check_dtype(self.transform(image=x)['image'], 'transform')
+            self.lap('transform', t)
+        x = x.transpose(2, 0, 1)
+        self.lap('sample', start)
+        y = self.image_dict[self.image_list[index]]['pe_present_on_image']
+        return x, y
+
+class PEDataset_val(PEDataset):
+    def __init__(self, image_dict, bbox_dict, image_list, target_size, data_dir=DATA_DIR, volume_cache=None, slice_cache=None, dicom_index=None, io_threads=0, uint8=False, decoder=None, timers=None, val_cache_dir=None):
+        super().__init__(image_dict, bbox_dict, image_list, target_size, None, data_dir=data_dir, volume_cache=volume_cache, slice_cache=slice_cache, dicom_index=dicom_index, io_threads=io_threads, uint8=uint8, decoder=decoder, timers=timers)
+        self.val_cache=ValCache(val_cache_dir, self) if val_cache_dir else None  # None => load every image on every pass
+    def __getitem__(self,index):
+        start = self.clock()
+        if self.val_cache is not None:
+            x = self.val_cache.get(index, self.load_image) # uint8, ToTensor scales it back to [0, 1]
+        else:
+            x = self.load_image(index)
+        if self.uint8:
+            self.lap('sample', start)
+            return x.transpose(2, 0, 1), self.image_dict[self.image_list[index]]['pe_present_on_image']
+        t = self.clock()
+        x = transforms.ToTensor()(x)
+        # x = transforms.Normalize(mean=[0.456, 0.456, 0.456], std=[0.224, 0.224, 0.224])(x) # old
+        x = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])(x) # New
+        self.lap('transform', t)
+        self.lap('sample', start)
+        y = self.image_dict[self.image_list[index]]['pe_present_on_image']
+        return x, y
+
+class PEDataset_batch(PEDataset):
+    """PEDataset fetching whole batches through __getitems__, for DataLoader(collate_fn=batch_collate).
+    transform is a batch_transforms callable on the NCHW float32 batch, None with uint8=True."""
+    def __getitems__(self, indices):
+        start = self.clock()
+        x = self.load_batch(indices)
+        if self.transform is not None:
+            t = self.clock()
+            x = check_dtype(self.transform(x), 'transform')
+            self.lap('transform', t)
+        self.lap('batch', start)
+        return x, self.labels(indices)
+
+class PEDataset_val_batch(PEDataset_val):
+    """PEDataset_val fetching whole batches through __getitems__, for DataLoader(collate_fn=batch_collate)"""
+    def __getitems__(self, indices):
+        start = self.clock()
+        if self.val_cache is not None:
+            x = np.stack([self.val_cache.get(index, self.load_image) for index in indices])
+            x = torch.from_numpy(x).permute(0, 3, 1, 2)
+            if not self.uint8:
+                x = x.float().div_(255.0)
+        else:
+            x = self.load_batch(indices)
+        if not self.uint8:
+            t = self.clock()
+            x = normalize_(x)
+            self.lap('transform', t)
+        self.lap('batch', start)
+        return x, self.labels(indices)
@@ -0,0 +1,54 @@
+import contextlib
+
+import torch
+
+# Mixed precision of the training / validation / feature extraction loops, replacing apex amp O1:
+#   fp32: no autocast; fp16: autocast to float16 with dynamic loss scaling (what O1 did);
+#   bf16: autocast to bfloat16, same exponent range as float32 so no loss scaling (also on CPU).
+PRECISIONS = ('fp32', 'fp16', 'bf16')
+AUTOCAST_DTYPES = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+def to_float32(outputs):
+    # float32 copies of the floating point tensors of a model output (tensor, tuple or list),
+    # numpy has no bfloat16 and the losses / sigmoids are taken in float32 as under O1
+    if torch.is_tensor(outputs):
+        return outputs.float() if outputs.is_floating_point() else outputs
+    if isinstance(outputs, (tuple, list)):
+        return type(outputs)(to_float32(x) for x in outputs)
+    return outputs
+
+
+class Precision(object):
+    """autocast + GradScaler of one --precision setting on one device.
+
+    with precision.autocast(): logits = to_float32(model(images))
+    precision.backward(loss); precision.step(optimizer)
+    """
+    def __init__(self, precision='fp16', device='cuda'):
+        if precision not in PRECISIONS:
+            raise ValueError("precision must be one of {}, got {}".format(PRECISIONS, precision))
+        self.precision = precision
+        self.device_type = torch.device(device).type
+        self.dtype = AUTOCAST_DTYPES.get(precision)
+        scaled = precision == 'fp16'
+        try:
+            self.scaler = torch.amp.GradScaler(self.device_type, enabled=scaled)
+        except (AttributeError, TypeError): # torch < 2.3: CUDA only
+            self.scaler = torch.cuda.amp.GradScaler(enabled=scaled and self.device_type == 'cuda')
+    def autocast(self):
+        if self.dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(self.device_type, dtype=self.dtype)
+    def backward(self, loss):
+        self.scaler.scale(loss).backward()
+    def step(self, optimizer):
+        # skips the step when fp16 gradients overflowed, like amp.scale_loss
+        self.scaler.step(optimizer)
+        self.scaler.update()
+    def state_dict(self):
+        return self.scaler.state_dict()
+    def load_state_dict(self, state_dict):
+        self.scaler.load_state_dict(state_dict)
+    def __repr__(self):
+        return 'Precision({}, {})'.format(self.precision, self.device_type)
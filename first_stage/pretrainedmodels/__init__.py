@@ -1,58 +1,65 @@
 from __future__ import print_function, division, absolute_import
-from .fbresnet import fbresnet152
+import importlib
 
-from .cafferesnet import cafferesnet101
+# Models are imported on first access (PEP 562): `import pretrainedmodels.senet` no longer
+# imports every architecture, resnext_features alone takes over a second.
+_MODULES = {
+    'fbresnet152': 'fbresnet',
+    'cafferesnet101': 'cafferesnet',
+    'bninception': 'bninception',
+    'resnext101_32x4d': 'resnext',
+    'resnext101_64x4d': 'resnext',
+    'inceptionv4': 'inceptionv4',
+    'inceptionresnetv2': 'inceptionresnetv2',
+    'nasnetalarge': 'nasnet',
+    'nasnetamobile': 'nasnet_mobile',
+    'alexnet': 'torchvision_models',
+    'densenet121': 'torchvision_models',
+    'densenet169': 'torchvision_models',
+    'densenet201': 'torchvision_models',
+    'densenet161': 'torchvision_models',
+    'resnet18': 'torchvision_models',
+    'resnet34': 'torchvision_models',
+    'resnet50': 'torchvision_models',
+    'resnet101': 'torchvision_models',
+    'resnet152': 'torchvision_models',
+    'inceptionv3': 'torchvision_models',
+    'squeezenet1_0': 'torchvision_models',
+    'squeezenet1_1': 'torchvision_models',
+    'vgg11': 'torchvision_models',
+    'vgg11_bn': 'torchvision_models',
+    'vgg13': 'torchvision_models',
+    'vgg13_bn': 'torchvision_models',
+    'vgg16': 'torchvision_models',
+    'vgg16_bn': 'torchvision_models',
+    'vgg19_bn': 'torchvision_models',
+    'vgg19': 'torchvision_models',
+    'dpn68': 'dpn',
+    'dpn68b': 'dpn',
+    'dpn92': 'dpn',
+    'dpn98': 'dpn',
+    'dpn131': 'dpn',
+    'dpn107': 'dpn',
+    'xception': 'xception',
+    'senet154': 'senet',
+    'se_resnet50': 'senet',
+    'se_resnet101': 'senet',
+    'se_resnet152': 'senet',
+    'se_resnext50_32x4d': 'senet',
+    'se_resnext101_32x4d': 'senet',
+    'pnasnet5large': 'pnasnet',
+    'polynet': 'polynet',
+}
 
-from .bninception import bninception
+__all__ = list(_MODULES)
 
-from .resnext import resnext101_32x4d
-from .resnext import resnext101_64x4d
 
-from .inceptionv4 import inceptionv4
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + _MODULES[name], __name__), name)
+    globals()[name] = value # the submodule import bound e.g. `xception` to the module
+    return value
 
-from .inceptionresnetv2 import inceptionresnetv2
-
-from .nasnet import nasnetalarge
-
-from .nasnet_mobile import nasnetamobile
-
-from .torchvision_models import alexnet
-from .torchvision_models import densenet121
-from .torchvision_models import densenet169
-from .torchvision_models import densenet201
-from .torchvision_models import densenet161
-from .torchvision_models import resnet18
-from .torchvision_models import resnet34
-from .torchvision_models import resnet50
-from .torchvision_models import resnet101
-from .torchvision_models import resnet152
-from .torchvision_models import inceptionv3
-from .torchvision_models import squeezenet1_0
-from .torchvision_models import squeezenet1_1
-from .torchvision_models import vgg11
-from .torchvision_models import vgg11_bn
-from .torchvision_models import vgg13
-from .torchvision_models import vgg13_bn
-from .torchvision_models import vgg16
-from .torchvision_models import vgg16_bn
-from .torchvision_models import vgg19_bn
-from .torchvision_models import vgg19
-
-from .dpn import dpn68
-from .dpn import dpn68b
-from .dpn import dpn92
-from .dpn import dpn98
-from .dpn import dpn131
-from .dpn import dpn107
-
-from .xception import xception
-
-from .senet import senet154
-from .senet import se_resnet50
-from .senet import se_resnet101
-from .senet import se_resnet152
-from .senet import se_resnext50_32x4d
-from .senet import se_resnext101_32x4d
-
-from .pnasnet import pnasnet5large
-from .polynet import polynet
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -324,6 +324,9 @@ class SENet(nn.Module):
         self.avg_pool = nn.AvgPool2d(7, stride=1)
         self.dropout = nn.Dropout(dropout_p) if dropout_p is not None else None
         self.last_linear = nn.Linear(512 * block.expansion, num_classes)
+        # checkpointing.set_checkpointing: runs the blocks of layer1-layer4 with activation
+        # checkpointing while gradients are enabled
+        self.checkpoint_blocks = None
 
     def _make_layer(self, block, planes, blocks, groups, reduction, stride=1,
                     downsample_kernel_size=1, downsample_padding=0):
@@ -347,6 +350,8 @@ class SENet(nn.Module):
 
     def features(self, x):
         x = self.layer0(x)
+        if self.checkpoint_blocks is not None and torch.is_grad_enabled():
+            return self.checkpoint_blocks(list(self.layer1) + list(self.layer2) + list(self.layer3) + list(self.layer4), x)
         x = self.layer1(x)
         x = self.layer2(x)
         x = self.layer3(x)
@@ -0,0 +1,183 @@
+import torch.nn as nn
+
+# Squeeze-and-excitation blocks added to torchvision ResNet50 / Xception, the seresnet50_manual and
+# sexception backbones of backbones.py
+
+
+class SEModule(nn.Module):
+
+    def __init__(self, channels, reduction):
+        super(SEModule, self).__init__()
+        self.avg_pool = nn.AdaptiveAvgPool2d(1)
+        self.fc1 = nn.Conv2d(channels, channels // reduction, kernel_size=1,
+                             padding=0)
+        self.relu = nn.ReLU(inplace=True)
+        self.fc2 = nn.Conv2d(channels // reduction, channels, kernel_size=1,
+                             padding=0)
+        self.sigmoid = nn.Sigmoid()
+
+    def forward(self, x):
+        module_input = x
+        x = self.avg_pool(x)
+        x = self.fc1(x)
+        x = self.relu(x)
+        x = self.fc2(x)
+        x = self.sigmoid(x)
+        return module_input * x
+
+def convert_to_SE_ResNet50(model):
+    reduction_ratio = 16
+    for index in range(0,len(model.layer1)): # layer1[0-2]
+        # if index == 0:
+        #     kkk = 1
+        #     model.layer1[index] = nn.Sequential(model.layer1[index].conv1, 
+        #                                                   model.layer1[index].bn1, 
+        #                                                   model.layer1[index].conv2,
+        #                                                   model.layer1[index].bn2,
+        #                                                   model.layer1[index].conv3,
+        #                                                   model.layer1[index].bn3,
+        #                                                   model.layer1[index].relu,
+        #                                                   SEModule(model.layer1[index].bn3.num_features, reduction_ratio),
+        #                                                   model.layer1[index].downsample)
+        # else:
+        #     model.layer1[index] = nn.Sequential(model.layer1[index], SEModule(model.layer1[index].bn3.num_features, reduction_ratio))
+        model.layer1[index] = nn.Sequential(model.layer1[index], SEModule(model.layer1[index].bn3.num_features, reduction_ratio))
+        model.layer1[index][1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+        model.layer1[index][1].fc1.bias.data.zero_()
+        model.layer1[index][1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+        model.layer1[index][1].fc2.bias.data.zero_()
+
+    for index in range(0, len(model.layer2)): # layer2[0-3]
+        # if index == 0:
+        #     kkk = 1
+        #     model.layer2[index] = nn.Sequential(model.layer2[index].conv1, 
+        #                                                   model.layer2[index].bn1, 
+        #                                                   model.layer2[index].conv2,
+        #                                                   model.layer2[index].bn2,
+        #                                                   model.layer2[index].conv3,
+        #                                                   model.layer2[index].bn3,
+        #                                                   model.layer2[index].relu,
+        #                                                   SEModule(model.layer2[index].bn3.num_features, reduction_ratio),
+        #                                                   model.layer2[index].downsample)
+        # else:
+        #     model.layer2[index] = nn.Sequential(model.layer2[index], SEModule(model.layer2[index].bn3.num_features, reduction_ratio))
+        model.layer2[index] = nn.Sequential(model.layer2[index], SEModule(model.layer2[index].bn3.num_features, reduction_ratio))
+        model.layer2[index][1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+        model.layer2[index][1].fc1.bias.data.zero_()
+        model.layer2[index][1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+        model.layer2[index][1].fc2.bias.data.zero_()
+            
+    for index in range(0, len(model.layer3)): # layer3[0-5]
+        # if index == 0:
+        #     kkk = 1
+        #     model.layer3[index] = nn.Sequential(model.layer3[index].conv1, 
+        #                                                   model.layer3[index].bn1, 
+        #                                                   model.layer3[index].conv2,
+        #                                                   model.layer3[index].bn2,
+        #                                                   model.layer3[index].conv3,
+        #                                                   model.layer3[index].bn3,
+        #                                                   model.layer3[index].relu,
+        #                                                   SEModule(model.layer3[index].bn3.num_features, reduction_ratio),
+        #                                                   model.layer3[index].downsample)
+        # else:
+        #     model.layer3[index] = nn.Sequential(model.layer3[index], SEModule(model.layer3[index].bn3.num_features, reduction_ratio))
+        model.layer3[index] = nn.Sequential(model.layer3[index], SEModule(model.layer3[index].bn3.num_features, reduction_ratio))
+        model.layer3[index][1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+        model.layer3[index][1].fc1.bias.data.zero_()
+        model.layer3[index][1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+        model.layer3[index][1].fc2.bias.data.zero_()
+
+    for index in range(0, len(model.layer4)): # layer4[0-2]
+        # if index == 0:
+        #     kkk = 1
+        #     model.layer4[index] = nn.Sequential(model.layer4[index].conv1, 
+        #                                                   model.layer4[index].bn1, 
+        #                                                   model.layer4[index].conv2,
+        #                                                   model.layer4[index].bn2,
+        #                                                   model.layer4[index].conv3,
+        #                                                   model.layer4[index].bn3,
+        #                                                   model.layer4[index].relu,
+        #                                                   SEModule(model.layer4[index].bn3.num_features, reduction_ratio),
+        #                                                   model.layer4[index].downsample)
+        # else:
+        #     model.layer4[index] = nn.Sequential(model.layer4[index], SEModule(model.layer4[index].bn3.num_features, reduction_ratio))
+        model.layer4[index] = nn.Sequential(model.layer4[index], SEModule(model.layer4[index].bn3.num_features, reduction_ratio))
+        model.layer4[index][1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+        model.layer4[index][1].fc1.bias.data.zero_()
+        model.layer4[index][1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+        model.layer4[index][1].fc2.bias.data.zero_()
+    return model
+
+def convert_to_SE_Xception(model, reduction_ratio=16):
+    model.block1.rep = nn.Sequential(model.block1.rep, SEModule(model.block1.rep[4].num_features, reduction_ratio))
+    model.block1.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block1.rep[1].fc1.bias.data.zero_()
+    model.block1.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block1.rep[1].fc2.bias.data.zero_()
+        
+    model.block2.rep = nn.Sequential(model.block2.rep, SEModule(model.block2.rep[5].num_features, reduction_ratio))
+    model.block2.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block2.rep[1].fc1.bias.data.zero_()
+    model.block2.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block2.rep[1].fc2.bias.data.zero_()
+    
+    model.block3.rep = nn.Sequential(model.block3.rep, SEModule(model.block3.rep[5].num_features, reduction_ratio))
+    model.block3.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block3.rep[1].fc1.bias.data.zero_()
+    model.block3.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block3.rep[1].fc2.bias.data.zero_()
+    
+    model.block4.rep = nn.Sequential(model.block4.rep, SEModule(model.block4.rep[8].num_features, reduction_ratio))
+    model.block4.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block4.rep[1].fc1.bias.data.zero_()
+    model.block4.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block4.rep[1].fc2.bias.data.zero_()
+    
+    model.block5.rep = nn.Sequential(model.block5.rep, SEModule(model.block5.rep[8].num_features, reduction_ratio))
+    model.block5.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block5.rep[1].fc1.bias.data.zero_()
+    model.block5.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block5.rep[1].fc2.bias.data.zero_()
+    
+    model.block6.rep = nn.Sequential(model.block6.rep, SEModule(model.block6.rep[8].num_features, reduction_ratio))
+    model.block6.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block6.rep[1].fc1.bias.data.zero_()
+    model.block6.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block6.rep[1].fc2.bias.data.zero_()
+    
+    model.block7.rep = nn.Sequential(model.block7.rep, SEModule(model.block7.rep[8].num_features, reduction_ratio))
+    model.block7.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block7.rep[1].fc1.bias.data.zero_()
+    model.block7.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block7.rep[1].fc2.bias.data.zero_()
+    
+    model.block8.rep = nn.Sequential(model.block8.rep, SEModule(model.block8.rep[8].num_features, reduction_ratio))
+    model.block8.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block8.rep[1].fc1.bias.data.zero_()
+    model.block8.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block8.rep[1].fc2.bias.data.zero_()
+    
+    model.block9.rep = nn.Sequential(model.block9.rep, SEModule(model.block9.rep[8].num_features, reduction_ratio))
+    model.block9.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block9.rep[1].fc1.bias.data.zero_()
+    model.block9.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block9.rep[1].fc2.bias.data.zero_()
+    
+    model.block10.rep = nn.Sequential(model.block10.rep, SEModule(model.block10.rep[8].num_features, reduction_ratio))
+    model.block10.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block10.rep[1].fc1.bias.data.zero_()
+    model.block10.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block10.rep[1].fc2.bias.data.zero_()
+    
+    model.block11.rep = nn.Sequential(model.block11.rep, SEModule(model.block11.rep[8].num_features, reduction_ratio))
+    model.block11.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block11.rep[1].fc1.bias.data.zero_()
+    model.block11.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block11.rep[1].fc2.bias.data.zero_()
+    
+    model.block12.rep = nn.Sequential(model.block12.rep, SEModule(model.block12.rep[5].num_features, reduction_ratio))
+    model.block12.rep[1].fc1.weight.data.normal_(mean=0.0, std=0.01)
+    model.block12.rep[1].fc1.bias.data.zero_()
+    model.block12.rep[1].fc2.weight.data.normal_(mean=0.0, std=0.01)
+    model.block12.rep[1].fc2.bias.data.zero_()
+    return model
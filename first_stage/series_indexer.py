@@ -0,0 +1,138 @@
+import argparse
+import csv
+import os
+import pickle
+from multiprocessing import Pool
+
+import numpy as np
+import pydicom
+from tqdm import tqdm
+
+from pe_dataset import DATA_DIR
+
+# Builds the process_input pickles from a <data_dir>/<study>/<series>/<image>.dcm tree:
+#   image_dict[image_id]   = {'series_id', 'image_minus1', 'image_plus1', 'pe_present_on_image'}
+#   series_dict[series_id] = {'sorted_image_list', <exam labels>}, series_id = '<study>_<series>'
+# Slices are sorted along the slice normal (ImagePositionPatient . ImageOrientationPatient normal),
+# the first/last slice is its own minus1/plus1 neighbour. Labels come from an RSNA-style train.csv.
+# <out_dir>/series_index_state.pickle keeps, per study, the (name, size, mtime) of its files and
+# its parsed slices, so a rerun only reads the headers of new or changed studies. It also marks the
+# pickles of out_dir as the indexer's: pickles without it (e.g. the production split) are not overwritten.
+SERIES_LABELS = ['negative_exam_for_pe', 'indeterminate', 'chronic_pe', 'acute_and_chronic_pe', 'central_pe',
+                 'leftsided_pe', 'rightsided_pe', 'rv_lv_ratio_gte_1', 'rv_lv_ratio_lt_1',
+                 'qa_motion', 'qa_contrast', 'flow_artifact', 'true_filling_defect_not_pe']
+HEADER_TAGS = ['ImagePositionPatient', 'ImageOrientationPatient', 'InstanceNumber']
+
+
+def study_signature(study_dir):
+    # sorted (relative path, size, mtime_ns) of every .dcm file of the study
+    signature = []
+    for series_uid in sorted(os.listdir(study_dir)):
+        series_dir = os.path.join(study_dir, series_uid)
+        if not os.path.isdir(series_dir):
+            continue
+        for entry in sorted(os.scandir(series_dir), key=lambda e: e.name):
+            if entry.name.endswith('.dcm'):
+                stat = entry.stat()
+                signature.append((series_uid+'/'+entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+def slice_position(data):
+    # distance along the slice normal, InstanceNumber when the geometry is missing
+    if 'ImagePositionPatient' in data and 'ImageOrientationPatient' in data:
+        orientation = np.array(data.ImageOrientationPatient, dtype=np.float64)
+        return float(np.dot(np.cross(orientation[:3], orientation[3:]), np.array(data.ImagePositionPatient, dtype=np.float64)))
+    return float(data.get('InstanceNumber', 0))
+
+def scan_study(job):
+    # study -> {series_uid: sorted image ids}
+    study_id, study_dir, signature = job
+    series = {}
+    for name, _, _ in signature:
+        series_uid, filename = name.split('/')
+        data = pydicom.dcmread(os.path.join(study_dir, name), stop_before_pixels=True, specific_tags=HEADER_TAGS)
+        series.setdefault(series_uid, []).append((slice_position(data), filename[:-len('.dcm')]))
+    return study_id, signature, {series_uid: [image_id for _, image_id in sorted(slices)] for series_uid, slices in series.items()}
+
+def scan_signature(job):
+    study_id, study_dir = job
+    return study_id, study_signature(study_dir)
+
+def read_labels(label_csv):
+    # RSNA train.csv: one row per image with the image label and the exam labels of its series
+    image_labels, series_labels = {}, {}
+    with open(label_csv, newline='') as f:
+        for row in csv.DictReader(f):
+            image_labels[row['SOPInstanceUID']] = int(row['pe_present_on_image'])
+            series_id = row['StudyInstanceUID']+'_'+row['SeriesInstanceUID']
+            if series_id not in series_labels:
+                series_labels[series_id] = {label: int(row[label]) for label in SERIES_LABELS if label in row}
+    return image_labels, series_labels
+
+def index_studies(data_dir, state=None, num_workers=8):
+    # state: {study_id: (signature, series)} of a previous run; returns the new state and the number of studies read
+    state = dict(state or {})
+    studies = sorted(s for s in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, s)))
+    with Pool(num_workers) as pool:
+        signatures = dict(pool.imap_unordered(scan_signature, [(s, os.path.join(data_dir, s)) for s in studies], chunksize=16))
+        for study_id in set(state) - set(studies):
+            del state[study_id]
+        jobs = [(s, os.path.join(data_dir, s), signatures[s]) for s in studies if s not in state or state[s][0] != signatures[s]]
+        for study_id, signature, series in tqdm(pool.imap_unordered(scan_study, jobs), total=len(jobs)):
+            state[study_id] = (signature, series)
+    return state, len(jobs)
+
+def build_dicts(state, image_labels=None, series_labels=None):
+    image_dict, series_dict = {}, {}
+    for study_id in sorted(state):
+        for series_uid, images in sorted(state[study_id][1].items()):
+            series_id = study_id+'_'+series_uid
+            series_dict[series_id] = {'sorted_image_list': images}
+            if series_labels is not None:
+                series_dict[series_id].update(series_labels.get(series_id, {}))
+            for k, image_id in enumerate(images):
+                image_dict[image_id] = {'series_id': series_id,
+                                        'image_minus1': images[max(k-1, 0)],
+                                        'image_plus1': images[min(k+1, len(images)-1)],
+                                        'pe_present_on_image': image_labels.get(image_id, 0) if image_labels is not None else 0}
+    return image_dict, series_dict
+
+def build_series_index(data_dir, out_dir, label_csv=None, num_workers=8, unlabeled=False):
+    if not label_csv and not unlabeled:
+        raise ValueError('no label_csv: the dicts would have pe_present_on_image=0 and no exam labels, pass unlabeled=True (--unlabeled 1) to write them anyway')
+    state_path = os.path.join(out_dir, 'series_index_state.pickle')
+    if not os.path.exists(state_path):
+        foreign = [name+'.pickle' for name in ('image_dict', 'series_dict') if os.path.exists(os.path.join(out_dir, name+'.pickle'))]
+        if foreign:
+            raise FileExistsError('{} in {} not written by series_indexer.py (no series_index_state.pickle), not overwriting'.format(' / '.join(foreign), out_dir))
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path, 'rb') as f:
+            state = pickle.load(f)
+    state, num_read = index_studies(data_dir, state, num_workers=num_workers)
+    image_labels, series_labels = read_labels(label_csv) if label_csv else (None, None)
+    image_dict, series_dict = build_dicts(state, image_labels, series_labels)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    for name, obj in (('image_dict', image_dict), ('series_dict', series_dict), ('series_index_state', state)):
+        with open(os.path.join(out_dir, name+'.pickle'), 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return image_dict, series_dict, num_read
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default=DATA_DIR, help="<study>/<series>/<image>.dcm tree")
+    parser.add_argument("--label_csv", type=str, default="", help="RSNA-style train.csv | empty: needs --unlabeled 1")
+    parser.add_argument("--unlabeled", type=int, default=0, help="1: without --label_csv, write pe_present_on_image=0 and no exam labels | 0: refuse")
+    parser.add_argument("--out_dir", type=str, required=True, help="output directory of image_dict / series_dict, never pickles it did not write")
+    parser.add_argument("--worker", type=int, default=12, help="Number of workers")
+    args = parser.parse_args()
+
+    image_dict, series_dict, num_read = build_series_index(args.data_dir, args.out_dir, label_csv=args.label_csv or None, num_workers=args.worker, unlabeled=args.unlabeled == 1)
+    print("Studies read: {}, series: {}, images: {}".format(num_read, len(series_dict), len(image_dict)))
+    print("image_dict / series_dict written to", args.out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import math
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+
+def slice_positions(image_dict, image_id):
+    # {image_id: position} of the series of image_id, walking the image_minus1 / image_plus1 links
+    # (the first / last slice links to itself)
+    head, seen = image_id, {image_id}
+    while image_dict[head]['image_minus1'] in image_dict and image_dict[head]['image_minus1'] not in seen:
+        head = image_dict[head]['image_minus1']
+        seen.add(head)
+    positions = {head: 0}
+    while image_dict[head]['image_plus1'] in image_dict and image_dict[head]['image_plus1'] not in positions:
+        head = image_dict[head]['image_plus1']
+        positions[head] = len(positions)
+    return positions
+
+
+class SeriesChunkSampler(Sampler):
+    """DistributedSampler that shuffles contiguous runs of chunk_size slices of one series.
+
+    chunk_size is the locality knob: 1 is a global shuffle like DistributedSampler,
+    larger chunks keep neighbouring slices together so reads are mostly sequential and
+    the minus1/plus1 slices are still in the slice cache.
+    Like DistributedSampler, every rank draws the same permutation for a given
+    (seed, epoch), every sample is visited once per epoch (padded to a multiple of
+    num_replicas) and set_epoch() must be called to reshuffle.
+    """
+    def __init__(self, dataset, chunk_size=32, num_replicas=None, rank=None, shuffle=True, seed=0):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size()
+        if rank is None:
+            rank = dist.get_rank()
+        self.chunk_size = chunk_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        series = OrderedDict()
+        for index, image_id in enumerate(dataset.image_list):
+            series.setdefault(dataset.image_dict[image_id]['series_id'], []).append(index)
+        self.series_indices = []
+        for indices in series.values():
+            # slice order, whatever the order of image_list
+            positions = slice_positions(dataset.image_dict, dataset.image_list[indices[0]])
+            indices.sort(key=lambda index: positions.get(dataset.image_list[index], len(positions)))
+            self.series_indices.append(np.array(indices, dtype=np.int64))
+        self.num_samples = math.ceil(len(dataset) / self.num_replicas)
+        self.total_size = self.num_samples * self.num_replicas
+    def chunks(self, generator):
+        chunks = []
+        for indices in self.series_indices:
+            # random phase so chunk boundaries (and chunk contents) change every epoch
+            offset = int(torch.randint(self.chunk_size, (1,), generator=generator)) if self.shuffle else 0
+            chunks += np.split(indices, np.arange(offset if offset else self.chunk_size, len(indices), self.chunk_size))
+        return chunks
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        chunks = self.chunks(g)
+        if self.shuffle:
+            chunks = [chunks[i] for i in torch.randperm(len(chunks), generator=g).tolist()]
+        indices = np.concatenate(chunks)
+        indices = np.resize(indices, self.total_size) # pad by wrapping around
+        # contiguous block per rank so chunks are not interleaved across ranks
+        indices = indices[self.rank*self.num_samples:(self.rank+1)*self.num_samples]
+        return iter(indices.tolist())
+    def __len__(self):
+        return self.num_samples
+    def set_epoch(self, epoch):
+        self.epoch = epoch
@@ -0,0 +1,211 @@
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+from tqdm import tqdm
+
+from dicom_decode import DicomDecoder
+from dicom_index import DicomIndex
+from metadata_store import MetadataStore, load_pickle
+from pe_dataset import DATA_DIR, PEDataset
+from volume_cache import VolumeCache
+from chunk_store import ChunkStore
+from windowing import WindowLUT, check_dtype
+
+# Stage-1 samples packed into large sequential shards, so training streams a few big files
+# instead of opening three small DICOM files per sample:
+#   <shard_dir>/shard_00000.bin  records back to back, each the C-order bytes of one lung-cropped,
+#                                windowed HxWx3 triplet (uint8 = round(255*window()), or float16)
+#   <shard_dir>/index.npz        one row per record, in file order: image_ids, shard, offset,
+#                                height, width, label (pe_present_on_image); dtype
+
+_pack_dataset = None # PEDataset handed to the packing processes through fork
+
+
+def pack_shard(job):
+    shard, indices, shard_dir, dtype = job
+    image_ids, offsets, heights, widths, labels = [], [], [], [], []
+    offset = 0
+    with open(os.path.join(shard_dir, 'shard_{:05d}.bin'.format(shard)), 'wb') as f:
+        for index in indices:
+            x = np.ascontiguousarray(_pack_dataset.load_crop(index).astype(dtype, copy=False))
+            f.write(x.tobytes())
+            image_id = _pack_dataset.image_list[index]
+            image_ids.append(image_id)
+            offsets.append(offset)
+            heights.append(x.shape[0])
+            widths.append(x.shape[1])
+            labels.append(_pack_dataset.image_dict[image_id]['pe_present_on_image'])
+            offset += x.nbytes
+    return shard, image_ids, offsets, heights, widths, labels
+
+def build_shards(dataset, shard_dir, samples_per_shard=1024, dtype='uint8', num_workers=8, seed=0):
+    # samples are shuffled once here so every shard mixes series and labels
+    global _pack_dataset
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+    dtype = np.dtype(dtype)
+    if dtype == np.uint8:
+        dataset.window_lut = WindowLUT(WL=100, WW=700, dtype=np.uint8)
+    _pack_dataset = dataset
+    order = np.random.default_rng(seed).permutation(len(dataset))
+    jobs = [(k, order[start:start+samples_per_shard], shard_dir, dtype) for k, start in enumerate(range(0, len(order), samples_per_shard))]
+    results = []
+    with Pool(num_workers) as pool:
+        for result in tqdm(pool.imap_unordered(pack_shard, jobs), total=len(jobs)):
+            results.append(result)
+    results.sort(key=lambda r: r[0])
+    np.savez(os.path.join(shard_dir, 'index.npz'),
+             image_ids=np.array([i for r in results for i in r[1]], dtype='S'),
+             shard=np.concatenate([np.full(len(r[1]), r[0], dtype=np.int32) for r in results]),
+             offset=np.concatenate([np.array(r[2], dtype=np.int64) for r in results]),
+             height=np.concatenate([np.array(r[3], dtype=np.int32) for r in results]),
+             width=np.concatenate([np.array(r[4], dtype=np.int32) for r in results]),
+             label=np.concatenate([np.array(r[5], dtype=np.uint8) for r in results]),
+             dtype=dtype.name)
+
+
+class ShardDataset(IterableDataset):
+    """Streams the records written by build_shards, drop-in for PEDataset in the training loops.
+
+    Every epoch the shard order is permuted with (seed, epoch) and the records, in that order,
+    are cut into equal contiguous runs per rank and then per DataLoader worker, so all ranks
+    yield len(self) samples like DistributedSampler(drop_last=True) and each worker reads its
+    files sequentially. A shuffle buffer of raw records mixes the samples within a worker.
+    The runs are whole multiples of the DataLoader's batch_size (the remainder is dropped), as
+    each worker collates its own batches: len(DataLoader) is then the true batch count.
+    """
+    def __init__(self, shard_dir, target_size, transform, shuffle_buffer=256, num_replicas=None, rank=None, seed=0, timers=None, batch_size=1):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size()
+        if rank is None:
+            rank = dist.get_rank()
+        self.shard_dir = shard_dir
+        self.target_size = target_size
+        self.transform = transform
+        self.shuffle_buffer = shuffle_buffer
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.timers = timers # StageTimers or None
+        self.batch_size = batch_size
+        self.epoch = 0
+        index = np.load(os.path.join(shard_dir, 'index.npz'))
+        self.shard = index['shard']
+        self.offset = index['offset']
+        self.height = index['height']
+        self.width = index['width']
+        self.label = index['label']
+        self.dtype = np.dtype(str(index['dtype']))
+        self.num_shards = int(self.shard.max())+1
+        self.num_samples = len(self.shard) // self.num_replicas // batch_size * batch_size
+    def __len__(self):
+        return self.num_samples
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+    def worker_rows(self, worker_id, num_workers):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(self.num_shards, generator=g).numpy()
+        starts = np.searchsorted(self.shard, np.arange(self.num_shards+1))
+        rows = np.concatenate([np.arange(starts[s], starts[s+1]) for s in order])
+        rows = rows[self.rank*self.num_samples:(self.rank+1)*self.num_samples]
+        batches = np.array_split(np.arange(self.num_samples // self.batch_size), num_workers)[worker_id]
+        if len(batches) == 0:
+            return rows[:0]
+        return rows[batches[0]*self.batch_size:(batches[-1]+1)*self.batch_size]
+    def read_records(self, rows):
+        f, shard = None, -1
+        try:
+            for row in rows:
+                if self.shard[row] != shard:
+                    if f is not None:
+                        f.close()
+                    shard = self.shard[row]
+                    f = open(os.path.join(self.shard_dir, 'shard_{:05d}.bin'.format(shard)), 'rb', buffering=16*1024*1024)
+                    f.seek(self.offset[row])
+                shape = (self.height[row], self.width[row], 3)
+                t = time.perf_counter_ns() if self.timers is not None else 0
+                x = np.frombuffer(f.read(int(np.prod(shape))*self.dtype.itemsize), dtype=self.dtype).reshape(shape)
+                if self.timers is not None:
+                    self.timers.lap('read', t)
+                yield x, self.label[row]
+        finally:
+            if f is not None:
+                f.close()
+    def prepare(self, x, y):
+        t = time.perf_counter_ns() if self.timers is not None else 0
+        if self.transform is None: # uint8 transport, augmented and normalized on the GPU
+            if self.dtype != np.uint8: # float16 shard: the uint8 record build_shards would have written
+                x = np.rint(255*x.astype(np.float32)).clip(0, 255).astype(np.uint8)
+            x = cv2.resize(x, (self.target_size,self.target_size)).transpose(2, 0, 1)
+            if self.timers is not None:
+                self.timers.lap('resize', t)
+            return x, int(y)
+        x = cv2.resize(x.astype(np.float32), (self.target_size,self.target_size))
+        if self.dtype == np.uint8:
+            x /= 255.0
+        if self.timers is not None:
+            t = self.timers.lap('resize', t)
+        x = check_dtype(self.transform(image=x)['image'], 'transform')
+        if self.timers is not None:
+            self.timers.lap('transform', t)
+        x = x.transpose(2, 0, 1)
+        return x, int(y)
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        rng = np.random.default_rng([self.seed, self.epoch, self.rank, worker_id])
+        buffer = []
+        for record in self.read_records(self.worker_rows(worker_id, num_workers)):
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(record)
+                continue
+            k = rng.integers(len(buffer))
+            yield self.prepare(*buffer[k])
+            buffer[k] = record
+        rng.shuffle(buffer)
+        for record in buffer:
+            yield self.prepare(*record)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--split", type=str, default="train", help="image_list_<split> / bbox_dict_<split> to pack")
+    parser.add_argument("--shard_dir", type=str, default="../process_input/split2/shards_train/", help="output directory")
+    parser.add_argument("--samples_per_shard", type=int, default=1024, help="records per shard file")
+    parser.add_argument("--dtype", type=str, default="uint8", help="uint8 | float16")
+    parser.add_argument("--data_dir", type=str, default=DATA_DIR, help="RSNA PE train directory")
+    parser.add_argument("--volume_cache", type=str, default="", help="volume_cache.py output directory | empty: read DICOM")
+    parser.add_argument("--chunk_store", type=str, default="", help="chunk_store.py output directory, read with --decode_threads | empty: off")
+    parser.add_argument("--dicom_index", type=str, default="", help="dicom_index.py output file | empty: parse DICOM headers")
+    parser.add_argument("--decoder", type=str, default="pydicom", help="compressed DICOM decoder: auto (fastest installed per transfer syntax) | imagecodecs | libjpeg | openjpeg | pillow | pydicom")
+    parser.add_argument("--decode_threads", type=int, default=0, help="threads per worker decoding slices for --decoder and --chunk_store | 0: serial")
+    parser.add_argument("--metadata_store", type=str, default="", help="metadata_store.py output directory | empty: read the pickles")
+    parser.add_argument("--worker", type=int, default=8, help="Number of packing processes")
+    args = parser.parse_args()
+
+    import pickle5 as pickle
+    metadata = MetadataStore(args.metadata_store) if args.metadata_store else None
+    image_dict = load_pickle('../process_input/split2/image_dict.pickle', metadata, pickle)
+    image_list = load_pickle('../process_input/split2/image_list_'+args.split+'.pickle', metadata, pickle)
+    bbox_dict = load_pickle('../lung_localization/split2/bbox_dict_'+args.split+'.pickle', metadata, pickle)
+    volume_cache = VolumeCache(args.volume_cache) if args.volume_cache else None
+    if args.chunk_store:
+        volume_cache = ChunkStore(args.chunk_store, threads=args.decode_threads)
+    decoder = DicomDecoder(args.decoder, threads=args.decode_threads) if args.decoder != 'pydicom' else None
+    dicom_index = DicomIndex(args.dicom_index, data_dir=args.data_dir, decoder=decoder) if args.dicom_index else None
+    dataset = PEDataset(image_dict=image_dict, bbox_dict=bbox_dict, image_list=image_list, target_size=None, transform=None, data_dir=args.data_dir, volume_cache=volume_cache, dicom_index=dicom_index, decoder=decoder)
+    print("Samples to pack:", len(dataset))
+    build_shards(dataset, args.shard_dir, samples_per_shard=args.samples_per_shard, dtype=args.dtype, num_workers=args.worker)
+    print("Shards written to", args.shard_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+from multiprocessing import Array
+
+import numpy as np
+from torch.utils.data import get_worker_info
+
+# Stages timed by the first-stage datasets; read and decode are per slice, the rest per sample
+# (batch: one __getitems__ call of the *_batch datasets)
+STAGES = ('read', 'decode', 'window', 'resize', 'transform', 'sample', 'batch')
+NUM_BINS = 24 # log2 histogram, bin b counts durations < 8.192us * 2^b, the last bin is open
+BIN0_NS = 8192
+
+
+class StageTimers(object):
+    """Per-stage latency histograms of the dataset code, one row per DataLoader worker.
+
+    The rows live in shared memory like SliceCache's counters, so the main process reports
+    all workers. Each worker only writes its own row; record() is a few hundred ns, and a
+    dataset built with timers=None does not call the clock at all.
+    """
+    def __init__(self, num_workers=0):
+        self.rows = num_workers+1 # row 0: main process (num_workers=0)
+        self.shared = Array('q', self.rows*len(STAGES)*(NUM_BINS+1)) # per bin counts, then the sum in ns
+        self.stage_index = {stage: k for k, stage in enumerate(STAGES)}
+        self.pid = None
+    def table(self):
+        return np.frombuffer(self.shared.get_obj(), dtype=np.int64).reshape(self.rows, len(STAGES), NUM_BINS+1)
+    def open(self):
+        info = get_worker_info()
+        self.row = self.table()[min(info.id+1, self.rows-1) if info is not None else 0]
+        self.lock = threading.Lock() # I/O threads of one worker share its row
+        self.pid = os.getpid()
+    def record(self, stage, ns):
+        if self.pid != os.getpid():
+            self.open()
+        counts = self.row[self.stage_index[stage]]
+        with self.lock:
+            counts[min((ns // BIN0_NS).bit_length(), NUM_BINS-1)] += 1
+            counts[NUM_BINS] += ns
+    def lap(self, stage, start):
+        # records now-start for stage, returns now as the start of the next stage
+        now = time.perf_counter_ns()
+        self.record(stage, now-start)
+        return now
+    def reset(self):
+        with self.shared.get_lock():
+            self.table()[...] = 0
+    def summary(self):
+        table = self.table()
+        total = table.sum(axis=0)
+        sample = total[self.stage_index['sample']][NUM_BINS] + total[self.stage_index['batch']][NUM_BINS]
+        entries = []
+        for stage in STAGES:
+            counts = total[self.stage_index[stage]]
+            n = counts[:NUM_BINS].sum()
+            if n == 0:
+                continue
+            cdf = np.cumsum(counts[:NUM_BINS])/n
+            p50, p90, p99 = [BIN0_NS*2**int(np.searchsorted(cdf, q))/1e6 for q in (0.5, 0.9, 0.99)]
+            entries.append('{} n {} mean {:.2f}ms p50<{:.2g} p90<{:.2g} p99<{:.2g}ms ({:.0%})'.format(
+                stage, n, counts[NUM_BINS]/n/1e6, p50, p90, p99, counts[NUM_BINS]/max(sample, 1)))
+        rows = table[:, self.stage_index['sample']] + table[:, self.stage_index['batch']]
+        busy = ['{:.1f}'.format(row[NUM_BINS]/1e9) for row in rows if row[:NUM_BINS].sum() > 0]
+        return 'stage timers: ' + ' | '.join(entries) + ' | busy s per worker: ' + ' '.join(busy)
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the first_stage modules are flat and import each other by name, as when run from first_stage/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shards import build_shards
+
+
+class RowDataset(object):
+    # load_crop of PEDataset: record `index` is filled with its index, heights and widths vary
+    def __init__(self, size):
+        self.image_list = ['img{}'.format(k) for k in range(size)]
+        self.image_dict = {image_id: {'pe_present_on_image': k % 2} for k, image_id in enumerate(self.image_list)}
+    def __len__(self):
+        return len(self.image_list)
+    def load_crop(self, index, triplet=None):
+        return np.full((5+index % 3, 4+index % 2, 3), index, dtype=np.float32)
+
+def identity(image):
+    return {'image': image}
+
+@pytest.fixture(scope='session')
+def shard_dir(tmp_path_factory):
+    # 203 records in 17-record shards; float16 holds the row ids exactly, the records resize to constant images
+    shard_dir = str(tmp_path_factory.mktemp('shards'))
+    build_shards(RowDataset(203), shard_dir, samples_per_shard=17, dtype='float16', num_workers=2)
+    return shard_dir
@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+import pytest
+
+from bench_batch_fetch import SyntheticSlices, train_transform_reference
+from bench_windowing import synthetic_slice
+from pe_dataset import PEDataset, PEDataset_val
+from windowing import NARROW_DTYPES, check_dtype
+
+SIZE = 128
+IMAGE_SIZE = 96
+BBOX = [16, 24, 112, 100]
+# img0-img2: int16 pixels, windowed through the table; img3-img5: int32, the window() fallback
+TABLE, FALLBACK = 1, 4
+
+
+@pytest.fixture(scope='module')
+def kwargs():
+    rng = np.random.default_rng(0)
+    slices = {'img{}'.format(k): (synthetic_slice(rng, SIZE, np.int16 if k < 3 else np.int32), 1.0, -1024.0) for k in range(6)}
+    image_dict = {'img{}'.format(k): {'series_id': 'study_series', 'image_minus1': 'img{}'.format(3*(k//3)),
+                                      'image_plus1': 'img{}'.format(3*(k//3)+2), 'pe_present_on_image': 0} for k in range(6)}
+    return dict(image_dict=image_dict, bbox_dict={'study_series': BBOX}, image_list=list(image_dict.keys()),
+                target_size=IMAGE_SIZE, volume_cache=SyntheticSlices(slices))
+
+def expected(uint8):
+    return 'uint8' if uint8 else 'float32'
+
+def dtype_name(x):
+    # numpy array or torch tensor
+    return str(x.dtype).replace('torch.', '')
+
+
+@pytest.mark.parametrize('index', [TABLE, FALLBACK], ids=['table', 'fallback'])
+@pytest.mark.parametrize('uint8', [False, True], ids=['float32', 'uint8'])
+def test_pe_dataset_stages(kwargs, index, uint8):
+    rng = np.random.default_rng(1)
+    transform = lambda image: {'image': train_transform_reference(image, IMAGE_SIZE, rng).transpose(1, 2, 0)}
+    dataset = PEDataset(transform=None if uint8 else transform, uint8=uint8, **kwargs)
+    crop = dataset.load_crop(index, dataset.load_triplet(index))
+    assert dtype_name(crop) == expected(uint8)
+    resized = cv2.resize(crop, (IMAGE_SIZE, IMAGE_SIZE))
+    assert dtype_name(resized) == expected(uint8)
+    image = dataset[index][0]
+    check_dtype(image, 'PEDataset')
+    assert dtype_name(image) == expected(uint8)
+    assert tuple(image.shape) == (3, IMAGE_SIZE, IMAGE_SIZE)
+
+@pytest.mark.parametrize('index', [TABLE, FALLBACK], ids=['table', 'fallback'])
+@pytest.mark.parametrize('uint8', [False, True], ids=['float32', 'uint8'])
+def test_pe_dataset_val(kwargs, index, uint8):
+    image = PEDataset_val(uint8=uint8, **kwargs)[index][0]
+    check_dtype(image, 'PEDataset_val')
+    assert dtype_name(image) == expected(uint8)
+
+def test_table_and_fallback_agree(kwargs):
+    # same stored values through the int16 table and the int32 window() fallback
+    dataset = PEDataset(transform=None, **kwargs)
+    rng = np.random.default_rng(2)
+    pixels = synthetic_slice(rng, SIZE, np.int16)
+    slices = {'img{}'.format(k): (pixels.astype(np.int16 if k < 3 else np.int32), 1.0, -1024.0) for k in range(6)}
+    dataset.volume_cache = SyntheticSlices(slices)
+    table, fallback = dataset.load_image(TABLE), dataset.load_image(FALLBACK)
+    assert table.dtype == fallback.dtype == np.float32
+    assert np.allclose(table, fallback, rtol=0, atol=1e-5)
+
+def test_check_dtype_rejects_wide():
+    for dtype in NARROW_DTYPES[:2] + NARROW_DTYPES[3:]:
+        check_dtype(np.zeros(2, dtype=dtype), 'narrow')
+    with pytest.raises(TypeError):
+        check_dtype(np.zeros(2, dtype=np.float64), 'rescale')
@@ -0,0 +1,108 @@
+import contextlib
+
+import pytest
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from conftest import identity
+from grad_accum import GradAccumulator, accumulation_steps
+from shards import ShardDataset
+
+pytestmark = pytest.mark.filterwarnings('ignore:This DataLoader will create')
+
+
+def make_model(inputs):
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Flatten(), nn.Linear(inputs, 8), nn.Tanh(), nn.Linear(8, 1))
+
+def accumulated_groups(model, batches, steps):
+    """(micro-batches, gradients) of every optimizer step of the train1.py / train2.py loop."""
+    criterion = nn.BCEWithLogitsLoss()
+    accumulator = GradAccumulator(model, steps)
+    groups, group = [], []
+    for j, (images, labels) in enumerate(accumulator.iterate(batches)):
+        group.append((images, labels))
+        with accumulator.sync(j):
+            loss = criterion(model(images.float()).view(-1), labels.float())
+            (loss/accumulator.steps).backward()
+        if accumulator.boundary(j):
+            accumulator.rescale(j)
+            groups.append((group, [p.grad.clone() for p in model.parameters()]))
+            model.zero_grad()
+            group = []
+    assert not group # the last micro-batch closed a group
+    return groups
+
+def large_batch_gradients(model, group):
+    criterion = nn.BCEWithLogitsLoss()
+    images = torch.cat([images for images, _ in group])
+    labels = torch.cat([labels for _, labels in group])
+    model.zero_grad()
+    criterion(model(images.float()).view(-1), labels.float()).backward()
+    gradients = [p.grad.clone() for p in model.parameters()]
+    model.zero_grad()
+    return gradients
+
+def check_groups(model, groups, steps, num_batches):
+    assert [len(group) for group, _ in groups] == [steps]*(num_batches//steps) + ([num_batches % steps] if num_batches % steps else [])
+    for group, accumulated in groups:
+        for a, b in zip(accumulated, large_batch_gradients(model, group)):
+            assert torch.allclose(a, b, rtol=1e-5, atol=1e-7)
+
+
+@pytest.mark.parametrize('num_batches,steps', [(10, 4), (9, 3), (7, 8), (1, 3), (5, 1)])
+def test_sized_loader_matches_large_batches(num_batches, steps):
+    torch.manual_seed(1)
+    dataset = TensorDataset(torch.randn(num_batches*4, 6), (torch.rand(num_batches*4) > 0.5).long())
+    loader = DataLoader(dataset, batch_size=4)
+    assert len(loader) == num_batches
+    model = make_model(6)
+    check_groups(model, accumulated_groups(model, loader, steps), steps, num_batches)
+
+@pytest.mark.parametrize('steps', [3, 4])
+def test_shard_loader_without_len(shard_dir, steps):
+    # an iterator over the ShardDataset loader has no __len__: the last group ends on StopIteration
+    dataset = ShardDataset(shard_dir, target_size=4, transform=identity, shuffle_buffer=8, num_replicas=1, rank=0, batch_size=8)
+    loader = DataLoader(dataset, batch_size=8, num_workers=2)
+    num_batches = len(dataset)//8
+    assert num_batches % steps != 0
+    batches = [(images/203.0, labels) for images, labels in loader]
+    model = make_model(3*4*4)
+    groups = accumulated_groups(model, iter(batches), steps)
+    check_groups(model, groups, steps, num_batches)
+
+def test_empty_loader():
+    assert list(GradAccumulator(make_model(2), 4).iterate([])) == []
+
+
+class NoSyncModule(nn.Linear):
+    # records the micro-batches run under DDP's no_sync()
+    def __init__(self):
+        super().__init__(2, 1)
+        self.unsynced = 0
+    @contextlib.contextmanager
+    def no_sync(self):
+        self.unsynced += 1
+        yield
+
+@pytest.mark.parametrize('num_batches,steps', [(10, 4), (8, 4), (3, 4)])
+def test_sync_on_boundaries(num_batches, steps):
+    model = NoSyncModule()
+    accumulator = GradAccumulator(model, steps)
+    synced = []
+    for j, _ in enumerate(accumulator.iterate(iter(range(num_batches)))):
+        before = model.unsynced
+        with accumulator.sync(j):
+            pass
+        if model.unsynced == before:
+            synced.append(j)
+    # the first micro-batch (static_graph), every group end and the real last micro-batch
+    expected = sorted({0, num_batches-1} | set(range(steps-1, num_batches, steps)))
+    assert synced == expected
+
+def test_accumulation_steps():
+    assert accumulation_steps(0, 8, 4) == 1
+    assert accumulation_steps(64, 8, 4) == 2
+    assert accumulation_steps(100, 8, 4) == 4
+    assert accumulation_steps(16, 32, 4) == 1
@@ -0,0 +1,79 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+import torch
+
+from series_sampler import SeriesChunkSampler, slice_positions
+
+
+class LinkedSeries(object):
+    # image_list / image_dict of a PEDataset: series of various lengths, image_list shuffled
+    def __init__(self, lengths, seed=0):
+        self.image_dict = {}
+        for s, length in enumerate(lengths):
+            images = ['s{}_img{}'.format(s, k) for k in range(length)]
+            for k, image_id in enumerate(images):
+                self.image_dict[image_id] = {'series_id': 'series{}'.format(s), 'image_minus1': images[max(k-1, 0)],
+                                             'image_plus1': images[min(k+1, length-1)], 'pe_present_on_image': 0}
+        self.image_list = list(self.image_dict)
+        np.random.default_rng(seed).shuffle(self.image_list)
+    def __len__(self):
+        return len(self.image_list)
+
+def position(dataset, index):
+    series, k = dataset.image_list[index].split('_img')
+    return series, int(k)
+
+
+@pytest.mark.parametrize('num_replicas', [1, 3, 4])
+@pytest.mark.parametrize('chunk_size', [1, 4, 7])
+def test_ranks_cover_every_index_once(num_replicas, chunk_size):
+    dataset = LinkedSeries([13, 1, 8, 20, 5])
+    for epoch in range(3):
+        ranks = []
+        for rank in range(num_replicas):
+            sampler = SeriesChunkSampler(dataset, chunk_size=chunk_size, num_replicas=num_replicas, rank=rank)
+            sampler.set_epoch(epoch)
+            ranks.append(list(sampler))
+            assert len(ranks[-1]) == len(sampler)
+        assert len(set(len(r) for r in ranks)) == 1
+        counts = Counter(index for r in ranks for index in r)
+        assert set(counts) == set(range(len(dataset)))
+        # the wrap-around padding repeats the first total_size - len(dataset) indices once
+        padding = len(ranks[0])*num_replicas - len(dataset)
+        assert 0 <= padding < num_replicas
+        assert sum(counts.values()) - len(dataset) == padding
+        assert max(counts.values()) <= 2
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 7])
+def test_chunks_follow_the_slice_links(chunk_size):
+    dataset = LinkedSeries([13, 1, 8, 20, 5])
+    sampler = SeriesChunkSampler(dataset, chunk_size=chunk_size, num_replicas=1, rank=0)
+    for epoch in range(3):
+        g = torch.Generator()
+        g.manual_seed(sampler.seed + epoch)
+        chunks = sampler.chunks(g)
+        assert sorted(np.concatenate(chunks).tolist()) == list(range(len(dataset)))
+        for chunk in chunks:
+            assert 1 <= len(chunk) <= chunk_size
+            positions = [position(dataset, index) for index in chunk]
+            assert len(set(series for series, _ in positions)) == 1
+            # consecutive slices, each the image_plus1 of the previous one
+            assert [k for _, k in positions] == list(range(positions[0][1], positions[0][1]+len(chunk)))
+            for a, b in zip(chunk[:-1], chunk[1:]):
+                assert dataset.image_dict[dataset.image_list[a]]['image_plus1'] == dataset.image_list[b]
+
+def test_iteration_keeps_chunks_together():
+    dataset = LinkedSeries([13, 1, 8, 20, 5])
+    sampler = SeriesChunkSampler(dataset, chunk_size=4, num_replicas=1, rank=0)
+    indices = list(sampler)
+    # a chunk is only cut at a series end or every chunk_size slices: few breaks in link order
+    breaks = sum(dataset.image_dict[dataset.image_list[a]]['image_plus1'] != dataset.image_list[b] for a, b in zip(indices[:-1], indices[1:]))
+    assert breaks < len(dataset)//2
+
+def test_slice_positions_from_any_slice():
+    dataset = LinkedSeries([9])
+    for image_id in dataset.image_list:
+        positions = slice_positions(dataset.image_dict, image_id)
+        assert positions == {'s0_img{}'.format(k): k for k in range(9)}
@@ -0,0 +1,43 @@
+from collections import Counter
+
+import pytest
+from torch.utils.data import DataLoader
+
+from conftest import identity
+from shards import ShardDataset
+
+pytestmark = pytest.mark.filterwarnings('ignore:This DataLoader will create')
+
+
+@pytest.mark.parametrize('num_replicas,num_workers,batch_size', [(1, 2, 8), (2, 3, 5), (3, 2, 7), (4, 3, 4)])
+def test_workers_yield_whole_batches_once(shard_dir, num_replicas, num_workers, batch_size):
+    for epoch in range(2):
+        rows, batches = Counter(), 0
+        for rank in range(num_replicas):
+            dataset = ShardDataset(shard_dir, target_size=4, transform=identity, shuffle_buffer=8,
+                                   num_replicas=num_replicas, rank=rank, batch_size=batch_size)
+            dataset.set_epoch(epoch)
+            loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+            rank_batches = 0
+            for images, labels in loader:
+                assert len(images) == batch_size
+                ids = images[:, 0, 0, 0].long().tolist()
+                assert labels.tolist() == [k % 2 for k in ids]
+                rows.update(ids)
+                rank_batches += 1
+            assert rank_batches == len(loader) == len(dataset)//batch_size
+            batches += rank_batches
+        # no row twice, and only the remainder short of a whole batch per rank is dropped
+        assert max(rows.values()) == 1
+        assert set(rows) <= set(range(203))
+        assert len(rows) == batches*batch_size
+        assert 203 - len(rows) < num_replicas*batch_size
+
+def test_ranks_see_disjoint_rows(shard_dir):
+    seen = []
+    for rank in range(2):
+        dataset = ShardDataset(shard_dir, target_size=4, transform=None, shuffle_buffer=8, num_replicas=2, rank=rank, batch_size=5)
+        rows = [row for w in range(3) for row in dataset.worker_rows(w, 3)]
+        assert len(rows) == len(dataset)
+        seen.append(set(rows))
+    assert not seen[0] & seen[1]
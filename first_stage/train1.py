@@ -8,12 +8,9 @@ import torch
 import torch.nn as nn
 from torch import optim
 import torch.nn.functional as F
-import torchvision.models as models
 from torchvision import transforms
 from torch.utils.data import Dataset, DataLoader
 import torch
-from apex import amp
-from pretrainedmodels.senet import se_resnext50_32x4d, senet154
 from torch.utils.data import DataLoader, RandomSampler, SequentialSampler
 from torch.utils.data.distributed import DistributedSampler
 import random
@@ -21,11 +18,28 @@ import pickle
 import albumentations
 import pydicom
 import copy
-from transformers import get_linear_schedule_with_warmup
 from sklearn.metrics import roc_auc_score
 from random import randrange
 import time
-from model_pytorch import Classifier_model, get_weight_name, ProgressMeter, save_checkpoint
+from model_pytorch import save_checkpoint
+from backbones import build_backbone, describe
+from pe_dataset import PEDataset, PEDataset_val, PEDataset_batch, PEDataset_val_batch, batch_collate
+from batch_transforms import TrainBatchTransform, uint8_to_device
+from volume_cache import VolumeCache
+from chunk_store import ChunkStore
+from slice_cache import SliceCache
+from dicom_decode import DicomDecoder
+from dicom_index import DicomIndex
+from metadata_store import MetadataStore, load_pickle
+from series_sampler import SeriesChunkSampler
+from shards import ShardDataset
+from stage_timers import StageTimers
+from data_wait import DataWaitMeter
+from grad_accum import GradAccumulator, accumulation_steps, linear_schedule_with_warmup
+from precision import Precision, PRECISIONS, to_float32
+from execution import Execution, COMPILE_MODES
+from checkpointing import set_checkpointing, memory_speed_report
+from ddp import BACKENDS, init_distributed, freeze_unused_parameters, ddp_options
 numSeed = randrange(25000)
 
 # DATA_DIR = ' ' 
@@ -46,243 +60,11 @@ class AverageMeter(object):
         self.count += n
         self.avg = self.sum / self.count
 
-def window(img, WL=50, WW=350):
-    upper, lower = WL+WW//2, WL-WW//2 # 400 to -300
-    X = np.clip(img.copy(), lower, upper)
-    X = X - np.min(X)
-    X = X / np.max(X)
-    # X = (X*255.0).astype('uint8')
-    return X
-
-class PEDataset(Dataset):
-    def __init__(self, image_dict, bbox_dict, image_list, target_size, transform):
-        self.image_dict=image_dict  # 1790594
-        self.bbox_dict=bbox_dict  # should be 6,279
-        self.image_list=image_list  # should be 6,279
-        self.target_size=target_size
-        self.transform=transform
-    def __len__(self):
-        return len(self.image_list)
-    def __getitem__(self,index):
-        study_id = self.image_dict[self.image_list[index]]['series_id'].split('_')[0]
-        series_id = self.image_dict[self.image_list[index]]['series_id'].split('_')[1]
-        data1 = pydicom.dcmread(DATA_DIR+study_id+'/'+series_id+'/'+self.image_dict[self.image_list[index]]['image_minus1']+'.dcm')
-        data2 = pydicom.dcmread(DATA_DIR+study_id+'/'+series_id+'/'+self.image_list[index]+'.dcm')
-        data3 = pydicom.dcmread(DATA_DIR+study_id+'/'+series_id+'/'+self.image_dict[self.image_list[index]]['image_plus1']+'.dcm')
-        x1 = data1.pixel_array
-        x2 = data2.pixel_array
-        x3 = data3.pixel_array
-        x1 = x1*data1.RescaleSlope+data1.RescaleIntercept
-        x2 = x2*data2.RescaleSlope+data2.RescaleIntercept
-        x3 = x3*data3.RescaleSlope+data3.RescaleIntercept
-        x1 = np.expand_dims(window(x1, WL=100, WW=700), axis=2)
-        x2 = np.expand_dims(window(x2, WL=100, WW=700), axis=2)
-        x3 = np.expand_dims(window(x3, WL=100, WW=700), axis=2)
-        x = np.concatenate([x1, x2, x3], axis=2)
-        # print("CHECK: x shape = " + str(x.shape))
-        bbox = self.bbox_dict[self.image_dict[self.image_list[index]]['series_id']]
-        # print("CHECK: bbox = " + str(bbox))
-        x = x[bbox[1]:bbox[3],bbox[0]:bbox[2],:]
-        # print("CHECK: x shape = " + str(x.shape))
-        x = cv2.resize(x, (self.target_size,self.target_size))
-        x = self.transform(image=x)['image']
-        x = x.transpose(2, 0, 1)
-        y = self.image_dict[self.image_list[index]]['pe_present_on_image']
-        return x, y
-
-class PEDataset_val(Dataset):
-    def __init__(self, image_dict, bbox_dict, image_list, target_size):
-        self.image_dict=image_dict  # # 1790594
-        self.bbox_dict=bbox_dict  # should be 1,000
-        self.image_list=image_list  # should be 1,000
-        self.target_size=target_size
-    def __len__(self):
-        return len(self.image_list)
-    def __getitem__(self,index):
-        study_id = self.image_dict[self.image_list[index]]['series_id'].split('_')[0]
-        series_id = self.image_dict[self.image_list[index]]['series_id'].split('_')[1]
-        data1 = pydicom.dcmread(DATA_DIR+study_id+'/'+series_id+'/'+self.image_dict[self.image_list[index]]['image_minus1']+'.dcm')
-        data2 = pydicom.dcmread(DATA_DIR+study_id+'/'+series_id+'/'+self.image_list[index]+'.dcm')
-        data3 = pydicom.dcmread(DATA_DIR+study_id+'/'+series_id+'/'+self.image_dict[self.image_list[index]]['image_plus1']+'.dcm')
-        x1 = data1.pixel_array
-        x2 = data2.pixel_array
-        x3 = data3.pixel_array
-        x1 = x1*data1.RescaleSlope+data1.RescaleIntercept
-        x2 = x2*data2.RescaleSlope+data2.RescaleIntercept
-        x3 = x3*data3.RescaleSlope+data3.RescaleIntercept
-        x1 = np.expand_dims(window(x1, WL=100, WW=700), axis=2)
-        x2 = np.expand_dims(window(x2, WL=100, WW=700), axis=2)
-        x3 = np.expand_dims(window(x3, WL=100, WW=700), axis=2)
-        x = np.concatenate([x1, x2, x3], axis=2)
-        bbox = self.bbox_dict[self.image_dict[self.image_list[index]]['series_id']]
-        x = x[bbox[1]:bbox[3],bbox[0]:bbox[2],:]
-        x = cv2.resize(x, (self.target_size,self.target_size))
-        x = transforms.ToTensor()(x)
-        # x = transforms.Normalize(mean=[0.456, 0.456, 0.456], std=[0.224, 0.224, 0.224])(x) # old
-        x = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])(x) # New
-        y = self.image_dict[self.image_list[index]]['pe_present_on_image']
-        return x, y
-
-class seresnext50(nn.Module):
-    def __init__(self ):
-        super().__init__()
-        self.net = se_resnext50_32x4d(num_classes=1000, pretrained='imagenet')
-        # self.net = se_resnext50_32x4d(num_classes=1000, pretrained=None) # Random Init
-        self.avg_pool = nn.AdaptiveAvgPool2d(1)
-        in_features = self.net.last_linear.in_features
-        self.last_linear = nn.Linear(in_features, 1)
-    def forward(self, x):
-        x = self.net.features(x)
-        x = self.avg_pool(x)
-        x = x.view(x.size(0), -1)
-        x = self.last_linear(x)
-        return x
-
-class resnext50_(nn.Module):
-    def __init__(self, pretrained):
-        super().__init__()
-        import torchvision.models as models
-        self.net = models.resnext50_32x4d(pretrained=pretrained)
-        self.avg_pool = nn.AdaptiveAvgPool2d(1)
-        in_features = self.net.fc.in_features
-        self.last_linear = nn.Linear(in_features, 1)
-    def forward(self, x):
-        x = self.net.features(x)
-        x = self.avg_pool(x)
-        x = x.view(x.size(0), -1)
-        x = self.last_linear(x)
-        return x
-
-class senet154_(nn.Module):
-    def __init__(self ):
-        super().__init__()
-        # self.net = senet154(num_classes=1000, pretrained='imagenet')
-        self.net = se_resnext50_32x4d(num_classes=1000, pretrained=None) # Random Init
-        self.avg_pool = nn.AdaptiveAvgPool2d(1)
-        in_features = self.net.last_linear.in_features
-        self.last_linear = nn.Linear(in_features, 1)
-    def forward(self, x):
-        x = self.net.features(x)
-        x = self.avg_pool(x)
-        x = x.view(x.size(0), -1)
-        x = self.last_linear(x)
-        return x
-
-class DRN_A_50(nn.Module):
-    def __init__(self ):
-        from drn_copiedModel import drn_a_50 as drn_model
-        super().__init__()
-        self.net = drn_model(pretrained=True)
-        self.avg_pool = nn.AdaptiveAvgPool2d(1)
-        in_features = self.net.fc.in_features
-        self.last_linear = nn.Linear(in_features, 1)
-    def forward(self, x):
-        x = self.net.features(x)
-        x = self.avg_pool(x)
-        x = x.view(x.size(0), -1)
-        x = self.last_linear(x)
-        return x
-
-class DRN_D_54(nn.Module):
-    def __init__(self ):
-        from drn_copiedModel import drn_d_54 as drn_model
-        super().__init__()
-        self.net = drn_model(pretrained=True)
-        self.avg_pool = nn.AdaptiveAvgPool2d(1)
-        in_features = self.net.fc.in_channels
-        self.last_linear = nn.Linear(in_features, 1)
-    def forward(self, x):
-        x = self.net.features(x)
-        x = self.avg_pool(x)
-        x = x.view(x.size(0), -1)
-        x = self.last_linear(x)
-        return x
-
-
-def transferLearningModels(backboneName, _weight):
-    if _weight == "ImageNet":
-        PRETRAINED = True
-    else:
-        PRETRAINED = False
-        
-    if backboneName == "densenet121":
-        net = models.densenet121(pretrained=PRETRAINED)
-        net.classifier = nn.Linear(1024, 1)
-        print("=> DenseNet121 loaded model: " + _weight)
-        return net
-    elif backboneName == "vgg16":
-        net = models.vgg16(pretrained=PRETRAINED)
-        net.classifier = nn.Linear(25088, 1)
-        print("=> VGG16 loaded model: " + _weight)
-        return net
-    elif backboneName == "xception":
-        from xception_copiedModel import xception
-        if _weight == "ImageNet":
-            PRETRAINED = 'imagenet'
-        else:
-            PRETRAINED = None
-        model = xception(num_classes=1000, pretrained=PRETRAINED)
-        print("Xception: => loaded model: " + _weight)
-        kernelCount = model.last_linear.in_features
-        model.last_linear = nn.Sequential(nn.Linear(kernelCount, 1))
-    elif backboneName == "resnet50":
-        model = models.resnet50(pretrained=PRETRAINED)
-        kernelCount = model.fc.in_features
-        model.fc = nn.Linear(kernelCount, 1)
-        print("=> ResNet50 loaded model: " + _weight)
-    elif backboneName == "resnet101":
-        from resnet_copied import resnet101
-        model = resnet101(pretrained=None)
-        if _weight=="ImageNet":
-            state_dict = torch.load("pretrain_model_weights/resnet101-63fe2227.pth", map_location="cpu") # extra
-            model.load_state_dict(state_dict) # was url
-        kernelCount = model.fc.in_features
-        model.fc = nn.Linear(kernelCount, 1)
-        print("=> ResNet101 loaded model: " + _weight)
-    elif backboneName == "resnet18":
-        model = models.resnet18(pretrained=PRETRAINED)
-        kernelCount = model.fc.in_features
-        model.fc = nn.Linear(kernelCount, 1)
-        print("=> ResNet18 loaded model: " + _weight)
-    elif backboneName == "senet154":
-        model = senet154_()
-        print("=> SeNet154 loaded model: " + 'imagenet')
-    elif backboneName == "drn_a_50":
-        from drn_copiedModel import drn_a_50 as drn_model
-        model = drn_model(pretrained=PRETRAINED)
-        kernelCount = model.fc.in_features
-        model.fc = nn.Linear(kernelCount, 1)
-        print("=> DRN-A-50 loaded model: " + _weight)
-    elif backboneName == "drn_d_54":
-        from drn_copiedModel import drn_d_54 as drn_model
-        model = drn_model(pretrained=PRETRAINED)
-        model.fc = nn.Conv2d(512, 1, kernel_size=(1,1), stride=(1,1))
-        print("=> DRN-D-54 loaded model: " + _weight)  
-    elif backboneName == "resnext50":
-        # model = resnext50_(pretrained=PRETRAINED)
-        import torchvision.models as models
-        num_class=1
-        model = models.resnext50_32x4d(num_classes=1000, pretrained=PRETRAINED)
-        kernelCount = model.fc.in_features
-        # model.fc = nn.Sequential(nn.Linear(kernelCount, num_class), nn.Sigmoid())
-        model.fc = nn.Sequential(nn.Linear(kernelCount, num_class))
-        print("=> ResNext50 loaded model " + str(PRETRAINED))
-    elif backboneName == "resnext101":
-        import torchvision.models as models
-        num_class=1
-        model = models.resnext101_32x8d(num_classes=1000, pretrained=PRETRAINED)
-        kernelCount = model.fc.in_features
-        # model.fc = nn.Sequential(nn.Linear(kernelCount, num_class), nn.Sigmoid())
-        model.fc = nn.Sequential(nn.Linear(kernelCount, num_class))
-        print("=> ResNext101 loaded model " + str(PRETRAINED))
-
-    return model
-
 def main():
     start_time = time.time()
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("--local_rank", type=int, default=-1, help="local_rank for distributed training on gpus")
+    parser.add_argument("--local_rank", type=int, default=-1, help="local_rank for distributed training (torch.distributed.launch) | -1: LOCAL_RANK of torchrun")
 
     parser.add_argument("--train_task", type=int, default=1, help="train or not")
     parser.add_argument("--val_task", type=int, default=1, help="val or not")
@@ -296,9 +78,35 @@ def main():
     parser.add_argument("--redu", type=int, default=100, help="Reduced Data")
 
     parser.add_argument("--BS", type=int, default=20, help="BatchSize")
-    parser.add_argument("--numGPU", type=int, default=4, help="Number of GPUs")
+    parser.add_argument("--numGPU", type=int, default=4, help="Number of GPUs (training uses the torch.distributed world size)")
     parser.add_argument("--worker", type=int, default=12, help="Number of workers")
+    parser.add_argument("--io_threads", type=int, default=0, help="threads per worker reading the slices of a triplet concurrently | 0: serial reads")
+    parser.add_argument("--batch_fetch", type=int, default=0, help="1: fetch and augment whole batches through __getitems__ (torch>=2.0) | 0: per sample")
+    parser.add_argument("--uint8_transport", type=int, default=0, help="1: workers emit uint8 images, augmented/normalized on the GPU | 0: float32")
     parser.add_argument("--imgSize", type=int, default=576, help="ImageSize")
+    parser.add_argument("--volume_cache", type=str, default="", help="volume_cache.py output directory | empty: read DICOM")
+    parser.add_argument("--chunk_store", type=str, default="", help="chunk_store.py output directory, read with --decode_threads | empty: off")
+    parser.add_argument("--slice_cache_mb", type=int, default=0, help="per-worker decoded slice LRU cache size in MB | 0: off")
+    parser.add_argument("--dicom_index", type=str, default="", help="dicom_index.py output file | empty: parse DICOM headers")
+    parser.add_argument("--decoder", type=str, default="pydicom", help="compressed DICOM decoder: auto (fastest installed per transfer syntax) | imagecodecs | libjpeg | openjpeg | pillow | pydicom")
+    parser.add_argument("--decode_threads", type=int, default=0, help="threads per worker decoding slices for --decoder and --chunk_store | 0: serial")
+    parser.add_argument("--metadata_store", type=str, default="", help="metadata_store.py output directory | empty: read the pickles")
+    parser.add_argument("--chunk_size", type=int, default=0, help="shuffle runs of chunk_size slices of one series | 0: DistributedSampler")
+    parser.add_argument("--shard_dir", type=str, default="", help="shards.py output directory to stream instead of PEDataset | empty: off")
+    parser.add_argument("--shuffle_buffer", type=int, default=256, help="per-worker shuffle buffer of --shard_dir records")
+    parser.add_argument("--val_cache", type=str, default="", help="directory of the resized validation image cache | empty: off")
+    parser.add_argument("--stage_timers", type=int, default=0, help="1: time read/decode/window/resize/transform in the training workers, reported with the loss | 0: off")
+    parser.add_argument("--effective_BS", type=int, default=0, help="samples per optimizer step over all GPUs, reached by accumulating --BS micro-batches | 0: BS x GPUs, no accumulation")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches loaded in advance by each training DataLoader worker")
+    parser.add_argument("--wait_log_steps", type=int, default=100, help="log the data-wait share of the step time with loader advice every N steps | 0: off")
+    parser.add_argument("--precision", type=str, default="fp16", choices=PRECISIONS, help="fp16: autocast + loss scaling (was apex amp O1) | bf16: autocast, no scaling, also on CPU | fp32")
+    parser.add_argument("--val_precision", type=str, default="fp32", choices=PRECISIONS, help="autocast of the validation pass: fp32 | fp16 | bf16 (--precision is the training one)")
+    parser.add_argument("--channels_last", type=int, default=0, help="1: NHWC model and inputs | 0: NCHW")
+    parser.add_argument("--compile", type=str, default="", choices=COMPILE_MODES, help="torch.compile mode of the model (nn.Module.compile, torch>=2.2) | empty: eager")
+    parser.add_argument("--checkpoint_segments", type=int, default=0, help="activation checkpointing of the SENet layer1-4 / Xception block1-12 blocks in N segments, DenseNet: memory_efficient | 0: off")
+    parser.add_argument("--backend", type=str, default="auto", choices=BACKENDS, help="torch.distributed backend | auto: nccl with CUDA, gloo with the ranks on the CPU without")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads per CPU rank | 0: the node's cores split between its ranks")
+    parser.add_argument("--find_unused", type=int, default=-1, help="-1: probe once, freeze the parameters without gradients, DDP static_graph | 1: DDP find_unused_parameters every step (old default) | 0: neither")
 
     args = parser.parse_args()
 
@@ -311,6 +119,14 @@ def main():
     loadW = args.loadW
     redu = args.redu
     nWorkers = args.worker
+    volume_cache = VolumeCache(args.volume_cache) if args.volume_cache else None
+    if args.chunk_store:
+        volume_cache = ChunkStore(args.chunk_store, threads=args.decode_threads)
+    slice_cache = SliceCache(args.slice_cache_mb) if args.slice_cache_mb > 0 else None
+    timers = StageTimers(num_workers=nWorkers) if args.stage_timers else None
+    decoder = DicomDecoder(args.decoder, threads=args.decode_threads) if args.decoder != 'pydicom' else None
+    dicom_index = DicomIndex(args.dicom_index, data_dir=DATA_DIR, decoder=decoder) if args.dicom_index else None
+    metadata = MetadataStore(args.metadata_store) if args.metadata_store else None
     # numSeed = randrange(2500)
 
     print("Train Task:", train_task)
@@ -333,25 +149,18 @@ def main():
 
 
     import pickle5 as pickle
-    with open('../process_input/split2/image_dict.pickle', 'rb') as f:
-        image_dict = pickle.load(f) 
-    with open('../lung_localization/split2/bbox_dict_train.pickle', 'rb') as f:
-        bbox_dict_train = pickle.load(f) 
+    image_dict = load_pickle('../process_input/split2/image_dict.pickle', metadata, pickle)
+    bbox_dict_train = load_pickle('../lung_localization/split2/bbox_dict_train.pickle', metadata, pickle)
 
     if redu == 100:
-        with open('../process_input/split2/image_list_train.pickle', 'rb') as f:
-            image_list_train = pickle.load(f) 
+        image_list_train = load_pickle('../process_input/split2/image_list_train.pickle', metadata, pickle)
     elif redu == 200:
-        with open('../process_input/split2/RSNA_PE_shiv/image_dict.pickle', 'rb') as f:
-            image_dict = pickle.load(f) 
-        with open('../process_input/split2/RSNA_PE_shiv/bbox_dict_train.pickle', 'rb') as f:
-            bbox_dict_train = pickle.load(f)
-        with open('../process_input/split2/RSNA_PE_shiv/image_list_train.pickle', 'rb') as f:
-            image_list_train = pickle.load(f) 
+        image_dict = load_pickle('../process_input/split2/RSNA_PE_shiv/image_dict.pickle', metadata, pickle)
+        bbox_dict_train = load_pickle('../process_input/split2/RSNA_PE_shiv/bbox_dict_train.pickle', metadata, pickle)
+        image_list_train = load_pickle('../process_input/split2/RSNA_PE_shiv/image_list_train.pickle', metadata, pickle)
         print("[INFO] Training data loaded - Shiv's Data Split")
     else: # for reduced training data
-        with open('../process_input/split2/image_list_train_'+ str(redu) + '.pickle', 'rb') as f:
-            image_list_train = pickle.load(f) 
+        image_list_train = load_pickle('../process_input/split2/image_list_train_'+ str(redu) + '.pickle', metadata, pickle)
         print("[INFO] Training Data loaded: ", redu, "%")
 
 
@@ -362,10 +171,10 @@ def main():
     out_dir = title_name + backboneName +'_' + gwn + '/'
 
     if train_task == 1:
-        torch.cuda.set_device(args.local_rank)
-        device = torch.device("cuda", args.local_rank)
-        torch.distributed.init_process_group(backend="nccl")
+        device = init_distributed(args) # cuda:local_rank, or the CPU for gloo without CUDA
         args.device = device
+        number_of_gpu = torch.distributed.get_world_size() # ranks actually launched
+        accum_steps = accumulation_steps(args.effective_BS, batch_size, number_of_gpu)
 
         seed = numSeed # was 2001
         random.seed(seed)
@@ -410,24 +219,30 @@ def main():
         if args.local_rank != 0:
             torch.distributed.barrier()
 
-        if loadW == 'ImageNet' or loadW == 'Random':
-            model = transferLearningModels(backboneName, loadW)
-        else:
-            _exp_name = loadW
-            _model_weight_path = os.path.join("pretrain_model_weights", _exp_name + ".pth.tar")
-            model,_ = Classifier_model(backboneName, num_class, conv=None, weight=_model_weight_path, linear_classifier=False, sobel=False, activation=None)
+        model = build_backbone(backboneName, loadW)
+        print("=> " + describe(backboneName, loadW))
 
         if args.local_rank == 0:
             torch.distributed.barrier()
 
         model.to(args.device)
+        precision = Precision(args.precision, args.device)
+        if args.checkpoint_segments > 0:
+            set_checkpointing(model, args.checkpoint_segments)
+            report = memory_speed_report(model, args.checkpoint_segments, (min(batch_size, 2), 3, image_size, image_size), args.device, precision)
+            if args.local_rank == 0:
+                print(report)
+        if args.find_unused < 0:
+            unused = freeze_unused_parameters(model, (min(batch_size, 2), 3, image_size, image_size), args.device, precision)
+            if args.local_rank == 0:
+                print("DDP static_graph, {} parameters without gradients frozen: {}".format(len(unused), ', '.join(unused)))
+        execution = Execution(args.channels_last, args.compile)
+        model = execution.prepare(model)
 
-        num_train_steps = int(len(image_list_train)/(batch_size*number_of_gpu)*num_epoch)   # 4 GPUs
+        num_train_steps = int(len(image_list_train)/(batch_size*number_of_gpu*accum_steps)*num_epoch)   # optimizer steps
         optimizer = optim.Adam(model.parameters(), lr=learning_rate)
-        scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=num_train_steps)
-        amp.register_float_function(torch, 'sigmoid') # extra
-        model, optimizer = amp.initialize(model, optimizer, opt_level="O1",verbosity=0)
-        model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[args.local_rank], output_device=args.local_rank, find_unused_parameters=True)
+        scheduler = linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=num_train_steps)
+        model = torch.nn.parallel.DistributedDataParallel(model, **ddp_options(args))
         criterion = nn.BCEWithLogitsLoss().to(args.device) # old with Se_resNet50
         # criterion = nn.BCELoss().to(args.device) # training => BCELosswithLogits use
 
@@ -439,30 +254,54 @@ def main():
             albumentations.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), max_pixel_value=1.0, p=1.0) # New
         ])
 
-        datagen = PEDataset(image_dict=image_dict, bbox_dict=bbox_dict_train, image_list=image_list_train, target_size=image_size, transform=train_transform)
-        sampler = DistributedSampler(datagen)
-        generator = DataLoader(dataset=datagen, sampler=sampler, batch_size=batch_size, num_workers=nWorkers, pin_memory=True)
+        device_transform = TrainBatchTransform(image_size) if args.uint8_transport else None
+        if args.shard_dir:
+            datagen = ShardDataset(args.shard_dir, target_size=image_size, transform=None if args.uint8_transport else train_transform, shuffle_buffer=args.shuffle_buffer, timers=timers, batch_size=batch_size)
+            sampler = datagen # splits the shards over ranks and workers itself, set_epoch() reshuffles them
+            generator = DataLoader(dataset=datagen, batch_size=batch_size, num_workers=nWorkers, pin_memory=args.device.type == "cuda", prefetch_factor=args.prefetch if nWorkers > 0 else None)
+        else:
+            if args.batch_fetch:
+                datagen = PEDataset_batch(image_dict=image_dict, bbox_dict=bbox_dict_train, image_list=image_list_train, target_size=image_size, transform=None if args.uint8_transport else TrainBatchTransform(image_size), data_dir=DATA_DIR, volume_cache=volume_cache, slice_cache=slice_cache, dicom_index=dicom_index, decoder=decoder, io_threads=args.io_threads, uint8=args.uint8_transport, timers=timers)
+            else:
+                datagen = PEDataset(image_dict=image_dict, bbox_dict=bbox_dict_train, image_list=image_list_train, target_size=image_size, transform=None if args.uint8_transport else train_transform, data_dir=DATA_DIR, volume_cache=volume_cache, slice_cache=slice_cache, dicom_index=dicom_index, decoder=decoder, io_threads=args.io_threads, uint8=args.uint8_transport, timers=timers)
+            if args.chunk_size > 0:
+                sampler = SeriesChunkSampler(datagen, chunk_size=args.chunk_size)
+            else:
+                sampler = DistributedSampler(datagen)
+            generator = DataLoader(dataset=datagen, sampler=sampler, batch_size=batch_size, num_workers=nWorkers, pin_memory=args.device.type == "cuda", prefetch_factor=args.prefetch if nWorkers > 0 else None, collate_fn=batch_collate if args.batch_fetch else None)
 
+        accumulator = GradAccumulator(model, accum_steps)
+        print("Effective batch: {} x {} GPUs x {} micro-batches = {}".format(batch_size, number_of_gpu, accum_steps, batch_size*number_of_gpu*accum_steps))
+        print("{}, warmup step {:.1f} s".format(execution.describe(), execution.warmup(model, (batch_size, 3, image_size, image_size), args.device, precision)))
 
         # print(model)
         print("Model is ready:", backboneName, _model_weight) 
         output_text_file = open(output_text_file_name, 'a')
         for ep in range(num_epoch):
+            sampler.set_epoch(ep)
             losses = AverageMeter()
             model.train()
-            for j,(images,labels) in enumerate(generator):
-                images = images.to(args.device)
+            optimizer.zero_grad()
+            wait_meter = DataWaitMeter() if args.wait_log_steps > 0 else None
+            for j,(images,labels) in enumerate(wait_meter.iterate(accumulator.iterate(generator)) if wait_meter is not None else accumulator.iterate(generator)):
+                if args.uint8_transport: # augment + normalize the uint8 batch on the GPU
+                    images = uint8_to_device(images, args.device, device_transform)
+                else:
+                    images = images.to(args.device)
+                images = execution.inputs(images)
                 labels = labels.float().to(args.device)
 
-                logits = model(images)
-                loss = criterion(logits.view(-1),labels) # was with BCEwithLogitsLoss
-                losses.update(loss.item(), images.size(0))
-
-                optimizer.zero_grad()
-                with amp.scale_loss(loss, optimizer) as scaled_loss: # was with BCEwithLogitsLoss
-                    scaled_loss.backward()
-                optimizer.step()
-                scheduler.step()
+                with accumulator.sync(j): # no DDP all-reduce until the last micro-batch of the step
+                    with precision.autocast():
+                        logits = to_float32(model(images))
+                    loss = criterion(logits.view(-1),labels) # was with BCEwithLogitsLoss
+                    losses.update(loss.item(), images.size(0))
+                    precision.backward(loss/accumulator.steps)
+                if accumulator.boundary(j):
+                    accumulator.rescale(j) # a last, shorter group: the mean over its micro-batches
+                    precision.step(optimizer)
+                    optimizer.zero_grad()
+                    scheduler.step()
 
                 train_loss = losses.avg
                 if args.local_rank == 0:
@@ -470,13 +309,29 @@ def main():
                         print('epoch: {}| step {}/{} train_loss: {}'.format(ep,j,len(generator),losses.avg), flush=True)
                     if j % 100 == 0:
                         print('epoch: {}| step {}/{} train_loss: {}'.format(ep,j,len(generator),losses.avg), flush=True)
+                        if timers is not None:
+                            print(timers.summary(), flush=True)
                     string_msg = 'epoch: {}| step {}/{} train_loss: {} \n'.format(ep,j,len(generator),losses.avg)
                     output_text_file.write(string_msg)
+                if wait_meter is not None and wait_meter.steps >= args.wait_log_steps:
+                    if args.local_rank == 0:
+                        string_msg = wait_meter.summary(args)
+                        print(string_msg, flush=True)
+                        output_text_file.write(string_msg + '\n')
+                    wait_meter.reset()
 
             if args.local_rank == 0:
                 print('epoch: {} train_loss: {}'.format(ep, losses.avg), flush=True)
                 string_msg = 'Training => loss:{}\n'.format(losses.avg)
                 output_text_file.write(string_msg)
+                if slice_cache is not None:
+                    print(slice_cache.stats_msg(), flush=True)
+                    output_text_file.write(slice_cache.stats_msg() + '\n')
+                    slice_cache.reset_stats()
+                if timers is not None:
+                    print(timers.summary(), flush=True)
+                    output_text_file.write(timers.summary() + '\n')
+                    timers.reset()
 
 
             if args.local_rank == 0:                
@@ -503,15 +358,12 @@ def main():
     ## ---------------------------- Model: Validation ---------------------------- ##    
     if val_task == 1:        
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        precision = Precision(args.val_precision, device)
+        execution = Execution(args.channels_last, args.compile)
 
         if manually_load == 1:
             # model building
-            if loadW=="ImageNet" or loadW=="Random":
-                model = transferLearningModels(backboneName, loadW)
-            else:
-                _exp_name = loadW
-                _model_weight_path = os.path.join("pretrain_model_weights", _exp_name + ".pth.tar")
-                model,_ = Classifier_model(backboneName, num_class, conv=None, weight=_model_weight_path, linear_classifier=False, sobel=False, activation=None)
+            model = build_backbone(backboneName, loadW)
 
             # checkpoint loading
             path_checkpoint = out_dir+"__"+backboneName+"__"+gwn+"_checkpoint.pth.tar"
@@ -525,6 +377,7 @@ def main():
             assert len(msg.missing_keys) == 0
             print("=> loaded checkPoint model '{}'".format(path_checkpoint))
 
+            model = execution.prepare(model)
             if torch.cuda.device_count() > 1:
                 model = torch.nn.DataParallel(model)
             model.to(device)  
@@ -545,33 +398,33 @@ def main():
     ## ---------------------------- Testing Data Loading ---------------------------- ##    
         print("Validation Testing Started")
         import pickle5 as pickle
-        with open('../process_input/split2/image_list_valid.pickle', 'rb') as f:
-            image_list_valid = pickle.load(f) 
-        with open('../lung_localization/split2/bbox_dict_valid.pickle', 'rb') as f:
-            bbox_dict_valid = pickle.load(f)
+        image_list_valid = load_pickle('../process_input/split2/image_list_valid.pickle', metadata, pickle)
+        bbox_dict_valid = load_pickle('../lung_localization/split2/bbox_dict_valid.pickle', metadata, pickle)
         if redu == 200:
-            with open('../process_input/split2/RSNA_PE_shiv/image_dict.pickle', 'rb') as f:
-                image_dict = pickle.load(f) 
-            with open('../process_input/split2/RSNA_PE_shiv/image_list_valid.pickle', 'rb') as f:
-                image_list_valid = pickle.load(f) 
-            with open('../process_input/split2/RSNA_PE_shiv/bbox_dict_valid.pickle', 'rb') as f:
-                bbox_dict_valid = pickle.load(f)
+            image_dict = load_pickle('../process_input/split2/RSNA_PE_shiv/image_dict.pickle', metadata, pickle)
+            image_list_valid = load_pickle('../process_input/split2/RSNA_PE_shiv/image_list_valid.pickle', metadata, pickle)
+            bbox_dict_valid = load_pickle('../process_input/split2/RSNA_PE_shiv/bbox_dict_valid.pickle', metadata, pickle)
 
         pred_prob = np.zeros((len(image_list_valid),),dtype=np.float32)
-        datagen = PEDataset_val(image_dict=image_dict, bbox_dict=bbox_dict_valid, image_list=image_list_valid, target_size=image_size)
-        generator = DataLoader(dataset=datagen, batch_size=batch_size, shuffle=False, num_workers=nWorkers, pin_memory=True)
+        datagen = (PEDataset_val_batch if args.batch_fetch else PEDataset_val)(image_dict=image_dict, bbox_dict=bbox_dict_valid, image_list=image_list_valid, target_size=image_size, data_dir=DATA_DIR, volume_cache=volume_cache, slice_cache=slice_cache, dicom_index=dicom_index, decoder=decoder, io_threads=args.io_threads, uint8=args.uint8_transport, val_cache_dir=args.val_cache)
+        if datagen.val_cache is not None:
+            print("Validation cache:", datagen.val_cache.image_path, datagen.val_cache.num_filled(), "/", len(datagen), "cached")
+        generator = DataLoader(dataset=datagen, batch_size=batch_size, shuffle=False, num_workers=nWorkers, pin_memory=True, collate_fn=batch_collate if args.batch_fetch else None)
 
     ## ---------------------------- Model Testing ---------------------------- ## 
+        execution.warmup(model, (batch_size, 3, image_size, image_size), device, precision, train=False)
         model.eval()
         losses = AverageMeter()
         for i, (images, labels) in tqdm(enumerate(generator), total=len(generator)):        
-            images, labels = images.float().to(device), labels.float().to(device)
+            images = execution.inputs(uint8_to_device(images, device) if args.uint8_transport else images.float().to(device))
+            labels = labels.float().to(device)
             with torch.no_grad():
                 start = i*batch_size
                 end = start+batch_size
                 if i == len(generator)-1:
                     end = len(generator.dataset)
-                logits = model(images) # sigmoid comming back should be 0-1
+                with precision.autocast():
+                    logits = to_float32(model(images)) # sigmoid comming back should be 0-1
                 loss = criterion(logits.view(-1), labels) # was with BCEwithLogitsLoss
                 losses.update(loss.item(), images.size(0))
                 pred_prob[start:end] = np.squeeze(logits.sigmoid().cpu().data.numpy()) # no need of sigmoid for BCEloss
@@ -585,6 +438,8 @@ def main():
 
         print(backboneName + "_" + gwn)
         print('loss:{}, auc:{}'.format(losses.avg, auc), flush=True)
+        if slice_cache is not None:
+            print(slice_cache.stats_msg(), flush=True)
         print()
 
         np.save(out_dir + 'groundTruth.npy', label)
@@ -0,0 +1,61 @@
+import hashlib
+import os
+
+import numpy as np
+
+# On-disk cache of the final, resized PEDataset_val images, filled by the first validation pass:
+#   <cache_dir>/val_<key>.u8      uint8 (len(image_list), target_size, target_size, 3), round(255*load_image())
+#                                 (load_image() itself with the uint8 window table)
+#   <cache_dir>/val_<key>.filled  uint8 (len(image_list),), 1 once the row is written
+# key hashes everything the images depend on: target size, window and its dtype, the bbox of every
+# sample and the image list, so a changed split or bbox_dict gets a new cache.
+
+
+def cache_key(dataset):
+    h = hashlib.sha1()
+    h.update(repr((dataset.target_size, dataset.window_lut.lower, dataset.window_lut.upper, dataset.window_lut.dtype.name)).encode())
+    h.update('\n'.join(dataset.image_list).encode())
+    series_ids = [dataset.image_dict[image_id]['series_id'] for image_id in dataset.image_list]
+    h.update(np.array([dataset.bbox_dict[s] for s in series_ids], dtype=np.int64).tobytes())
+    return h.hexdigest()[:16]
+
+def create_file(path, nbytes):
+    # the full-size (sparse) file appears atomically, so concurrent processes never map a short file
+    if os.path.exists(path):
+        return
+    tmp = path+'.tmp{}'.format(os.getpid())
+    with open(tmp, 'wb') as f:
+        f.truncate(nbytes)
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    os.remove(tmp)
+
+
+class ValCache(object):
+    """uint8 memmap of the resized validation images of one PEDataset_val"""
+    def __init__(self, cache_dir, dataset):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self.key = cache_key(dataset)
+        self.shape = (len(dataset), dataset.target_size, dataset.target_size, 3)
+        self.image_path = os.path.join(cache_dir, 'val_'+self.key+'.u8')
+        self.filled_path = os.path.join(cache_dir, 'val_'+self.key+'.filled')
+        create_file(self.image_path, int(np.prod(self.shape)))
+        create_file(self.filled_path, len(dataset))
+        self.images = None # mapped lazily, per DataLoader worker
+        self.filled = None
+    def open(self):
+        self.images = np.memmap(self.image_path, dtype=np.uint8, mode='r+', shape=self.shape)
+        self.filled = np.memmap(self.filled_path, dtype=np.uint8, mode='r+', shape=self.shape[:1])
+    def num_filled(self):
+        return int(np.fromfile(self.filled_path, dtype=np.uint8).sum())
+    def get(self, index, load):
+        if self.images is None:
+            self.open()
+        if not self.filled[index]:
+            x = load(index)
+            self.images[index] = x if x.dtype == np.uint8 else np.round(np.clip(x, 0, 1)*255.0)
+            self.filled[index] = 1
+        return np.array(self.images[index])
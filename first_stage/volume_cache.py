@@ -0,0 +1,117 @@
+import argparse
+import os
+import pickle
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+from lung_bbox import series_bbox
+from pe_dataset import DATA_DIR, read_dicom_slice
+
+# One-time conversion of the DICOM series into contiguous per-series volumes.
+#   <cache_dir>/<series_id>.npy   stored pixel values, shape (num_slices, H, W), int16
+#   <cache_dir>/index.npz         slice-offset index, sorted by image id:
+#                                 image_ids, series_index, z, slope, intercept, series_ids
+#   <cache_dir>/bbox_dict.pickle  lung_bbox.py estimate of every series, in the bbox_dict format
+
+
+def convert_series(job):
+    series_index, series_id, sorted_image_list, data_dir, cache_dir = job
+    study_id, series_uid = series_id.split('_')
+    series_dir = data_dir+study_id+'/'+series_uid+'/'
+    slices = [read_dicom_slice(series_dir+image_id+'.dcm') for image_id in sorted_image_list]
+    volume = np.stack([pixels for pixels, _, _ in slices])
+    if volume.dtype != np.int16 and volume.min() >= -32768 and volume.max() <= 32767:
+        volume = volume.astype(np.int16)
+    np.save(os.path.join(cache_dir, series_id+'.npy'), volume)
+    slope = np.array([float(s) for _, s, _ in slices], dtype=np.float64)
+    intercept = np.array([float(i) for _, _, i in slices], dtype=np.float64)
+    return series_index, sorted_image_list, slope, intercept, series_bbox(slices)
+
+def build_volume_cache(series_dict, series_list, cache_dir, data_dir=DATA_DIR, num_workers=8):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    jobs = [(k, series_id, series_dict[series_id]['sorted_image_list'], data_dir, cache_dir) for k, series_id in enumerate(series_list)]
+    image_ids, series_index, z, slope, intercept = [], [], [], [], []
+    bbox_dict = {}
+    with Pool(num_workers) as pool:
+        for k, sorted_image_list, s, i, bbox in tqdm(pool.imap_unordered(convert_series, jobs), total=len(jobs)):
+            image_ids += sorted_image_list
+            series_index.append(np.full(len(sorted_image_list), k, dtype=np.int32))
+            z.append(np.arange(len(sorted_image_list), dtype=np.int32))
+            slope.append(s)
+            intercept.append(i)
+            bbox_dict[series_list[k]] = bbox
+    with open(os.path.join(cache_dir, 'bbox_dict.pickle'), 'wb') as f:
+        pickle.dump(bbox_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
+    image_ids = np.array(image_ids, dtype='S')
+    order = np.argsort(image_ids)
+    np.savez(os.path.join(cache_dir, 'index.npz'),
+             image_ids=image_ids[order],
+             series_index=np.concatenate(series_index)[order],
+             z=np.concatenate(z)[order],
+             slope=np.concatenate(slope)[order],
+             intercept=np.concatenate(intercept)[order],
+             series_ids=np.array(series_list, dtype='S'))
+
+
+class VolumeCache(object):
+    """Reads slices from the volumes written by build_volume_cache as np.memmap views"""
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        index = np.load(os.path.join(cache_dir, 'index.npz'))
+        self.image_ids = index['image_ids']
+        self.series_index = index['series_index']
+        self.z = index['z']
+        self.slope = index['slope']
+        self.intercept = index['intercept']
+        self.series_ids = [s.decode() for s in index['series_ids']]
+        self.volumes = {} # opened lazily, per DataLoader worker
+    def row(self, image_id):
+        row = np.searchsorted(self.image_ids, image_id.encode())
+        if row == len(self.image_ids) or self.image_ids[row] != image_id.encode():
+            raise KeyError(image_id)
+        return row
+    def volume(self, series_index):
+        if series_index not in self.volumes:
+            path = os.path.join(self.cache_dir, self.series_ids[series_index]+'.npy')
+            self.volumes[series_index] = np.load(path, mmap_mode='r')
+        return self.volumes[series_index]
+    def read_slice(self, image_id):
+        row = self.row(image_id)
+        return self.volume(self.series_index[row])[self.z[row]], self.slope[row], self.intercept[row]
+    def read_triplet(self, image_minus1, image_id, image_plus1):
+        rows = [self.row(image_minus1), self.row(image_id), self.row(image_plus1)]
+        volume = self.volume(self.series_index[rows[1]])
+        z = self.z[rows]
+        if z[0]+1 == z[1] == z[2]-1:
+            triplet = volume[z[0]:z[2]+1] # zero-copy, one contiguous read
+        else:
+            triplet = volume[z] # first/last slice of the series is its own neighbour
+        return [(triplet[k], self.slope[rows[k]], self.intercept[rows[k]]) for k in range(3)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--series_dict", type=str, default="../process_input/split2/series_dict.pickle", help="series_dict with sorted_image_list")
+    parser.add_argument("--bbox_dict", type=str, nargs='+', default=["../lung_localization/split2/bbox_dict_train.pickle", "../lung_localization/split2/bbox_dict_valid.pickle"], help="series to convert")
+    parser.add_argument("--data_dir", type=str, default=DATA_DIR, help="RSNA PE train directory")
+    parser.add_argument("--cache_dir", type=str, default="../process_input/split2/volume_cache/", help="output directory")
+    parser.add_argument("--worker", type=int, default=12, help="Number of workers")
+    args = parser.parse_args()
+
+    with open(args.series_dict, 'rb') as f:
+        series_dict = pickle.load(f)
+    series_list = set()
+    for path in args.bbox_dict:
+        with open(path, 'rb') as f:
+            series_list.update(pickle.load(f).keys())
+    series_list = sorted(series_list)
+    print("Series to convert:", len(series_list))
+    build_volume_cache(series_dict, series_list, args.cache_dir, data_dir=args.data_dir, num_workers=args.worker)
+    print("Volume cache written to", args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
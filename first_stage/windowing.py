@@ -0,0 +1,87 @@
+import numpy as np
+
+# dtype policy of the stage-1 preprocessing: everything from rescale to the model input is float32
+# or narrower (uint8/float16 transport); only the one-off 65536-entry tables are built in float64
+NARROW_DTYPES = ('uint8', 'float16', 'bfloat16', 'float32')
+
+
+class WindowLUT(object):
+    """Lookup-table version of window(): stored 16-bit pixels -> windowed values in one gather.
+
+    window() clips the rescaled slice to [WL-WW//2, WL+WW//2] and stretches it by the
+    min/max of the clipped slice. Rescale and clip are monotonic in the stored value, so
+    those min/max are the clipped values of the slice's min/max stored pixels, and the
+    whole pipeline (slope, intercept, clip, stretch) folds into one 65536-entry table.
+    """
+    def __init__(self, WL=100, WW=700, dtype=np.float32, max_tables=64):
+        self.upper, self.lower = WL+WW//2, WL-WW//2
+        self.dtype = np.dtype(dtype) # float32, or uint8 for round(255*window())
+        self.max_tables = max_tables
+        self.tables = {}
+    def clipped(self, signed, slope, intercept):
+        # float64 like x*data.RescaleSlope+data.RescaleIntercept
+        stored = np.arange(65536, dtype=np.uint16)
+        if signed:
+            stored = stored.view(np.int16)
+        return np.clip(stored*slope+intercept, self.lower, self.upper)
+    def table(self, signed, slope, intercept, pmin, pmax):
+        # slices of a series nearly always hit the clip range at both ends, so the key repeats
+        slope, intercept = float(slope), float(intercept)
+        lo, hi = sorted(np.clip([pmin*slope+intercept, pmax*slope+intercept], self.lower, self.upper))
+        key = (signed, slope, intercept, lo, hi)
+        if key not in self.tables:
+            if len(self.tables) >= self.max_tables:
+                self.tables.clear()
+            with np.errstate(invalid='ignore', divide='ignore'): # constant slice => nan, as window()
+                table = (self.clipped(signed, slope, intercept)-lo)/(hi-lo)
+            if self.dtype == np.uint8:
+                table = np.round(table*255.0)
+            self.tables[key] = table.astype(self.dtype)
+        return self.tables[key]
+    def __call__(self, pixels, slope, intercept, out=None, bbox=None):
+        # bbox = [x0, y0, x1, y1] crops before the lookup; the stretch still uses the whole slice
+        crop = bbox_crop(bbox)
+        if pixels.dtype == np.int16:
+            index = pixels.view(np.uint16)
+        elif pixels.dtype == np.uint16:
+            index = pixels
+        else: # not a 16-bit stored value array
+            index = None
+        if out is None:
+            out = np.empty(pixels[crop].shape, dtype=self.dtype)
+        if index is None:
+            x = pixels.astype(np.float32)*np.float32(slope)+np.float32(intercept) # not pixels*slope, which is float64
+            x = window(x, WL=(self.upper+self.lower)//2, WW=self.upper-self.lower)[crop]
+            out[...] = np.round(x*255.0) if self.dtype == np.uint8 else x
+            return out
+        table = self.table(pixels.dtype == np.int16, slope, intercept, pixels.min(), pixels.max())
+        np.take(table, index[crop], out=out, mode='clip')
+        return out
+    def window_triplet(self, slices, out=None, bbox=None):
+        # [(pixels, slope, intercept)] x 3 -> HxWx3 (or the bbox crop of it), written channel by channel into out
+        if out is None:
+            out = np.empty(slices[0][0][bbox_crop(bbox)].shape+(3,), dtype=self.dtype)
+        for k, (pixels, slope, intercept) in enumerate(slices):
+            self(pixels, slope, intercept, out=out[:, :, k], bbox=bbox)
+        return out
+
+
+def check_dtype(x, stage):
+    # numpy array or torch tensor; a float64 output means something upcast silently
+    if str(x.dtype).replace('torch.', '') not in NARROW_DTYPES:
+        raise TypeError('{} produced {}, the preprocessing runs in float32 or narrower'.format(stage, x.dtype))
+    return x
+
+def bbox_crop(bbox):
+    # bbox_dict format [x0, y0, x1, y1] -> index of x[bbox[1]:bbox[3],bbox[0]:bbox[2]]
+    if bbox is None:
+        return (slice(None), slice(None))
+    return (slice(bbox[1], bbox[3]), slice(bbox[0], bbox[2]))
+
+def window(img, WL=50, WW=350):
+    upper, lower = WL+WW//2, WL-WW//2 # 400 to -300
+    X = np.clip(img.copy(), lower, upper)
+    X = X - np.min(X)
+    X = X / np.max(X)
+    # X = (X*255.0).astype('uint8')
+    return X
@@ -151,6 +151,10 @@ class Xception(nn.Module):
 
         self.fc = nn.Linear(2048, num_classes)
 
+        # checkpointing.set_checkpointing: runs block1-block12 (with their SE modules after
+        # convert_to_SE_Xception) with activation checkpointing while gradients are enabled
+        self.checkpoint_blocks = None
+
         # #------- init weights --------
         # for m in self.modules():
         #     if isinstance(m, nn.Conv2d):
@@ -170,18 +174,22 @@ class Xception(nn.Module):
         x = self.bn2(x)
         x = self.relu2(x)
 
-        x = self.block1(x)
-        x = self.block2(x)
-        x = self.block3(x)
-        x = self.block4(x)
-        x = self.block5(x)
-        x = self.block6(x)
-        x = self.block7(x)
-        x = self.block8(x)
-        x = self.block9(x)
-        x = self.block10(x)
-        x = self.block11(x)
-        x = self.block12(x)
+        if self.checkpoint_blocks is not None and torch.is_grad_enabled():
+            x = self.checkpoint_blocks([self.block1, self.block2, self.block3, self.block4, self.block5, self.block6,
+                                        self.block7, self.block8, self.block9, self.block10, self.block11, self.block12], x)
+        else:
+            x = self.block1(x)
+            x = self.block2(x)
+            x = self.block3(x)
+            x = self.block4(x)
+            x = self.block5(x)
+            x = self.block6(x)
+            x = self.block7(x)
+            x = self.block8(x)
+            x = self.block9(x)
+            x = self.block10(x)
+            x = self.block11(x)
+            x = self.block12(x)
 
         x = self.conv3(x)
         x = self.bn3(x)
@@ -12,8 +12,11 @@ import torchvision.models
 from torchvision import transforms
 from torch.utils.data import Dataset, DataLoader
 import torch
-from apex import amp
 from random import randrange
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'first_stage'))
+from metadata_store import MetadataStore, load_pickle
+from precision import Precision, PRECISIONS, to_float32
 from sklearn.metrics import roc_auc_score, log_loss
 numSeed = randrange(2500)
 
@@ -151,6 +154,8 @@ parser.add_argument("--backboneName", type=str, default="resnet18", help="resnet
 parser.add_argument("--runV", type=str, default="version_1", help="model load during val or not")
 parser.add_argument("--featureMode", type=int, default=1, help="fine tuned or non-fine tuned")
 parser.add_argument("--ssl_method_name", type=str, default=" ", help="SSL method name")
+parser.add_argument("--metadata_store", type=str, default="", help="metadata_store.py output directory | empty: read the pickles")
+parser.add_argument("--precision", type=str, default="fp16", choices=PRECISIONS, help="fp16: autocast + loss scaling (was apex amp O1) | bf16: autocast, no scaling | fp32")
 args = parser.parse_args()
 backboneName = args.backboneName
 runV = args.runV
@@ -159,18 +164,13 @@ ssl_method_name = args.ssl_method_name
 
 
 # prepare input
-with open('../process_input/split2/series_list_train.pickle', 'rb') as f:
-    series_list_train = pickle.load(f)
-with open('../process_input/split2/series_list_valid.pickle', 'rb') as f:
-    series_list_valid = pickle.load(f) 
-with open('../process_input/split2/image_list_train.pickle', 'rb') as f:
-    image_list_train = pickle.load(f)
-with open('../process_input/split2/image_list_valid.pickle', 'rb') as f:
-    image_list_valid = pickle.load(f) 
-with open('../process_input/split2/image_dict.pickle', 'rb') as f:
-    image_dict = pickle.load(f) 
-with open('../process_input/split2/series_dict.pickle', 'rb') as f:
-    series_dict = pickle.load(f)
+metadata = MetadataStore(args.metadata_store) if args.metadata_store else None
+series_list_train = load_pickle('../process_input/split2/series_list_train.pickle', metadata, pickle)
+series_list_valid = load_pickle('../process_input/split2/series_list_valid.pickle', metadata, pickle)
+image_list_train = load_pickle('../process_input/split2/image_list_train.pickle', metadata, pickle)
+image_list_valid = load_pickle('../process_input/split2/image_list_valid.pickle', metadata, pickle)
+image_dict = load_pickle('../process_input/split2/image_dict.pickle', metadata, pickle)
+series_dict = load_pickle('../process_input/split2/series_dict.pickle', metadata, pickle)
 
 
 ## Loading Features
@@ -369,7 +369,7 @@ model = PENet(input_len=feature_size, lstm_size=lstm_size)
 model = model.cuda()
 optimizer = optim.Adam(model.parameters(), lr=learning_rate)
 scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=1, gamma=0.8)
-model, optimizer = amp.initialize(model, optimizer, opt_level="O1",verbosity=0)
+precision = Precision(args.precision, 'cuda')
 criterion = nn.BCEWithLogitsLoss(reduction='none').cuda()
 criterion1 = nn.BCEWithLogitsLoss().cuda()
 
@@ -450,7 +450,8 @@ for ep in tqdm(range(num_epoch)):
         y_lt = y_lt.float().cuda()
         y_chronic = y_chronic.float().cuda()
         y_acute_and_chronic = y_acute_and_chronic.float().cuda()
-        logits_pe, logits_npe, logits_idt, logits_lpe, logits_rpe, logits_cpe, logits_gte, logits_lt, logits_chronic, logits_acute_and_chronic = model(x, mask)
+        with precision.autocast():
+            logits_pe, logits_npe, logits_idt, logits_lpe, logits_rpe, logits_cpe, logits_gte, logits_lt, logits_chronic, logits_acute_and_chronic = to_float32(model(x, mask))
         loss_pe = criterion(logits_pe.squeeze(),y_pe)
         loss_pe = loss_pe*mask*loss_weights_pe
         loss_pe = loss_pe.sum()/mask.sum()
@@ -476,9 +477,8 @@ for ep in tqdm(range(num_epoch)):
         loss = loss_pe + loss_npe + loss_idt + loss_lpe + loss_rpe + loss_cpe + loss_gte + loss_lt + loss_chronic + loss_acute_and_chronic
 
         optimizer.zero_grad()
-        with amp.scale_loss(loss, optimizer) as scaled_loss:
-            scaled_loss.backward()
-        optimizer.step()
+        precision.backward(loss)
+        precision.step(optimizer)
 
     scheduler.step()
 
@@ -569,7 +569,8 @@ for ep in tqdm(range(num_epoch)):
             y_chronic = y_chronic.float().cuda()
             y_acute_and_chronic = y_acute_and_chronic.float().cuda()
 
-            logits_pe, logits_npe, logits_idt, logits_lpe, logits_rpe, logits_cpe, logits_gte, logits_lt, logits_chronic, logits_acute_and_chronic = model(x, mask)
+            with precision.autocast():
+                logits_pe, logits_npe, logits_idt, logits_lpe, logits_rpe, logits_cpe, logits_gte, logits_lt, logits_chronic, logits_acute_and_chronic = to_float32(model(x, mask))
             
             loss_pe = criterion(logits_pe.squeeze(),y_pe)
             loss_pe = loss_pe*mask*loss_weights_pe
@@ -17,11 +17,11 @@ from models_vit.modeling_exp import VisionTransformer
 from models_vit.modeling_exp import CONFIGS as CONFIGS_model_name
 import pandas as pd
 import csv 
-try:
-    from apex import amp
-except:
-    check=1
 from random import randrange
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'first_stage'))
+from metadata_store import MetadataStore, load_pickle
+from precision import Precision, PRECISIONS, to_float32
 from sklearn.metrics import roc_auc_score, log_loss
 from modules_settransformer import ISAB, PMA, SAB
 
@@ -322,6 +322,8 @@ parser.add_argument("--backboneName", type=str, default="resnet18", help="resnet
 parser.add_argument("--runV", type=str, default="version_1", help="model load during val or not")
 parser.add_argument("--featureMode", type=int, default=1, help="fine tuned or non-fine tuned")
 parser.add_argument("--ssl_method_name", type=str, default=" ", help="fine tuned or non-fine tuned")
+parser.add_argument("--metadata_store", type=str, default="", help="metadata_store.py output directory | empty: read the pickles")
+parser.add_argument("--precision", type=str, default="fp16", choices=PRECISIONS, help="fp16: autocast + loss scaling (was apex amp O1) | bf16: autocast, no scaling | fp32")
 
 parser.add_argument("--LR", type=float, default=0.001)
 parser.add_argument("--BS", type=int, default=32)
@@ -346,18 +348,13 @@ featureMode = args.featureMode
 ssl_method_name = args.ssl_method_name
 
 # prepare input
-with open('../process_input/split2/series_list_train.pickle', 'rb') as f:
-    series_list_train = pickle.load(f)
-with open('../process_input/split2/series_list_valid.pickle', 'rb') as f:
-    series_list_valid = pickle.load(f) 
-with open('../process_input/split2/image_list_train.pickle', 'rb') as f:
-    image_list_train = pickle.load(f)
-with open('../process_input/split2/image_list_valid.pickle', 'rb') as f:
-    image_list_valid = pickle.load(f) 
-with open('../process_input/split2/image_dict.pickle', 'rb') as f:
-    image_dict = pickle.load(f) 
-with open('../process_input/split2/series_dict.pickle', 'rb') as f:
-    series_dict = pickle.load(f)
+metadata = MetadataStore(args.metadata_store) if args.metadata_store else None
+series_list_train = load_pickle('../process_input/split2/series_list_train.pickle', metadata, pickle)
+series_list_valid = load_pickle('../process_input/split2/series_list_valid.pickle', metadata, pickle)
+image_list_train = load_pickle('../process_input/split2/image_list_train.pickle', metadata, pickle)
+image_list_valid = load_pickle('../process_input/split2/image_list_valid.pickle', metadata, pickle)
+image_dict = load_pickle('../process_input/split2/image_dict.pickle', metadata, pickle)
+series_dict = load_pickle('../process_input/split2/series_dict.pickle', metadata, pickle)
 
 
 ## Loading Features
@@ -1142,7 +1139,7 @@ elif args.optChoice == "SGD": # good one
     optimizer = optim.SGD(model.parameters(), lr=learning_rate, weight_decay=0, momentum=0.9, nesterov=False)
 # scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=5, gamma=0.1) # was active # optim.lr_scheduler.StepLR(optimizer, step_size=1, gamma=0.8)
 scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', factor=0.1, patience=10)
-model, optimizer = amp.initialize(model, optimizer, opt_level="O1",verbosity=0)
+precision = Precision(args.precision, 'cuda')
 criterion = nn.BCEWithLogitsLoss(reduction='none').cuda()
 # criterion1 = nn.BCEWithLogitsLoss().cuda()
 criterion1 = ComulativeBCELoss().cuda()
@@ -1250,7 +1247,8 @@ for ep in tqdm(range(1, num_epoch + 1)):
         y_chronic = y_chronic.type(torch.DoubleTensor).cuda()
         y_acute_and_chronic = y_acute_and_chronic.type(torch.DoubleTensor).cuda()
 
-        logits_6144SLICE, logits_pe, logits_npe, logits_idt, logits_lpe, logits_rpe, logits_cpe, logits_gte, logits_lt, logits_chronic, logits_acute_and_chronic = model(x, mask)         
+        with precision.autocast():
+            logits_6144SLICE, logits_pe, logits_npe, logits_idt, logits_lpe, logits_rpe, logits_cpe, logits_gte, logits_lt, logits_chronic, logits_acute_and_chronic = to_float32(model(x, mask))
         # logits_npe, logits_idt, logits_lpe, logits_rpe, logits_cpe, logits_gte, logits_lt, logits_chronic, logits_acute_and_chronic = model(x, mask)
         
 
@@ -1292,9 +1290,8 @@ for ep in tqdm(range(1, num_epoch + 1)):
             loss = loss - loss_pe # extraNahid - excluding loss_pe: maybe have a bad effect on the model for other AUCs
         avg_loss_count.append(loss.item())
         optimizer.zero_grad()
-        with amp.scale_loss(loss, optimizer) as scaled_loss:
-            scaled_loss.backward()
-        optimizer.step()
+        precision.backward(loss)
+        precision.step(optimizer)
 
     scheduler.step(sum(avg_loss_count)/len(avg_loss_count)) # for scheduler reduceLRonrPla # loss should be the avg loss of an epoch
 
@@ -1387,7 +1384,8 @@ for ep in tqdm(range(1, num_epoch + 1)):
             y_chronic = y_chronic.type(torch.DoubleTensor).cuda()
             y_acute_and_chronic = y_acute_and_chronic.type(torch.DoubleTensor).cuda()
 
-            logits_6144SLICE, logits_pe, logits_npe, logits_idt, logits_lpe, logits_rpe, logits_cpe, logits_gte, logits_lt, logits_chronic, logits_acute_and_chronic = model(x, mask)
+            with precision.autocast():
+                logits_6144SLICE, logits_pe, logits_npe, logits_idt, logits_lpe, logits_rpe, logits_cpe, logits_gte, logits_lt, logits_chronic, logits_acute_and_chronic = to_float32(model(x, mask))
             # logits_npe, logits_idt, logits_lpe, logits_rpe, logits_cpe, logits_gte, logits_lt, logits_chronic, logits_acute_and_chronic = model(x, mask)
 
             # loss_pe = criterion1(logits_pe[0].squeeze(), logits_pe[1].squeeze(),y_pe) # was active 29th Sept 2022